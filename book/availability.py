@@ -0,0 +1,51 @@
+"""
+Daily free copies of a book over a date range.
+
+Copies on the shelf are free on every day of the range. A copy out on an
+active borrowing is free again from its expected return date. Overdue
+copies have no date to come back on, so they are counted as out for the
+whole range.
+
+One range query over the active borrowings index gives the number of
+copies due back on each day. A difference array and a running sum turn
+those into daily free copies in O(borrowings + days).
+"""
+
+from datetime import date, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+
+AVAILABILITY_DAYS = 90
+AVAILABILITY_MAX_DAYS = 366
+
+
+def daily_free_copies(book: Book, start: date, end: date) -> list[dict]:
+    """
+    Free copies of the book on each day from `start` to `end`, both
+    included. `start` must not be in the past.
+    """
+    days = (end - start).days + 1
+    returns = [0] * days
+    due_back = (
+        Borrowing.objects.filter(
+            book=book,
+            actual_return_date__isnull=True,
+            expected_return_date__gte=timezone.localdate(),
+            expected_return_date__lte=end,
+        )
+        .values_list("expected_return_date")
+        .annotate(copies=Count("id"))
+        .order_by()
+    )
+    for return_date, copies in due_back:
+        returns[max((return_date - start).days, 0)] += copies
+    free = book.inventory
+    calendar = []
+    for offset in range(days):
+        free += returns[offset]
+        calendar.append({"date": start + timedelta(days=offset), "free": free})
+    return calendar
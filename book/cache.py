@@ -0,0 +1,91 @@
+"""
+Versioned cache for catalog reads.
+
+Every book has a version key and the catalog as a whole has one more.
+Cached list pages embed the catalog version in their key and cached books
+embed their own version, so bumping a version makes the old entries
+unreachable without having to find and delete them.
+"""
+
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_TIMEOUT = 300
+CATALOG_VERSION_KEY = "book:catalog:version"
+
+
+def _book_version_key(book_id: int) -> str:
+    return f"book:{book_id}:version"
+
+
+def _get_version(key: str) -> int:
+    version = cache.get(key)
+    if version is None:
+        # A fresh timestamp rather than 1, so a version key that was
+        # evicted can not point back at entries cached before eviction.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def list_key(query_string: str) -> str:
+    return f"book:list:{_get_version(CATALOG_VERSION_KEY)}:{query_string}"
+
+
+def detail_key(book_id: int) -> str:
+    return f"book:{book_id}:{_get_version(_book_version_key(book_id))}"
+
+
+def availability_key(book_id: int, today, start, end) -> str:
+    version = _get_version(_book_version_key(book_id))
+    return f"book:{book_id}:availability:{version}:{today}:{start}:{end}"
+
+
+def get_or_set(make_key, build):
+    """
+    Return the cached value for the key built by make_key(), or build it
+    and cache it. The cache is an optimisation only: if it is unavailable
+    the value is built from the database.
+    """
+    try:
+        key = make_key()
+        data = cache.get(key)
+    except Exception as error:
+        logger.warning("Catalog cache is unavailable: %s", error)
+        return build()
+    if data is None:
+        data = build()
+        try:
+            cache.set(key, data, CATALOG_CACHE_TIMEOUT)
+        except Exception as error:
+            logger.warning("Catalog cache is unavailable: %s", error)
+    return data
+
+
+def invalidate_books(*book_ids: int) -> None:
+    """
+    Drop cached pages and cached copies of the given books once the
+    current transaction commits.
+    """
+
+    def bump():
+        try:
+            for book_id in book_ids:
+                _bump_version(_book_version_key(book_id))
+            _bump_version(CATALOG_VERSION_KEY)
+        except Exception as error:
+            logger.warning("Catalog cache invalidation failed: %s", error)
+
+    transaction.on_commit(bump)
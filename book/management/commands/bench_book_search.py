@@ -0,0 +1,141 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from rest_framework.test import APIRequestFactory
+
+from book.models import Book
+from book.views import BookSearchAPIView
+
+WORDS = [
+    "shadow",
+    "river",
+    "garden",
+    "winter",
+    "forgotten",
+    "silver",
+    "mountain",
+    "tiger",
+    "letters",
+    "night",
+    "kingdom",
+    "island",
+    "journey",
+    "stone",
+    "memory",
+    "fire",
+    "ocean",
+    "city",
+    "secret",
+    "dream",
+    "war",
+    "peace",
+    "house",
+    "storm",
+    "forest",
+    "queen",
+    "road",
+    "glass",
+    "summer",
+    "bridge",
+]
+NAMES = [
+    "Ivan",
+    "Olena",
+    "Taras",
+    "Lesya",
+    "Mykola",
+    "Maria",
+    "Petro",
+    "Oksana",
+    "Franko",
+    "Shevchenko",
+    "Kotsiubynsky",
+    "Ukrainka",
+    "Bahrianyi",
+    "Stefanyk",
+    "Kobylianska",
+    "Tychyna",
+]
+QUERIES = [
+    "river",
+    "silver tiger",
+    "forgotten kingdom winter",
+    "shevchenko",
+    "olena ukrainka",
+    "glas bridge",
+    "kotsubynsky",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic catalog and reports p50/p95 latency of "
+        "/books/search/ for a mix of exact and misspelled queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=100_000)
+        parser.add_argument("--repeats", type=int, default=50)
+
+    def handle(self, *args, **options):
+        first_id = (Book.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        started = time.perf_counter()
+        self.seed(options["books"])
+        self.stdout.write(
+            f"seeded {options['books']} books in "
+            f"{time.perf_counter() - started:.1f} s"
+        )
+        factory = APIRequestFactory()
+        view = BookSearchAPIView.as_view()
+        try:
+            for query in QUERIES:
+                timings = []
+                for _ in range(options["repeats"]):
+                    request = factory.get(
+                        "/books/search/", {"q": query}, SERVER_NAME="localhost"
+                    )
+                    started = time.perf_counter()
+                    response = view(request)
+                    response.render()
+                    timings.append((time.perf_counter() - started) * 1000)
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                self.stdout.write(
+                    f"{query!r:<28} hits {response.data['count']:>8}  "
+                    f"p50 {statistics.median(timings):7.2f} ms  "
+                    f"p95 {p95:7.2f} ms"
+                )
+        finally:
+            Book.objects.filter(id__gte=first_id).delete()
+
+    @staticmethod
+    def seed(count):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Book._meta.db_table}
+                    (title, author, cover, inventory, daily_fee)
+                SELECT
+                    initcap(concat_ws(' ',
+                        (%(words)s::text[])[1 + i %% %(w)s],
+                        (%(words)s::text[])[1 + (i / %(w)s) %% %(w)s],
+                        (%(words)s::text[])[1 + (i / 7) %% %(w)s])),
+                    concat_ws(' ',
+                        (%(names)s::text[])[1 + i %% %(n)s],
+                        (%(names)s::text[])[1 + (i / %(n)s) %% %(n)s]),
+                    'soft',
+                    i %% 5,
+                    1 + i %% 9
+                FROM generate_series(1, %(count)s) AS i
+                """,
+                {
+                    "words": WORDS,
+                    "w": len(WORDS),
+                    "names": NAMES,
+                    "n": len(NAMES),
+                    "count": count,
+                },
+            )
+            cursor.execute(f"VACUUM ANALYZE {Book._meta.db_table}")
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2025-03-07 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="Book",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("title", models.CharField(max_length=100)),
+                ("author", models.CharField(max_length=100)),
+                (
+                    "cover",
+                    models.CharField(
+                        choices=[("hard", "Hardcover"), ("soft", "Softcover")],
+                        max_length=5,
+                    ),
+                ),
+                ("inventory", models.PositiveIntegerField()),
+                (
+                    "daily_fee",
+                    models.DecimalField(decimal_places=2, max_digits=4),
+                ),
+            ],
+        ),
+    ]
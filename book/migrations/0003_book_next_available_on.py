@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0002_book_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="next_available_on",
+            field=models.DateField(editable=False, null=True),
+        ),
+    ]
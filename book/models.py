@@ -1,4 +1,178 @@
+from django.apps import apps
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
 from django.db import models
+from django.db.models import (
+    Case,
+    F,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from book.cache import invalidate_books
+
+SEARCH_CONFIG = "simple"
+SEARCH_CANDIDATES = 1000
+
+
+class BookManager(models.Manager):
+    """Inventory updates in single SQL statements and catalog search."""
+
+    def reserve(self, book_id: int) -> bool:
+        """
+        Take one copy of the book if there is one left.
+
+        The availability check and the decrement are a single conditional
+        UPDATE, so concurrent borrowers can never drive inventory below zero.
+        Returns True if a copy was reserved.
+        """
+        reserved = bool(
+            self.filter(pk=book_id, inventory__gt=0).update(
+                inventory=F("inventory") - 1
+            )
+        )
+        if reserved:
+            invalidate_books(book_id)
+        return reserved
+
+    def release(self, book_id: int, copies: int = 1) -> None:
+        """Put returned copies of the book back into inventory."""
+        self.filter(pk=book_id).update(inventory=F("inventory") + copies)
+        invalidate_books(book_id)
+
+    def release_many(self, copies: dict[int, int]) -> None:
+        """
+        Put copies of several books back in one UPDATE.
+        `copies` maps book ids to the number of copies.
+        """
+        if not copies:
+            return
+        self.filter(pk__in=copies).update(
+            inventory=F("inventory")
+            + Case(
+                *(
+                    When(pk=book_id, then=Value(count))
+                    for book_id, count in copies.items()
+                ),
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+        invalidate_books(*copies)
+
+    def reserve_many(self, book_ids) -> list[int]:
+        """
+        Take one copy of each book, all or nothing. The book rows are
+        locked in id order, so concurrent carts sharing books queue up
+        instead of deadlocking, and one UPDATE takes the copies. Returns
+        the ids of the books that are missing or out of stock, in which
+        case nothing is reserved. Must run inside a transaction.
+        """
+        book_ids = sorted(set(book_ids))
+        in_stock = set(
+            self.select_for_update()
+            .filter(pk__in=book_ids, inventory__gt=0)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        unavailable = [pk for pk in book_ids if pk not in in_stock]
+        if unavailable or not book_ids:
+            return unavailable
+        self.filter(pk__in=book_ids).update(inventory=F("inventory") - 1)
+        invalidate_books(*book_ids)
+        return []
+
+    def borrowed_until(self, book_ids, return_date) -> None:
+        """
+        Record new borrowings of the books due back on `return_date`: the
+        next available date of each moves to it if that is sooner, but
+        not into the past.
+        """
+        book_ids = list(book_ids)
+        self.filter(pk__in=book_ids).update(
+            next_available_on=Greatest(
+                Least(
+                    Coalesce("next_available_on", Value(return_date)),
+                    Value(return_date),
+                ),
+                Value(timezone.localdate()),
+            )
+        )
+        invalidate_books(*book_ids)
+
+    def refresh_next_available(self, book_ids) -> None:
+        """
+        Recompute the next available date of the books from their active
+        borrowings, after some of them were returned or cancelled. Each
+        book costs one lookup in the active borrowings index. Overdue
+        borrowings are expected back today at the earliest.
+        """
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        borrowing = apps.get_model("borrowing", "Borrowing")
+        self.filter(pk__in=book_ids).update(
+            next_available_on=Subquery(
+                borrowing.objects.filter(
+                    book=OuterRef("pk"), actual_return_date__isnull=True
+                )
+                .values("book")
+                .annotate(
+                    earliest=Greatest(
+                        Min("expected_return_date"),
+                        Value(timezone.localdate()),
+                    )
+                )
+                .values("earliest")
+            )
+        )
+        invalidate_books(*book_ids)
+
+    def search(self, text: str) -> models.QuerySet:
+        """
+        Rank books by full-text match on title and author.
+
+        Falls back to trigram word similarity when nothing matches, so
+        misspelled queries still find the book. Results stop at the
+        SEARCH_CANDIDATES best matches, so very common words do not page
+        through the whole table. The candidates are picked by rank with
+        the id as tie-breaker, which keeps the best matches on page one
+        and the pages stable between calls.
+        """
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type="websearch"
+        )
+        candidates = self.filter(search_vector=query)
+        rank = SearchRank(F("search_vector"), query)
+        if not candidates.exists():
+            candidates = self.filter(
+                Q(title__trigram_word_similar=text)
+                | Q(author__trigram_word_similar=text)
+            )
+            rank = Greatest(
+                TrigramWordSimilarity(text, "title"),
+                TrigramWordSimilarity(text, "author"),
+            )
+        best = (
+            candidates.annotate(rank=rank)
+            .order_by("-rank", "id")
+            .values("id")[:SEARCH_CANDIDATES]
+        )
+        return (
+            self.filter(id__in=best)
+            .annotate(rank=rank)
+            .order_by("-rank", "id")
+        )
 
 
 class Book(models.Model):
@@ -14,8 +188,40 @@ class Book(models.Model):
     )
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=4, decimal_places=2)
+    # Earliest expected return of an active borrowing, kept up to date in
+    # the borrow and return transactions.
+    next_available_on = models.DateField(null=True, editable=False)
+    # Maintained by the book_search_vector_trigger database trigger.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BookManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            GinIndex(
+                fields=["title"],
+                name="book_title_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(
+                fields=["author"],
+                name="book_author_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
 
     def __str__(self):
         return (
             f"{self.title}, (author {self.author}) daily fee: {self.daily_fee}"
         )
+
+    @property
+    def available_from(self):
+        """
+        next_available_on, moved up to today once the borrowing it came
+        from is overdue.
+        """
+        if self.next_available_on is None:
+            return None
+        return max(self.next_available_on, timezone.localdate())
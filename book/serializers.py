@@ -4,6 +4,18 @@ from book.models import Book
 
 
 class BookSerializer(serializers.ModelSerializer):
+    next_available_on = serializers.DateField(
+        source="available_from", read_only=True
+    )
+
     class Meta:
         model = Book
-        fields = ("id", "title", "author", "cover", "inventory", "daily_fee")
+        fields = (
+            "id",
+            "title",
+            "author",
+            "cover",
+            "inventory",
+            "daily_fee",
+            "next_available_on",
+        )
@@ -1,5 +1,9 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework.reverse import reverse
@@ -7,10 +11,21 @@ from rest_framework import status
 
 from book.models import Book
 from book.serializers import BookSerializer
+from borrowing.models import Borrowing
+from books_rent_config.testing import QueryBudgetMixin
 
 BOOK_URL = reverse("book:book-list")
 
 
+# The catalog cache is only invalidated on commit, which TestCase never
+# does, so tests that do not exercise the cache bypass it.
+WITHOUT_CACHE = override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    }
+)
+
+
 def sample_book(**params):
     """Create a sample book."""
     defaults = {
@@ -24,6 +39,7 @@ def sample_book(**params):
     return Book.objects.create(**defaults)
 
 
+@WITHOUT_CACHE
 class Unauthenticated(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -56,6 +72,7 @@ class Unauthenticated(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+@WITHOUT_CACHE
 class Authenticated(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -92,6 +109,7 @@ class Authenticated(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+@WITHOUT_CACHE
 class Is_Staff_user(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -133,3 +151,201 @@ class Is_Staff_user(TestCase):
         sample_book()
         response = self.client.get(BOOK_URL + "1/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+BOOK_SEARCH_URL = reverse("book:book-search")
+
+
+class Search(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.kobzar = sample_book(title="Kobzar", author="Taras Shevchenko")
+        self.garden = sample_book(
+            title="The Garden of Gethsemane", author="Ivan Bahrianyi"
+        )
+        self.tiger = sample_book(
+            title="Tiger Trappers", author="Ivan Bahrianyi"
+        )
+
+    def test_search_by_title_and_author(self):
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "kobzar"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"], [BookSerializer(self.kobzar).data]
+        )
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "bahrianyi"})
+        self.assertEqual(response.data["count"], 2)
+
+    def test_title_match_ranks_above_author_match(self):
+        sample_book(title="Shevchenko", author="unknown")
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "shevchenko"})
+        titles = [book["title"] for book in response.data["results"]]
+        self.assertEqual(titles, ["Shevchenko", "Kobzar"])
+
+    def test_misspelled_query_falls_back_to_similarity(self):
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "Getsemane"})
+        self.assertEqual(
+            response.data["results"], [BookSerializer(self.garden).data]
+        )
+
+    @mock.patch("book.models.SEARCH_CANDIDATES", 2)
+    def test_candidates_are_the_best_matches(self):
+        Book.objects.bulk_create(
+            Book(
+                title=f"Filler {i}",
+                author="Shevchenko",
+                cover="soft",
+                inventory=1,
+                daily_fee=1,
+            )
+            for i in range(5)
+        )
+        best = sample_book(title="Shevchenko", author="unknown")
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "shevchenko"})
+        results = response.data["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["id"], best.id)
+        again = self.client.get(BOOK_SEARCH_URL, {"q": "shevchenko"})
+        self.assertEqual(again.data["results"], results)
+
+    def test_search_vector_follows_title_update(self):
+        self.kobzar.title = "Haidamaky"
+        self.kobzar.save()
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "haidamaky"})
+        self.assertEqual(response.data["count"], 1)
+
+    def test_empty_query_returns_nothing(self):
+        response = self.client.get(BOOK_SEARCH_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 0)
+
+
+class CatalogCache(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = sample_book()
+        self.detail_url = reverse("book:book-detail", args=[self.book.id])
+
+    def test_list_and_detail_are_served_from_cache(self):
+        self.client.get(BOOK_URL)
+        self.client.get(self.detail_url)
+        with self.assertNumQueries(0):
+            list_response = self.client.get(BOOK_URL)
+            detail_response = self.client.get(self.detail_url)
+        self.assertEqual(list_response.data, [BookSerializer(self.book).data])
+        self.assertEqual(detail_response.data, BookSerializer(self.book).data)
+
+    def test_inventory_update_invalidates_cache(self):
+        self.client.get(BOOK_URL)
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.reserve(self.book.id)
+        self.assertEqual(self.client.get(BOOK_URL).data[0]["inventory"], 9)
+        self.assertEqual(self.client.get(self.detail_url).data["inventory"], 9)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.release(self.book.id)
+        self.assertEqual(self.client.get(BOOK_URL).data[0]["inventory"], 10)
+        self.assertEqual(
+            self.client.get(self.detail_url).data["inventory"], 10
+        )
+
+    def test_save_invalidates_only_changed_book(self):
+        other_book = sample_book(title="Other")
+        other_url = reverse("book:book-detail", args=[other_book.id])
+        self.client.get(self.detail_url)
+        self.client.get(other_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = "Renamed"
+            self.book.save()
+        self.assertEqual(
+            self.client.get(self.detail_url).data["title"], "Renamed"
+        )
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+
+class Availability(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.today = timezone.localdate()
+        self.book = sample_book(inventory=1)
+        self.url = reverse("book:book-availability", args=[self.book.id])
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"calendar{i}@example.com")
+            for i in range(4)
+        )
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                book=self.book,
+                user=user,
+                expected_return_date=self.today + timedelta(days=days),
+            )
+            for user, days in zip(users, (0, 2, 2, 4))
+        )
+        Borrowing.objects.filter(user=users[0]).update(
+            borrow_date=self.today - timedelta(days=10),
+            expected_return_date=self.today - timedelta(days=3),
+        )
+
+    def free(self, response):
+        return [day["free"] for day in response.data["days"]]
+
+    def test_daily_free_copies(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        days = self.free(response)
+        self.assertEqual(len(days), 90)
+        # The overdue copy never comes back within the range.
+        self.assertEqual(days[:6], [1, 1, 3, 3, 4, 4])
+        self.assertEqual(days[-1], 4)
+
+        start = self.today + timedelta(days=3)
+        response = self.client.get(
+            self.url, {"from": start, "to": start + timedelta(days=2)}
+        )
+        self.assertEqual(self.free(response), [3, 4, 4])
+
+    def test_invalid_ranges(self):
+        for params in (
+            {"from": self.today - timedelta(days=1)},
+            {"from": self.today, "to": self.today - timedelta(days=1)},
+            {"to": self.today + timedelta(days=400)},
+            {"from": "tomorrow"},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, params
+            )
+        response = self.client.get(
+            reverse("book:book-availability", args=[self.book.id + 1])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_until_borrow_or_return(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.reserve(self.book.id)
+        self.assertEqual(self.free(self.client.get(self.url))[0], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.release(self.book.id)
+        self.assertEqual(self.free(self.client.get(self.url))[0], 1)
+
+
+@WITHOUT_CACHE
+class QueryBudget(QueryBudgetMixin, TestCase):
+    def test_book_list(self):
+        def add_books(count):
+            Book.objects.bulk_create(
+                Book(
+                    title=f"Budget {i}",
+                    author="unknown",
+                    cover="soft",
+                    inventory=1,
+                    daily_fee=1,
+                )
+                for i in range(count)
+            )
+
+        self.assertQueryBudget(BOOK_URL, 1, add_books)
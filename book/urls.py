@@ -1,5 +1,10 @@
 from django.urls import path
-from book.views import BookCreateAPIView, BookUpdateAPIView
+from book.views import (
+    BookAvailabilityAPIView,
+    BookCreateAPIView,
+    BookSearchAPIView,
+    BookUpdateAPIView,
+)
 
 
 app_name = "book"
@@ -7,4 +12,10 @@ app_name = "book"
 urlpatterns = [
     path("", BookCreateAPIView.as_view(), name="book-list"),
     path("<int:pk>/", BookUpdateAPIView.as_view(), name="book-detail"),
+    path("search/", BookSearchAPIView.as_view(), name="book-search"),
+    path(
+        "<int:pk>/availability/",
+        BookAvailabilityAPIView.as_view(),
+        name="book-availability",
+    ),
 ]
@@ -1,7 +1,23 @@
-from django.shortcuts import render
+from datetime import timedelta
+
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import generics, mixins, permissions
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from book.availability import (
+    AVAILABILITY_DAYS,
+    AVAILABILITY_MAX_DAYS,
+    daily_free_copies,
+)
+from book.cache import availability_key, detail_key, get_or_set, list_key
 from book.models import Book
+from book.pagination import BookSearchPagination
 from book.serializers import BookSerializer
 
 from book.permissions import IsAdminOrReadOnly
@@ -14,6 +30,16 @@ class BookCreateAPIView(generics.ListCreateAPIView):
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
+    def list(self, request, *args, **kwargs):
+        """Serve the list from the catalog cache"""
+        data = get_or_set(
+            lambda: list_key(request.META.get("QUERY_STRING", "")),
+            lambda: super(BookCreateAPIView, self)
+            .list(request, *args, **kwargs)
+            .data,
+        )
+        return Response(data)
+
 
 class BookUpdateAPIView(generics.RetrieveUpdateDestroyAPIView):
     """Book update and delete view."""
@@ -21,3 +47,118 @@ class BookUpdateAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrReadOnly,)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Serve the book from the catalog cache"""
+        data = get_or_set(
+            lambda: detail_key(self.kwargs["pk"]),
+            lambda: super(BookUpdateAPIView, self)
+            .retrieve(request, *args, **kwargs)
+            .data,
+        )
+        return Response(data)
+
+
+class BookSearchAPIView(generics.ListAPIView):
+    """Ranked search over book titles and authors."""
+
+    serializer_class = BookSerializer
+    permission_classes = (permissions.AllowAny,)
+    pagination_class = BookSearchPagination
+
+    def get_queryset(self):
+        text = self.request.query_params.get("q", "").strip()
+        if not text:
+            return Book.objects.none()
+        return Book.objects.search(text)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                type=OpenApiTypes.STR,
+                description="Words to look for in the title or author. "
+                "Misspelled words are matched by similarity.",
+                location=OpenApiParameter.QUERY,
+                required=True,
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class BookAvailabilityAPIView(APIView):
+    """Free copies of a book on each day of a date range."""
+
+    permission_classes = (permissions.AllowAny,)
+
+    @staticmethod
+    def parse_day(params, name, default):
+        value = params.get(name)
+        if not value:
+            return default
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({name: "Enter a date as YYYY-MM-DD."})
+        return day
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "from",
+                type=OpenApiTypes.DATE,
+                description="First day, today by default.",
+                location=OpenApiParameter.QUERY,
+                required=False,
+            ),
+            OpenApiParameter(
+                "to",
+                type=OpenApiTypes.DATE,
+                description=f"Last day, {AVAILABILITY_DAYS} days from the "
+                f"first by default. At most {AVAILABILITY_MAX_DAYS} days.",
+                location=OpenApiParameter.QUERY,
+                required=False,
+            ),
+        ],
+        description="Free copies on each day. Copies out on a borrowing "
+        "count as free from their expected return date; overdue copies "
+        "count as out.",
+    )
+    def get(self, request, pk):
+        today = timezone.localdate()
+        start = self.parse_day(request.query_params, "from", today)
+        end = self.parse_day(
+            request.query_params,
+            "to",
+            start + timedelta(days=AVAILABILITY_DAYS - 1),
+        )
+        if start < today:
+            raise ValidationError(
+                {"from": "The range can not start in the past."}
+            )
+        if end < start:
+            raise ValidationError({"to": "The range ends before it starts."})
+        if (end - start).days >= AVAILABILITY_MAX_DAYS:
+            raise ValidationError(
+                {
+                    "to": f"The range is longer than {AVAILABILITY_MAX_DAYS} days."
+                }
+            )
+
+        def build():
+            book = get_object_or_404(Book.objects.only("inventory"), pk=pk)
+            return {
+                "book": book.id,
+                "from": start,
+                "to": end,
+                "days": daily_free_copies(book, start, end),
+            }
+
+        data = get_or_set(
+            lambda: availability_key(pk, today, start, end), build
+        )
+        return Response(data)
@@ -0,0 +1,283 @@
+"""
+Per-view request metrics: how many queries a DRF view runs, how long they
+take and how long the whole request takes.
+
+The counters live in the shared cache, so the metrics endpoint reports
+every worker process. Views are labelled "<METHOD>:<url name>", which
+tells apart the actions of a viewset. Each request updates all of its
+counters in one round trip to the cache.
+
+Pooled database connections report how often and how long processes
+waited for a connection, summed per process type.
+"""
+
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import connection, connections
+from django.urls import URLResolver, get_resolver
+from drf_spectacular.utils import extend_schema
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+METRIC_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+METRIC_FIELDS = ("count", "queries", "db_ms", "total_ms")
+PROCESS_TYPES = ("web", "qcluster", "bot")
+# psycopg_pool counters, summed over the processes of a type.
+POOL_COUNTERS = (
+    "requests_num",
+    "requests_queued",
+    "requests_wait_ms",
+    "requests_errors",
+    "usage_ms",
+    "returns_bad",
+    "connections_num",
+    "connections_ms",
+    "connections_errors",
+    "connections_lost",
+)
+POOL_GAUGES = (
+    "pool_min",
+    "pool_max",
+    "pool_size",
+    "pool_available",
+    "requests_waiting",
+)
+POOL_FLUSH_INTERVAL = 10
+
+_pool_flushed_at = 0.0
+
+
+def incr_many(deltas: dict[str, int]) -> None:
+    """
+    Add to counters in the shared cache, creating them as needed. On
+    Redis the INCRBYs go out in one pipeline. Other backends, such as
+    the local cache of the tests, take one read and one write.
+    """
+    if not deltas:
+        return
+    # The backend itself: `cache` is a proxy and never a RedisCache.
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        client = backend._cache.get_client(write=True)
+        with client.pipeline(transaction=False) as pipeline:
+            for key, delta in deltas.items():
+                pipeline.incrby(backend.make_and_validate_key(key), delta)
+            pipeline.execute()
+        return
+    values = cache.get_many(deltas)
+    cache.set_many(
+        {key: values.get(key, 0) + delta for key, delta in deltas.items()},
+        None,
+    )
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries and their time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+
+
+def is_api_view(view) -> bool:
+    return issubclass(getattr(view, "cls", type), APIView)
+
+
+class QueryMetricsMiddleware:
+    """Record query count, DB time and total time of every DRF request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None and match.url_name and is_api_view(match.func):
+            record(
+                f"{request.method}:{match.view_name}",
+                counter.queries,
+                counter.seconds,
+                time.perf_counter() - started,
+            )
+        return response
+
+
+def _metric_key(label: str, field: str) -> str:
+    return f"request:metrics:{label}:{field}"
+
+
+def record(label: str, queries: int, db_seconds: float, seconds: float):
+    try:
+        incr_many(
+            {
+                _metric_key(label, "count"): 1,
+                _metric_key(label, "queries"): queries,
+                _metric_key(label, "db_ms"): round(db_seconds * 1000),
+                _metric_key(label, "total_ms"): round(seconds * 1000),
+            }
+        )
+    except Exception as error:
+        logger.warning("Request metrics are unavailable: %s", error)
+
+
+def api_view_names(patterns=None, namespace: str = ""):
+    """Names of all DRF views in the URL configuration."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = (
+                f"{namespace}{pattern.namespace}:"
+                if pattern.namespace
+                else namespace
+            )
+            yield from api_view_names(pattern.url_patterns, prefix)
+        elif pattern.name and is_api_view(pattern.callback):
+            yield f"{namespace}{pattern.name}"
+
+
+def request_metrics() -> dict:
+    """Totals and per-request averages of every view that has served."""
+    labels = [
+        f"{method}:{name}"
+        for name in sorted(set(api_view_names()))
+        for method in METRIC_METHODS
+    ]
+    values = cache.get_many(
+        [
+            _metric_key(label, field)
+            for label in labels
+            for field in METRIC_FIELDS
+        ]
+    )
+    metrics = {}
+    for label in labels:
+        count = values.get(_metric_key(label, "count"), 0)
+        if not count:
+            continue
+        totals = {
+            field: values.get(_metric_key(label, field), 0)
+            for field in METRIC_FIELDS
+        }
+        metrics[label] = {
+            **totals,
+            "avg_queries": totals["queries"] / count,
+            "avg_db_ms": totals["db_ms"] / count,
+            "avg_total_ms": totals["total_ms"] / count,
+        }
+    return metrics
+
+
+def _pool_key(process_type: str, field: str) -> str:
+    return f"db:pool:{process_type}:{field}"
+
+
+def flush_pool_stats(wrapper, force: bool = False) -> None:
+    """
+    Move the pool counters of this process into the shared cache, at
+    most every POOL_FLUSH_INTERVAL seconds. The pooled backend calls it
+    whenever it returns a connection.
+    """
+    global _pool_flushed_at
+    now = time.monotonic()
+    if not force and now - _pool_flushed_at < POOL_FLUSH_INTERVAL:
+        return
+    _pool_flushed_at = now
+    stats = wrapper.pool_stats(reset=True)
+    try:
+        incr_many(
+            {
+                _pool_key(settings.PROCESS_TYPE, field): stats[field]
+                for field in POOL_COUNTERS
+                if stats.get(field)
+            }
+        )
+    except Exception as error:
+        logger.warning("Connection pool metrics are unavailable: %s", error)
+
+
+def pool_metrics() -> dict:
+    """
+    Pool counters per process type and the pool gauges of the serving
+    process. The average wait is per connection checkout.
+    """
+    values = cache.get_many(
+        [
+            _pool_key(process_type, field)
+            for process_type in PROCESS_TYPES
+            for field in POOL_COUNTERS
+        ]
+    )
+    totals = {}
+    for process_type in PROCESS_TYPES:
+        counters = {
+            field: values.get(_pool_key(process_type, field), 0)
+            for field in POOL_COUNTERS
+        }
+        if not counters["requests_num"]:
+            continue
+        totals[process_type] = {
+            **counters,
+            "avg_wait_ms": counters["requests_wait_ms"]
+            / counters["requests_num"],
+        }
+    pools = {}
+    for wrapper in connections.all(initialized_only=True):
+        stats = getattr(wrapper, "pool_stats", dict)()
+        if stats:
+            pools[wrapper.alias] = {
+                field: stats.get(field) for field in POOL_GAUGES
+            }
+    return {
+        "process_types": totals,
+        "this_process": {
+            "pid": os.getpid(),
+            "process_type": settings.PROCESS_TYPE,
+            "pools": pools,
+        },
+    }
+
+
+class RequestMetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    @extend_schema(
+        description=(
+            "Requests, DB queries, DB time and total time per API view and "
+            "method, as totals and per-request averages."
+        )
+    )
+    def get(self, request):
+        return Response(request_metrics())
+
+
+class DatabasePoolMetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    @extend_schema(
+        description=(
+            "Connection pool checkouts, waits, timeouts and reconnects per "
+            "process type, and the pool size of the serving process."
+        )
+    )
+    def get(self, request):
+        return Response(pool_metrics())
@@ -0,0 +1,132 @@
+"""
+PostgreSQL backend that takes connections from a psycopg_pool
+ConnectionPool instead of opening one per request.
+
+Enable it with ENGINE "books_rent_config.postgresql_pool" and a "pool"
+dict in OPTIONS; the dict is passed to ConnectionPool (min_size,
+max_size, timeout, max_idle, max_lifetime, ...). Closing a Django
+connection returns it to the pool, so CONN_MAX_AGE must stay 0. With
+CONN_HEALTH_CHECKS the pool checks a connection before handing it out.
+
+Pools belong to a process: a process forked after its parent opened a
+pool (django-q workers) builds its own and never touches the parent's
+sockets.
+"""
+
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from psycopg import IsolationLevel
+
+from .creation import DatabaseCreation
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError as error:
+    raise ImproperlyConfigured(
+        "Error loading psycopg_pool module, install psycopg-pool"
+    ) from error
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    @property
+    def _pool_key(self):
+        # The test runner renames the database, which gets its own pool.
+        return os.getpid(), self.alias, self.settings_dict["NAME"]
+
+    @property
+    def pool(self) -> ConnectionPool:
+        pool = _pools.get(self._pool_key)
+        if pool is not None:
+            return pool
+        if self.settings_dict["CONN_MAX_AGE"] != 0:
+            raise ImproperlyConfigured(
+                "Pooled connections need CONN_MAX_AGE = 0, closing a "
+                "connection returns it to the pool."
+            )
+        with _pools_lock:
+            pool = _pools.get(self._pool_key)
+            if pool is None:
+                pool = ConnectionPool(
+                    # Django switches autocommit off when it needs to.
+                    kwargs={
+                        **self.get_connection_params(),
+                        "autocommit": True,
+                    },
+                    check=(
+                        ConnectionPool.check_connection
+                        if self.settings_dict["CONN_HEALTH_CHECKS"]
+                        else None
+                    ),
+                    name=f"{self.alias}:{os.getpid()}",
+                    open=False,
+                    **self.settings_dict["OPTIONS"].get("pool", {}),
+                )
+                _pools[self._pool_key] = pool
+        return pool
+
+    def close_pool(self):
+        pool = _pools.pop(self._pool_key, None)
+        if pool is not None:
+            pool.close()
+
+    def pool_stats(self, reset: bool = False) -> dict:
+        """
+        psycopg_pool statistics of this process's pool, empty before the
+        first connection. With `reset` the counters start over.
+        """
+        pool = _pools.get(self._pool_key)
+        if pool is None:
+            return {}
+        return pool.pop_stats() if reset else pool.get_stats()
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict["OPTIONS"]
+        try:
+            isolation_level = IsolationLevel(
+                options.get("isolation_level", IsolationLevel.READ_COMMITTED)
+            )
+        except ValueError:
+            raise ImproperlyConfigured(
+                f"Invalid transaction isolation level "
+                f"{options['isolation_level']} specified. Use one of the "
+                f"psycopg.IsolationLevel values."
+            )
+        self.isolation_level = isolation_level
+        pool = self.pool
+        pool.open()
+        connection = pool.getconn()
+        connection._django_pid = os.getpid()
+        if "isolation_level" in options:
+            connection.isolation_level = isolation_level
+        connection.cursor_factory = (
+            base.ServerBindingCursor
+            if options.get("server_side_binding") is True
+            else base.Cursor
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if connection._django_pid != os.getpid():
+            # Inherited from the parent process, which still uses it.
+            return
+        with self.wrap_database_errors:
+            connection._pool.putconn(connection)
+        from books_rent_config.metrics import flush_pool_stats
+
+        flush_pool_stats(self)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from os import getenv
 from pathlib import Path
 
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "user",
@@ -66,6 +68,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "books_rent_config.metrics.QueryMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "books_rent_config.urls"
@@ -97,9 +100,51 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST"),
         "PORT": os.getenv("POSTGRES_PORT"),
+        # Keep connections between requests and check them before reuse.
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# web, qcluster or bot; sizes the connection pool of this process.
+PROCESS_TYPE = os.getenv("PROCESS_TYPE") or {
+    "qcluster": "qcluster",
+    "runbot": "bot",
+}.get(sys.argv[1] if len(sys.argv) > 1 else "", "web")
+
+# Per-process pool sizes. A django-q worker runs one task at a time, and
+# there are Q_CLUSTER["workers"] of them, each with its own pool.
+DB_POOL_SIZES = {
+    "web": {"min_size": 2, "max_size": 10},
+    "qcluster": {"min_size": 1, "max_size": 2},
+    "bot": {"min_size": 1, "max_size": 4},
+}
+
+if os.getenv("DB_POOL") == "True":
+    DATABASES["default"].update(
+        ENGINE="books_rent_config.postgresql_pool",
+        CONN_MAX_AGE=0,
+        OPTIONS={
+            "pool": {
+                **DB_POOL_SIZES[PROCESS_TYPE],
+                # Seconds to wait for a free connection before failing.
+                "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+                "max_idle": 300,
+                "max_lifetime": 1800,
+            }
+        },
+    )
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://localhost:6379/1"),
+    }
+}
+
+# Runs the tests on a local cache, emptied before every test.
+TEST_RUNNER = "books_rent_config.testing.TestRunner"
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -145,7 +190,7 @@ AUTH_USER_MODEL = "user.User"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "user.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
@@ -164,6 +209,23 @@ INTERNAL_IPS = [
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Base URL of a self-hosted or fake Bot API server, e.g. http://localhost:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# "polling" runs one bot process; "webhook" serves updates over HTTP from
+# any number of replicas behind a load balancer.
+TELEGRAM_BOT_MODE = os.getenv("TELEGRAM_BOT_MODE", "polling")
+
+# Public HTTPS URL Telegram posts updates to, e.g.
+# https://bot.example.com/telegram/webhook/
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token with every update.
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+TELEGRAM_WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", 8081))
+
 
 Q_CLUSTER = {
     "name": "myproject",
@@ -199,6 +261,9 @@ STRIPE_SECRET_KEY = getenv("STRIPE_SECRET_KEY")
 
 STRIPE_WEBHOOK_SECRET = getenv("STRIPE_WEBHOOK_SECRET")
 
+# Base URL of a Stripe API stand-in, e.g. http://localhost:12111
+STRIPE_API_BASE = getenv("STRIPE_API_BASE")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Book for rent API",
     "VERSION": "1.0.0",
@@ -0,0 +1,83 @@
+import unittest
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+BUDGET_ROWS = (1, 10, 1000)
+
+# Tests never touch the Redis of the developer or of CI.
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tests",
+    }
+}
+
+
+class CacheClearingResult:
+    """Start every test with empty caches, so no state leaks between them."""
+
+    def startTest(self, test):
+        from user.cache import local_cache
+
+        for cache in caches.all(initialized_only=True):
+            cache.clear()
+        local_cache.clear()
+        super().startTest(test)
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner that swaps the shared cache for a local one."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=TEST_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or unittest.TextTestResult
+        return type(base.__name__, (CacheClearingResult, base), {})
+
+
+class QueryBudgetMixin:
+    """
+    Assertions that an endpoint runs a fixed number of queries however
+    many rows it serves, to catch N+1 regressions in tests.
+    """
+
+    def assertQueryBudget(
+        self, url, budget, add_rows, user=None, rows=BUDGET_ROWS
+    ):
+        """
+        GET `url` after growing the data to each count in `rows` and
+        check that no response takes more than `budget` queries.
+        `add_rows(n)` creates n more rows. The user is authenticated with
+        a real JWT, so the authentication query counts as well.
+        """
+        client = APIClient()
+        if user is not None:
+            client.credentials(
+                HTTP_AUTHORIZE=f"Bearer {AccessToken.for_user(user)}"
+            )
+        created = 0
+        for count in rows:
+            add_rows(count - created)
+            created = count
+            with self.subTest(url=url, rows=count):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(
+                    len(queries),
+                    budget,
+                    "\n".join(query["sql"] for query in queries),
+                )
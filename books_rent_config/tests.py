@@ -0,0 +1,162 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from books_rent_config.metrics import (
+    api_view_names,
+    flush_pool_stats,
+    incr_many,
+)
+
+POOL_ALIAS = "pool_test"
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_requests_are_recorded_per_view_and_method(self):
+        self.client.get(reverse("users:user-me"))
+        self.client.get(reverse("users:user-me"))
+        self.client.get(reverse("borrowings:borrowings-list"))
+
+        response = self.client.get(reverse("request-metrics"))
+
+        me = response.data["GET:users:user-me"]
+        self.assertEqual(me["count"], 2)
+        self.assertEqual(me["queries"], 0)
+        self.assertEqual(
+            response.data["GET:borrowings:borrowings-list"]["count"], 1
+        )
+        self.assertNotIn("POST:users:user-me", response.data)
+
+    def test_only_api_views_are_listed(self):
+        names = set(api_view_names())
+        self.assertIn("payments:payments-webhook", names)
+        self.assertIn("borrowings:borrowings-return-book", names)
+        self.assertNotIn("payment_success", names)
+        self.assertFalse(any(name.startswith("admin:") for name in names))
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_authenticate(
+            user=get_user_model().objects.create_user(
+                email="user@example.com", password="password"
+            )
+        )
+        response = self.client.get(reverse("request-metrics"))
+        self.assertEqual(response.status_code, 403)
+
+
+class RedisCountersTestCase(SimpleTestCase):
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://redis.invalid:6379/0",
+            }
+        }
+    )
+    def test_counters_are_incremented_in_one_pipeline(self):
+        backend = caches["default"]
+        with mock.patch.object(
+            backend._cache, "get_client"
+        ) as get_client, mock.patch.object(backend, "get_many") as get_many:
+            incr_many({"first": 1, "second": 5})
+
+        pipeline = get_client.return_value.pipeline.return_value
+        pipeline = pipeline.__enter__.return_value
+        self.assertEqual(
+            pipeline.incrby.call_args_list,
+            [
+                mock.call(backend.make_and_validate_key("first"), 1),
+                mock.call(backend.make_and_validate_key("second"), 5),
+            ],
+        )
+        pipeline.execute.assert_called_once_with()
+        get_many.assert_not_called()
+
+
+class PooledBackendTestCase(TestCase):
+    """The pooled backend on the test database, under an extra alias."""
+
+    def setUp(self):
+        connections.settings[POOL_ALIAS] = {
+            **connections.settings["default"],
+            "ENGINE": "books_rent_config.postgresql_pool",
+            "CONN_MAX_AGE": 0,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {"pool": {"min_size": 1, "max_size": 1}},
+        }
+        self.pooled = connections[POOL_ALIAS]
+
+    def tearDown(self):
+        self.pooled.close()
+        self.pooled.close_pool()
+        del connections[POOL_ALIAS]
+        del connections.settings[POOL_ALIAS]
+
+    def backend_pid(self):
+        with self.pooled.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_closed_connection_goes_back_to_the_pool(self):
+        pid = self.backend_pid()
+        self.pooled.close()
+        self.assertEqual(self.pooled.pool_stats()["pool_available"], 1)
+
+        self.assertEqual(self.backend_pid(), pid)
+        self.assertEqual(self.pooled.pool_stats()["pool_available"], 0)
+
+    def test_broken_connection_is_replaced(self):
+        pid = self.backend_pid()
+        self.pooled.close()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+        self.assertNotEqual(self.backend_pid(), pid)
+
+    def test_inherited_connection_is_not_returned(self):
+        self.backend_pid()
+        inherited = self.pooled.connection
+        inherited._django_pid = -1
+
+        self.pooled.close()
+
+        self.assertIsNone(self.pooled.connection)
+        self.assertEqual(self.pooled.pool_stats()["pool_available"], 0)
+        inherited.close()
+
+    def test_persistent_connections_are_rejected(self):
+        self.pooled.settings_dict["CONN_MAX_AGE"] = 60
+        with self.assertRaises(ImproperlyConfigured):
+            self.pooled.ensure_connection()
+
+    def test_pool_metrics(self):
+        self.backend_pid()
+        self.pooled.close()
+        flush_pool_stats(self.pooled, force=True)
+        client = APIClient()
+        client.force_authenticate(
+            user=get_user_model().objects.create_superuser(
+                email="admin@example.com", password="password"
+            )
+        )
+
+        response = client.get(reverse("db-pool-metrics"))
+
+        self.assertEqual(
+            response.data["process_types"]["web"]["requests_num"], 1
+        )
+        self.assertEqual(
+            response.data["this_process"]["pools"][POOL_ALIAS]["pool_max"], 1
+        )
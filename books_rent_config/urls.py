@@ -20,9 +20,13 @@ from django.urls import path, include
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
-    SpectacularSwaggerView
+    SpectacularSwaggerView,
 )
 
+from books_rent_config.metrics import (
+    DatabasePoolMetricsView,
+    RequestMetricsView,
+)
 from payment.views import payment_success, payment_cancel
 
 urlpatterns = [
@@ -31,18 +35,33 @@ urlpatterns = [
     path("books/", include("book.urls"), name="books"),
     path("borrowings/", include("borrowing.urls"), name="borrowings"),
     path("payments/", include("payment.urls"), name="payments"),
+    path(
+        "notifications/",
+        include("telegram_bot.urls"),
+        name="notifications",
+    ),
     path("success/", payment_success, name="payment_success"),
     path("cancel/", payment_cancel, name="payment_cancel"),
+    path(
+        "metrics/requests/",
+        RequestMetricsView.as_view(),
+        name="request-metrics",
+    ),
+    path(
+        "metrics/db-pool/",
+        DatabasePoolMetricsView.as_view(),
+        name="db-pool-metrics",
+    ),
     path("__debug__/", include("debug_toolbar.urls")),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
         "api/schema/swagger-ui/",
         SpectacularSwaggerView.as_view(url_name="schema"),
-        name="swagger-ui"
+        name="swagger-ui",
     ),
     path(
-        'api/schema/redoc/',
+        "api/schema/redoc/",
         SpectacularRedocView.as_view(url_name="schema"),
-        name="redoc"
+        name="redoc",
     ),
 ]
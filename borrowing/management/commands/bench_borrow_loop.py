@@ -0,0 +1,269 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.views.generic.dates import timezone_today
+from rest_framework.test import APIClient
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.events import process_pending
+from payment.fake_stripe import FakeStripe
+from payment.models import Payment, StripeEvent
+from payment.stripe_client import get_client
+from payment.utils import create_deferred_session
+from telegram_bot.fake_api import FakeBotAPI
+from telegram_bot.models import Notification
+from telegram_bot.outbox import deliver_pending
+
+BENCH_WEBHOOK_SECRET = "whsec_bench"
+BENCH_TELEGRAM_ID = 9_000_000_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the borrow -> pay -> webhook -> return loop against local "
+        "Stripe and Telegram stand-ins and reports throughput, latency "
+        "percentiles and DB queries per request for every step"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--books", type=int, default=20)
+        parser.add_argument("--stripe-latency", type=float, default=0.05)
+        parser.add_argument("--telegram-latency", type=float, default=0.05)
+        parser.add_argument(
+            "--async-checkout",
+            action="store_true",
+            help="Borrow with ?checkout=async and run the deferred Stripe "
+            "calls as a separate worker stage",
+        )
+
+    def handle(self, *args, **options):
+        self.concurrency = options["concurrency"]
+        self.async_checkout = options["async_checkout"]
+        tag = uuid.uuid4().hex[:8]
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(
+                email=f"bench-{tag}-{i}@example.com",
+                telegram_id=BENCH_TELEGRAM_ID + i,
+            )
+            for i in range(options["users"])
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"bench loop book {tag} {i}",
+                author="bench",
+                cover=Book.Cover.SOFT,
+                inventory=options["users"],
+                daily_fee=1,
+            )
+            for i in range(options["books"])
+        )
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        def run(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        stripe = FakeStripe(
+            BENCH_WEBHOOK_SECRET, latency=options["stripe_latency"]
+        )
+        telegram = FakeBotAPI(latency=options["telegram_latency"])
+        stripe_url = run(stripe.start())
+        telegram_url = run(telegram.start())
+        try:
+            with override_settings(
+                STRIPE_API_BASE=stripe_url,
+                STRIPE_SECRET_KEY="sk_test_bench",
+                STRIPE_WEBHOOK_SECRET=BENCH_WEBHOOK_SECRET,
+                TELEGRAM_API_URL=telegram_url,
+                TELEGRAM_BOT_TOKEN="42:bench",
+            ):
+                get_client.cache_clear()
+                self.run_loop(users, books, stripe)
+                self.stdout.write(
+                    f"fake stripe: {stripe.requests} requests, "
+                    f"fake telegram: {telegram.sent} sent, "
+                    f"{telegram.throttled} throttled"
+                )
+        finally:
+            get_client.cache_clear()
+            run(stripe.stop())
+            run(telegram.stop())
+            loop.call_soon_threadsafe(loop.stop)
+            user_ids = [user.id for user in users]
+            StripeEvent.objects.filter(
+                payload__data__object__id__in=list(stripe.sessions)
+            ).delete()
+            Notification.objects.filter(
+                telegram_id__gte=BENCH_TELEGRAM_ID,
+                telegram_id__lt=BENCH_TELEGRAM_ID + len(users),
+            ).delete()
+            Borrowing.objects.filter(user_id__in=user_ids).delete()
+            Book.objects.filter(id__in=[book.id for book in books]).delete()
+            get_user_model().objects.filter(id__in=user_ids).delete()
+
+    def run_loop(self, users, books, stripe):
+        expected_return_date = timezone_today() + timedelta(days=7)
+        borrowings_url = reverse("borrowings:borrowings-list")
+        webhook_url = reverse("payments:payments-webhook")
+
+        def borrow(i, query=""):
+            return self.request(
+                users[i],
+                "post",
+                f"{borrowings_url}{query}",
+                {
+                    "book": books[i % len(books)].id,
+                    "expected_return_date": expected_return_date,
+                },
+            )
+
+        if self.async_checkout:
+            session_ids = self.borrow_deferred(borrow, len(users))
+        else:
+            # create_stripe_session answers with a plain redirect (302).
+            results = self.stage("borrow", borrow, len(users), expected=302)
+            session_ids = [
+                response["Location"].rsplit("/", 1)[-1]
+                for response in results
+                if response.status_code == 302
+            ]
+
+        def webhook(i):
+            payload, signature = stripe.signed_event(session_ids[i])
+            return self.request(
+                None,
+                "post",
+                webhook_url,
+                payload,
+                content_type="application/json",
+                HTTP_STRIPE_SIGNATURE=signature,
+            )
+
+        self.stage("webhook", webhook, len(session_ids), expected=200)
+        self.drain("process events", process_pending, self.concurrency)
+
+        payments = dict(
+            Payment.objects.filter(session_id__in=session_ids).values_list(
+                "borrowing_id", "borrowing__user_id"
+            )
+        )
+        by_user = {user.id: user for user in users}
+        returns = list(payments.items())
+
+        def return_book(i):
+            borrowing_id, user_id = returns[i]
+            return self.request(
+                by_user[user_id],
+                "post",
+                f"{borrowings_url}{borrowing_id}/return/",
+            )
+
+        self.stage("return", return_book, len(returns), expected=200)
+        self.drain("notifications", deliver_pending, 1)
+
+    def borrow_deferred(self, borrow, count):
+        """
+        Borrow with deferred checkout, then play the django-q worker that
+        opens the Stripe sessions. Returns the session ids.
+        """
+        with mock.patch("payment.utils.async_task"):
+            results = self.stage(
+                "borrow (async)",
+                lambda i: borrow(i, "?checkout=async"),
+                count,
+                expected=202,
+            )
+        payment_ids = [
+            response.data["payment"]
+            for response in results
+            if response.status_code == 202
+        ]
+
+        def open_session(i):
+            try:
+                return create_deferred_session(payment_ids[i])
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            opened = sum(pool.map(open_session, range(len(payment_ids))))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{'checkout worker':<15} {opened} done, "
+            f"{opened / elapsed:7.1f} /s ({elapsed:.2f} s)"
+        )
+        return list(
+            Payment.objects.filter(id__in=payment_ids).values_list(
+                "session_id", flat=True
+            )
+        )
+
+    def request(self, user, method, url, data=None, **extra):
+        client = APIClient(SERVER_NAME="localhost", REMOTE_ADDR="10.0.0.1")
+        if user is not None:
+            client.force_authenticate(user=user)
+        connection.ensure_connection()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, **extra)
+            response.elapsed = time.perf_counter() - started
+        response.queries = len(queries)
+        return response
+
+    def stage(self, name, func, count, expected):
+        def worker(i):
+            try:
+                return func(i)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(worker, range(count)))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(response.elapsed * 1000 for response in results)
+        p50, p95, p99 = (
+            latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+            for p in (50, 95, 99)
+        )
+        errors = sum(response.status_code != expected for response in results)
+        queries = statistics.mean(response.queries for response in results)
+        self.stdout.write(
+            f"{name:<15} {count} req, {count / elapsed:7.1f} req/s, "
+            f"p50 {p50:6.1f} ms, p95 {p95:6.1f} ms, p99 {p99:6.1f} ms, "
+            f"{queries:4.1f} queries/req, {errors} errors"
+        )
+        return results
+
+    def drain(self, name, func, workers):
+        def worker(_):
+            try:
+                return func()
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            done = sum(pool.map(worker, range(workers)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name:<15} {done} done, {done / elapsed:7.1f} /s "
+            f"({elapsed:.2f} s)"
+        )
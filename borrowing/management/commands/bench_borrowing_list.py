@@ -0,0 +1,153 @@
+import statistics
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.views import BorrowingViewSet
+
+SCENARIOS = {
+    "own": ("user", {}),
+    "staff all": ("staff", {}),
+    "staff is_active=true": ("staff", {"is_active": "true"}),
+    "staff is_active=false": ("staff", {"is_active": "false"}),
+    "staff user_id": ("staff", {"user_id": None}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds borrowings in steps and measures BorrowingViewSet.list "
+        "latency for the first and a deep page at each table size"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10_000, 100_000, 1_000_000],
+            help="Table sizes to measure, e.g. 10000 1000000 10000000",
+        )
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--repeats", type=int, default=20)
+        parser.add_argument(
+            "--depth",
+            type=int,
+            default=100,
+            help="Deep page to measure; the default reaches past the first "
+            "2000 rows",
+        )
+
+    def handle(self, *args, **options):
+        book = Book.objects.create(
+            title="bench book",
+            author="bench",
+            cover=Book.Cover.SOFT,
+            inventory=0,
+            daily_fee=1,
+        )
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"bench-{book.id}-{i}@example.com")
+            for i in range(options["users"])
+        )
+        staff = get_user_model().objects.create(
+            email=f"bench-{book.id}-staff@example.com", is_staff=True
+        )
+        self.factory = APIRequestFactory()
+        self.view = BorrowingViewSet.as_view({"get": "list"})
+        self.actors = {"user": users[0], "staff": staff}
+        self.user_id = users[0].id
+        try:
+            seeded = 0
+            for size in sorted(options["sizes"]):
+                self.seed(book, users, seeded, size)
+                seeded = size
+                self.stdout.write(f"--- {size} borrowings")
+                for name, (actor, params) in SCENARIOS.items():
+                    first, deep = self.measure(
+                        actor, params, options["repeats"], options["depth"]
+                    )
+                    self.stdout.write(
+                        f"{name:<24} first page p50 {first:7.2f} ms, "
+                        f"page {options['depth']} p50 {deep:7.2f} ms"
+                    )
+        finally:
+            Borrowing.objects.filter(book=book).delete()
+            book.delete()
+            get_user_model().objects.filter(
+                id__in=[user.id for user in users] + [staff.id]
+            ).delete()
+
+    def seed(self, book, users, start, stop):
+        """
+        Insert borrowings start + 1..stop in one statement. The first
+        borrowing of every user stays active, everything else is returned.
+        """
+        user_ids = [user.id for user in users]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Borrowing._meta.db_table}
+                    (borrow_date, expected_return_date, actual_return_date,
+                     book_id, user_id)
+                SELECT
+                    current_date - (i %% 3650),
+                    current_date - (i %% 3650) + 14,
+                    CASE WHEN i <= %(users)s THEN NULL
+                         ELSE current_date - (i %% 3650) + 7 END,
+                    %(book)s,
+                    (%(user_ids)s::bigint[])[1 + i %% %(users)s]
+                FROM generate_series(%(start)s, %(stop)s) AS i
+                """,
+                {
+                    "users": len(user_ids),
+                    "book": book.id,
+                    "user_ids": user_ids,
+                    "start": start + 1,
+                    "stop": stop,
+                },
+            )
+            cursor.execute(f"ANALYZE {Borrowing._meta.db_table}")
+
+    def get(self, actor, params):
+        request = self.factory.get(
+            "/borrowings/", params, SERVER_NAME="localhost"
+        )
+        force_authenticate(request, user=self.actors[actor])
+        started = time.perf_counter()
+        response = self.view(request)
+        response.render()
+        return (time.perf_counter() - started) * 1000, response
+
+    def measure(self, actor, params, repeats, depth):
+        params = {
+            key: self.user_id if value is None else value
+            for key, value in params.items()
+        }
+        first, deep = [], []
+        for _ in range(repeats):
+            elapsed, response = self.get(actor, params)
+            first.append(elapsed)
+        next_url = response.data["next"]
+        for _ in range(depth - 1):
+            if next_url is None:
+                break
+            elapsed, response = self.get(actor, self.cursor(next_url, params))
+            next_url = response.data["next"]
+        for _ in range(repeats):
+            elapsed, _ = self.get(actor, self.cursor(next_url, params))
+            deep.append(elapsed)
+        return statistics.median(first), statistics.median(deep)
+
+    @staticmethod
+    def cursor(url, params):
+        if url is None:
+            return params
+        cursor = parse_qs(urlsplit(url).query)["cursor"][0]
+        return {**params, "cursor": cursor}
@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.views.generic.dates import timezone_today
+from rest_framework.exceptions import ValidationError
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.serializers import BorrowingSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs N parallel borrowers against one hot book and reports "
+        "throughput and oversell count"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--borrowers", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=16)
+        parser.add_argument("--inventory", type=int, default=50)
+
+    def handle(self, *args, **options):
+        borrowers = options["borrowers"]
+        workers = options["workers"]
+        inventory = options["inventory"]
+
+        book = Book.objects.create(
+            title="bench hot book",
+            author="bench",
+            cover=Book.Cover.SOFT,
+            inventory=inventory,
+            daily_fee=1,
+        )
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"bench-{book.id}-{i}@example.com")
+            for i in range(borrowers)
+        )
+        expected_return_date = timezone_today() + timedelta(days=1)
+
+        def borrow(user) -> bool:
+            serializer = BorrowingSerializer(
+                data={
+                    "book": book.id,
+                    "expected_return_date": expected_return_date,
+                },
+                context={"request": SimpleNamespace(user=user)},
+            )
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=user)
+                return True
+            except ValidationError:
+                return False
+            finally:
+                connection.close()
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(borrow, users))
+            elapsed = time.perf_counter() - started
+
+            book.refresh_from_db()
+            borrowed = Borrowing.objects.filter(book=book).count()
+            oversell = max(borrowed - inventory, 0)
+            self.stdout.write(
+                f"borrowers: {borrowers}, workers: {workers}, "
+                f"inventory: {inventory}\n"
+                f"succeeded: {sum(results)}, rejected: "
+                f"{len(results) - sum(results)}\n"
+                f"throughput: {borrowers / elapsed:.1f} req/s "
+                f"({elapsed:.2f} s)\n"
+                f"final inventory: {book.inventory}, oversell: {oversell}"
+            )
+            if oversell or book.inventory != inventory - borrowed:
+                self.stdout.write(
+                    self.style.ERROR("Inventory invariant broken")
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS("No oversell"))
+        finally:
+            book.delete()
+            get_user_model().objects.filter(
+                id__in=[user.id for user in users]
+            ).delete()
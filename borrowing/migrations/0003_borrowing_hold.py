@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-17 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0002_borrowing_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrowing",
+            name="hold_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(
+                    ("actual_return_date__isnull", True),
+                    ("hold_expires_at__isnull", False),
+                ),
+                fields=["hold_expires_at"],
+                name="borrowing_hold_expiry_idx",
+            ),
+        ),
+    ]
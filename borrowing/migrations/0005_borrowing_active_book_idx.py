@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-17 14:08
+
+from django.db import migrations, models
+
+BACKFILL_NEXT_AVAILABLE_ON = """
+UPDATE book_book SET next_available_on = (
+    SELECT min(expected_return_date)
+    FROM borrowing_borrowing
+    WHERE book_id = book_book.id AND actual_return_date IS NULL
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0003_book_next_available_on"),
+        ("borrowing", "0004_waitlist"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["book", "expected_return_date"],
+                name="borrowing_active_book_idx",
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_NEXT_AVAILABLE_ON, migrations.RunSQL.noop),
+    ]
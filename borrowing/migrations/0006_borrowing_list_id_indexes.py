@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-17 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0005_borrowing_active_book_idx"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="borrowing",
+            name="borrowing_date_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="borrowing",
+            name="borrowing_user_date_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="borrowing",
+            name="borrowing_active_date_idx",
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "id"], name="borrowing_user_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["id"],
+                name="borrowing_active_id_idx",
+            ),
+        ),
+    ]
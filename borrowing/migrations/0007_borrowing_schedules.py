@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Registered here rather than by the bot, so held copies and waitlist
+# offers are released on every deployment, with or without the bot.
+SCHEDULES = {
+    "release expired borrowing holds": {
+        "func": "borrowing.holds.release_expired_holds",
+        "schedule_type": "I",
+        "minutes": 5,
+        "repeats": -1,
+    },
+    "expire waitlist offers": {
+        "func": "borrowing.waitlist.expire_offers",
+        "schedule_type": "I",
+        "minutes": 5,
+        "repeats": -1,
+    },
+}
+
+
+def create_schedules(apps, schema_editor):
+    schedule = apps.get_model("django_q", "Schedule")
+    for name, fields in SCHEDULES.items():
+        schedule.objects.update_or_create(name=name, defaults=fields)
+
+
+def delete_schedules(apps, schema_editor):
+    schedule = apps.get_model("django_q", "Schedule")
+    schedule.objects.filter(name__in=SCHEDULES).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_q", "0014_schedule_cluster"),
+        ("borrowing", "0006_borrowing_list_id_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_schedules, delete_schedules),
+    ]
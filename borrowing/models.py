@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import CheckConstraint, Q, F
+from django.db.models import CheckConstraint, Q, F, Index
 from django.core.exceptions import ValidationError
 from django.db.models.constraints import UniqueConstraint
 
@@ -11,6 +11,8 @@ class Borrowing(models.Model):
     borrow_date = models.DateField(auto_now_add=True)
     expected_return_date = models.DateField()
     actual_return_date = models.DateField(null=True, blank=True)
+    # Until the borrowing is paid, its copy is only held until this time.
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name="borrowings"
@@ -32,10 +34,36 @@ class Borrowing(models.Model):
                 name="unique_active_borrowing",
             ),
         ]
+        indexes = [
+            Index(
+                fields=["user", "id"],
+                name="borrowing_user_id_idx",
+            ),
+            Index(
+                fields=["id"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_id_idx",
+            ),
+            Index(
+                fields=["book", "expected_return_date"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_book_idx",
+            ),
+            Index(
+                fields=["hold_expires_at"],
+                condition=Q(
+                    hold_expires_at__isnull=False,
+                    actual_return_date__isnull=True,
+                ),
+                name="borrowing_hold_expiry_idx",
+            ),
+        ]
 
     def __str__(self):
-        return (f"{self.book.title} expected return date "
-                f"{self.expected_return_date}")
+        return (
+            f"{self.book.title} expected return date "
+            f"{self.expected_return_date}"
+        )
 
     @staticmethod
     def validate_dates(
@@ -53,3 +81,58 @@ class Borrowing(models.Model):
             actual_return_date=self.actual_return_date,
             error=ValidationError,
         )
+
+
+class WaitlistEntry(models.Model):
+    """
+    A reader queued for an out-of-stock book. The queue of a book is its
+    WAITING entries in id order. A returned copy is offered to the head
+    of the queue and held for it until offer_expires_at.
+    """
+
+    class Status(models.TextChoices):
+        WAITING = "waiting", "Waiting"
+        OFFERED = "offered", "Offered"
+        CLAIMED = "claimed", "Claimed"
+        EXPIRED = "expired", "Expired"
+        CANCELLED = "cancelled", "Cancelled"
+
+    ACTIVE = (Status.WAITING, Status.OFFERED)
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="waitlist"
+    )
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name="waitlist_entries",
+    )
+    status = models.CharField(
+        max_length=9, choices=Status.choices, default=Status.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    offer_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["user", "book"],
+                condition=Q(status__in=["waiting", "offered"]),
+                name="unique_active_waitlist_entry",
+            ),
+        ]
+        indexes = [
+            Index(
+                fields=["book", "id"],
+                condition=Q(status="waiting"),
+                name="waitlist_queue_idx",
+            ),
+            Index(
+                fields=["offer_expires_at"],
+                condition=Q(status="offered"),
+                name="waitlist_offer_expiry_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} waiting for {self.book_id} ({self.status})"
@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class BorrowingCursorPagination(CursorPagination):
+    """
+    Keyset pagination, newest borrowings first.
+
+    DRF builds the cursor from the first ordering field alone and skips
+    rows sharing its value with an offset, so that field must be unique.
+    Ids grow with the borrow date.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-id",)
@@ -1,5 +1,4 @@
-from django.db import transaction
-from django.db.models import F
+from django.db import IntegrityError, transaction
 
 from datetime import date
 
@@ -7,7 +6,19 @@ from rest_framework import serializers
 
 from book.models import Book
 from book.serializers import BookSerializer
-from borrowing.models import Borrowing
+from borrowing.holds import hold_deadline
+from borrowing.models import Borrowing, WaitlistEntry
+from borrowing.returns import BULK_RETURN_MAX
+from borrowing.waitlist import (
+    claim_offer,
+    claim_offers,
+    leave_queue,
+    leave_queues,
+)
+from telegram_bot.notifications import created_text
+from telegram_bot.outbox import enqueue
+
+CART_MAX_BOOKS = 10
 
 
 class BorrowingSerializer(serializers.ModelSerializer):
@@ -38,36 +49,173 @@ class BorrowingSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        book_id = validated_data["book"].id
+        book = validated_data["book"]
+        user = validated_data["user"]
         try:
-            book = Book.objects.get(pk=book_id)
-        except Book.DoesNotExist:
-            raise serializers.ValidationError(
-                "The selected book does not exist."
+            with transaction.atomic():
+                # A copy offered from the waitlist is already set aside.
+                if not claim_offer(book.id, user.id):
+                    if not Book.objects.reserve(book.id):
+                        raise serializers.ValidationError(
+                            self._not_available_message(book)
+                        )
+                    leave_queue(book.id, user.id)
+                borrowing = super(BorrowingSerializer, self).create(
+                    {**validated_data, "hold_expires_at": hold_deadline()}
+                )
+                Book.objects.borrowed_until(
+                    [book.id], borrowing.expected_return_date
+                )
+        except IntegrityError:
+            raise serializers.ValidationError("The book is already borrowed")
+        return borrowing
+
+    @staticmethod
+    def _not_available_message(book: Book) -> str:
+        if book.available_from:
+            return (
+                f"Sorry this book is not available now, we expect that it "
+                f"book will be available on {book.available_from}"
             )
+        return "Sorry this book is not available now."
+
+
+class CartSerializer(serializers.Serializer):
+    """Borrow several books at once, all or nothing."""
+
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=CART_MAX_BOOKS,
+    )
+    expected_return_date = serializers.DateField()
+
+    def validate_books(self, books):
+        if len(set(books)) != len(books):
+            raise serializers.ValidationError("A book is in the cart twice.")
+        return books
 
-        if book.inventory == 0:
-            earliest_return = (
-                Borrowing.objects.filter(book=book)
-                .order_by("expected_return_date")
-                .first()
+    def validate(self, data):
+        Borrowing.validate_dates(
+            borrow_date=date.today(),
+            expected_return_date=data["expected_return_date"],
+            actual_return_date=None,
+            error=serializers.ValidationError,
+        )
+        borrowed = list(
+            Borrowing.objects.filter(
+                user=self.context["request"].user,
+                book_id__in=data["books"],
+                actual_return_date__isnull=True,
+            ).values_list("book_id", flat=True)
+        )
+        if borrowed:
+            raise serializers.ValidationError(
+                {"books": f"Already borrowed: {sorted(borrowed)}"}
             )
-            if earliest_return:
-                raise serializers.ValidationError(
-                    f"Sorry this book is not available now, we expect that it "
-                    f"book will be available on "
-                    f"{earliest_return.expected_return_date}"
+        return data
+
+    def create(self, validated_data) -> list[Borrowing]:
+        """
+        Reserve a copy of every book, claiming waitlist offers first, and
+        insert the borrowings in one statement. One outbox message lists
+        them all.
+        """
+        book_ids = validated_data["books"]
+        user = validated_data["user"]
+        expected_return_date = validated_data["expected_return_date"]
+        try:
+            with transaction.atomic():
+                claimed = claim_offers(book_ids, user.id)
+                unavailable = Book.objects.reserve_many(
+                    [book_id for book_id in book_ids if book_id not in claimed]
                 )
-            else:
-                raise serializers.ValidationError(
-                    "Sorry this book is not available now."
+                if unavailable:
+                    raise serializers.ValidationError(
+                        {"books": f"Not available now: {unavailable}"}
+                    )
+                leave_queues(book_ids, user.id)
+                books = Book.objects.in_bulk(book_ids)
+                borrowings = Borrowing.objects.bulk_create(
+                    Borrowing(
+                        book=books[book_id],
+                        user=user,
+                        expected_return_date=expected_return_date,
+                        hold_expires_at=hold_deadline(),
+                    )
+                    for book_id in book_ids
                 )
-        with transaction.atomic():
-            Book.objects.filter(pk=book_id).update(
-                inventory=F("inventory") - 1
+                Book.objects.borrowed_until(book_ids, expected_return_date)
+                if user.telegram_id:
+                    enqueue(
+                        telegram_id=user.telegram_id,
+                        text="\n".join(map(created_text, borrowings)),
+                    )
+        except IntegrityError:
+            raise serializers.ValidationError("A book is already borrowed")
+        return borrowings
+
+    def to_representation(self, borrowings):
+        return {
+            "borrowings": [borrowing.id for borrowing in borrowings],
+        }
+
+
+class BulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BULK_RETURN_MAX,
+    )
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WaitlistEntry
+        fields = ("id", "book", "status", "created_at", "offer_expires_at")
+        read_only_fields = ("status", "created_at", "offer_expires_at")
+
+    def validate_book(self, book):
+        if book.inventory > 0:
+            raise serializers.ValidationError(
+                "The book is available, borrow it instead."
             )
-            borrowing = super(BorrowingSerializer, self).create(validated_data)
-        return borrowing
+        if Borrowing.objects.filter(
+            user=self.context["request"].user,
+            book=book,
+            actual_return_date__isnull=True,
+        ).exists():
+            raise serializers.ValidationError("The book is already borrowed")
+        return book
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                "You are already on the waitlist for this book."
+            )
+
+
+class DetailWaitlistEntrySerializer(WaitlistEntrySerializer):
+    position = serializers.SerializerMethodField()
+
+    class Meta(WaitlistEntrySerializer.Meta):
+        fields = WaitlistEntrySerializer.Meta.fields + ("position",)
+
+    def get_position(self, entry: WaitlistEntry) -> int | None:
+        """Place in the queue, counted through the queue index."""
+        if entry.status != WaitlistEntry.Status.WAITING:
+            return None
+        return (
+            WaitlistEntry.objects.filter(
+                book_id=entry.book_id,
+                status=WaitlistEntry.Status.WAITING,
+                id__lt=entry.id,
+            ).count()
+            + 1
+        )
 
 
 class BorrowingBookReturnSerializer(serializers.ModelSerializer):
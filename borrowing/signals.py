@@ -1,15 +1,17 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from borrowing.models import Borrowing
-from telegram_bot.notifications import run_send_created
+from telegram_bot.notifications import created_text
+from telegram_bot.outbox import enqueue
 
 
 @receiver(post_save, sender=Borrowing)
 def borrowing_created(sender, instance, created, **kwargs):
+    """
+    Queue the 'borrowing created' message in the outbox. It is written in
+    the borrowing's transaction and sent by django-q after commit.
+    """
     if created:
         telegram_id = instance.user.telegram_id
         if telegram_id:
-            run_send_created(telegram_id=telegram_id, borrowing=instance)
-            print(
-                f"Borrowing '{instance.id}' by {instance.book} has been created."
-            )
+            enqueue(telegram_id=telegram_id, text=created_text(instance))
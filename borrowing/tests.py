@@ -3,23 +3,38 @@ from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+import stripe
 from django.views.generic.dates import timezone_today
+from django_q.models import Schedule
 from rest_framework.response import Response
 
 from rest_framework.reverse import reverse
 
 
 from rest_framework.test import APIClient
-from rest_framework import status
+from rest_framework import exceptions, status
 
 from book.models import Book
-from borrowing.models import Borrowing
+from borrowing.holds import BORROWING_HOLD_TTL, release_expired_holds
+from borrowing.models import Borrowing, WaitlistEntry
 from borrowing.serializers import BorrowingSerializer
 from borrowing.signals import borrowing_created
+from borrowing.waitlist import expire_offers
+from books_rent_config.testing import QueryBudgetMixin
+from payment.models import Payment
+from payment.stripe_client import CircuitBreaker
+from payment.utils import complete_payment
+from telegram_bot.models import Notification
 
 URL_BORROWING = reverse("borrowings:borrowings-list")
+URL_WAITLIST = reverse("borrowings:waitlist-list")
+URL_CART = reverse("borrowings:borrowings-cart")
+URL_BULK_RETURN = reverse("borrowings:borrowings-bulk-return")
 BOOK_DATA = {
     "title": "Kolobok",
     "author": "unknown",
@@ -129,7 +144,7 @@ class Authenticated(TestCase):
         self.client.force_authenticate(user=auth_user)
         response = self.client.get(URL_BORROWING)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        for borrow in response.data:
+        for borrow in response.data["results"]:
             print(borrow["user"])
             self.assertEqual(borrow["user"], auth_user.id)
 
@@ -147,18 +162,20 @@ class Authenticated(TestCase):
         response = self.client.get(URL_BORROWING, {"is_active": "true"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         serializer_is_active = BorrowingSerializer(auth_user_borrow)
-        self.assertIn(serializer_is_active.data, response.data)
+        self.assertIn(serializer_is_active.data, response.data["results"])
         response = self.client.get(URL_BORROWING, {"is_active": "false"})
-        self.assertNotIn(serializer_is_active.data, response.data)
+        self.assertNotIn(serializer_is_active.data, response.data["results"])
 
         actual_return_date = date.today().strftime("%Y-%m-%d")
         auth_user_borrow.actual_return_date = actual_return_date
         auth_user_borrow.save()
         serializer_is_not_active = BorrowingSerializer(auth_user_borrow)
         response = self.client.get(URL_BORROWING, {"is_active": "true"})
-        self.assertNotIn(serializer_is_not_active.data, response.data)
+        self.assertNotIn(
+            serializer_is_not_active.data, response.data["results"]
+        )
         response = self.client.get(URL_BORROWING, {"is_active": "false"})
-        self.assertIn(serializer_is_not_active.data, response.data)
+        self.assertIn(serializer_is_not_active.data, response.data["results"])
 
     def test_filter_user_id(self):
         """filter shouldn`t working if user is not staff"""
@@ -178,7 +195,7 @@ class Authenticated(TestCase):
         for user_id in users:
             response = self.client.get(URL_BORROWING, {"user_id": user_id})
             self.assertEqual(response.status_code, status.HTTP_200_OK)
-            self.assertEqual(response.data, serializer.data)
+            self.assertEqual(response.data["results"], serializer.data)
 
     @mock.patch("borrowing.views.create_stripe_session")
     def test_authenticated_user_can_create_borrowing(
@@ -215,6 +232,88 @@ class Authenticated(TestCase):
             borrowing=created_borrowing, amount=amount, payments_type="PAYMENT"
         )
 
+    @mock.patch("payment.utils.create_payment")
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_failed_payment_undoes_borrowing(
+        self, mock_get_client, mock_create_payment
+    ):
+        mock_create_payment.side_effect = exceptions.ValidationError(
+            {"amount": ["invalid"]}
+        )
+        user = get_user_model().objects.create_user(
+            email="failed@example.com", password="password"
+        )
+        book = sample_book()
+        self.client.force_authenticate(user=user)
+        payload = {
+            "expected_return_date": date.today() + timedelta(days=2),
+            "book": book.id,
+        }
+        with self.assertLogs("payment.utils", "ERROR"):
+            response = self.client.post(URL_BORROWING, data=payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrowing.objects.exists())
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, BOOK_DATA["inventory"])
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_rejected_checkout_undoes_borrowing(self, mock_get_client):
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.side_effect = stripe.error.AuthenticationError(
+            "invalid api key"
+        )
+        user = get_user_model().objects.create_user(
+            email="rejected@example.com", password="password"
+        )
+        book = sample_book()
+        self.client.force_authenticate(user=user)
+        payload = {
+            "expected_return_date": date.today() + timedelta(days=2),
+            "book": book.id,
+        }
+        response = self.client.post(URL_BORROWING, data=payload)
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertFalse(Borrowing.objects.exists())
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, BOOK_DATA["inventory"])
+
+    @mock.patch("payment.utils.async_task")
+    @mock.patch("borrowing.views.create_stripe_session")
+    def test_async_checkout_defers_stripe_session(
+        self, mock_session_create, mock_async_task
+    ):
+        user = get_user_model().objects.create_user(
+            email="async@example.com", password="password"
+        )
+        book = sample_book()
+        self.client.force_authenticate(user=user)
+        payload = {
+            "expected_return_date": date.today() + timedelta(days=2),
+            "book": book.id,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"{URL_BORROWING}?checkout=async", data=payload
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        borrowing = Borrowing.objects.get(id=response.data["borrowing"])
+        payment = borrowing.payments.get()
+        self.assertEqual(payment.id, response.data["payment"])
+        self.assertEqual(payment.amount, 2 * book.daily_fee)
+        self.assertIsNone(payment.session_id)
+        self.assertEqual(
+            response["Location"],
+            response.wsgi_request.build_absolute_uri(
+                reverse(
+                    "payments:payments-checkout", kwargs={"pk": payment.id}
+                )
+            ),
+        )
+        mock_session_create.assert_not_called()
+        mock_async_task.assert_called_once_with(
+            "payment.utils.create_deferred_session", payment.id
+        )
+
     def test_should_not_create_with_invalid_data(self):
         book = sample_book()
         user = get_user_model().objects.create_user(
@@ -303,3 +402,632 @@ class Authenticated(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         response = self.client.post(f"{URL_BORROWING}{borrowing.id}/return/")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_last_copy_can_be_borrowed_only_once(self):
+        book = sample_book(inventory=1)
+        first_user, second_user = get_user_model().objects.bulk_create(
+            [
+                get_user_model()(email="first@example.com"),
+                get_user_model()(email="second@example.com"),
+            ]
+        )
+        payload = {
+            "expected_return_date": date.today() + timedelta(days=1),
+            "book": book.id,
+        }
+        with mock.patch(
+            "borrowing.views.create_stripe_session",
+            return_value=Response(status=status.HTTP_303_SEE_OTHER),
+        ):
+            self.client.force_authenticate(user=first_user)
+            self.client.post(URL_BORROWING, data=payload)
+            self.client.force_authenticate(user=second_user)
+            response = self.client.post(URL_BORROWING, data=payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 0)
+        self.assertEqual(Borrowing.objects.filter(book=book).count(), 1)
+        self.assertFalse(Book.objects.reserve(book.id))
+
+    def test_list_is_cursor_paginated(self):
+        (
+            book,
+            auth_user,
+            another_user,
+            admin,
+            user_borrow,
+            another_user_borrow,
+            admin_borrow,
+        ) = sample_bd()
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(URL_BORROWING, {"page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [borrow["id"] for borrow in response.data["results"]],
+            [admin_borrow.id, another_user_borrow.id],
+        )
+        self.assertIsNotNone(response.data["next"])
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [borrow["id"] for borrow in response.data["results"]],
+            [user_borrow.id],
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_list_pages_through_one_busy_date(self):
+        """More borrowings on one date than DRF's cursor offset cutoff"""
+        book = sample_book()
+        user = get_user_model().objects.create_user(
+            email="busy@example.com", password="password"
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=user,
+                expected_return_date=timezone_today(),
+                actual_return_date=timezone_today(),
+            )
+            for _ in range(1250)
+        )
+        self.client.force_authenticate(user=user)
+        seen = []
+        url, params = URL_BORROWING, {"page_size": 100}
+        # A stuck cursor would page forever, so stop after enough pages.
+        for _ in range(len(borrowings) // 100 + 2):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(borrow["id"] for borrow in response.data["results"])
+            url, params = response.data["next"], None
+            if url is None:
+                break
+        self.assertEqual(
+            seen, sorted((borrow.id for borrow in borrowings), reverse=True)
+        )
+
+
+class Holds(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        post_save.disconnect(borrowing_created, sender=Borrowing)
+        self.addCleanup(post_save.connect, borrowing_created, sender=Borrowing)
+        self.books = [sample_book(inventory=5), sample_book(inventory=5)]
+        self.users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"hold{i}@example.com") for i in range(3)
+        )
+
+    def borrow(self, user, book, hold_expires_at):
+        Book.objects.reserve(book.id)
+        return Borrowing.objects.create(
+            book=book,
+            user=user,
+            expected_return_date=timezone_today() + timedelta(days=1),
+            hold_expires_at=hold_expires_at,
+        )
+
+    @mock.patch("borrowing.views.create_stripe_session")
+    def test_new_borrowing_holds_its_copy(self, mock_session_create):
+        mock_session_create.return_value = Response(
+            status=status.HTTP_303_SEE_OTHER
+        )
+        self.client.force_authenticate(user=self.users[0])
+        self.client.post(
+            URL_BORROWING,
+            data={
+                "expected_return_date": date.today() + timedelta(days=1),
+                "book": self.books[0].id,
+            },
+        )
+        borrowing = Borrowing.objects.get()
+        self.assertAlmostEqual(
+            borrowing.hold_expires_at,
+            timezone.now() + BORROWING_HOLD_TTL,
+            delta=timedelta(minutes=1),
+        )
+
+    def test_expired_holds_are_released(self):
+        past = timezone.now() - timedelta(minutes=1)
+        first, second = self.books
+        expired = [
+            self.borrow(self.users[0], first, past),
+            self.borrow(self.users[1], first, past),
+            self.borrow(self.users[2], second, past),
+        ]
+        Payment.objects.create(
+            borrowing=expired[0],
+            amount=5,
+            session_id="cs_hold",
+            session_url="https://checkout.stripe.com/cs_hold",
+        )
+        held = self.borrow(
+            self.users[0], second, timezone.now() + timedelta(hours=1)
+        )
+        paid = self.borrow(self.users[1], second, None)
+
+        self.assertEqual(release_expired_holds(batch_size=2), 3)
+
+        remaining = Borrowing.objects.values_list("id", flat=True)
+        self.assertCountEqual(remaining, [held.id, paid.id])
+        self.assertFalse(Payment.objects.exists())
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.inventory, 5)
+        self.assertEqual(second.inventory, 3)
+        self.assertEqual(release_expired_holds(), 0)
+
+
+class NextAvailableOn(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        post_save.disconnect(borrowing_created, sender=Borrowing)
+        self.addCleanup(post_save.connect, borrowing_created, sender=Borrowing)
+        self.book = sample_book(inventory=2)
+        self.users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"next{i}@example.com") for i in range(3)
+        )
+
+    @mock.patch("borrowing.views.create_stripe_session")
+    def borrow(self, user, days, mock_session_create):
+        mock_session_create.return_value = Response(
+            status=status.HTTP_303_SEE_OTHER
+        )
+        self.client.force_authenticate(user=user)
+        return self.client.post(
+            URL_BORROWING,
+            data={
+                "book": self.book.id,
+                "expected_return_date": timezone_today()
+                + timedelta(days=days),
+            },
+        )
+
+    def next_available_on(self):
+        self.book.refresh_from_db()
+        return self.book.next_available_on
+
+    def test_next_available_on_follows_active_borrowings(self):
+        self.assertIsNone(self.next_available_on())
+        self.borrow(self.users[0], 7)
+        self.borrow(self.users[1], 3)
+        soonest = timezone_today() + timedelta(days=3)
+        self.assertEqual(self.next_available_on(), soonest)
+
+        response = self.borrow(self.users[2], 5)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(soonest), str(response.data))
+
+        self.client.force_authenticate(user=self.users[1])
+        borrowing = Borrowing.objects.get(user=self.users[1])
+        self.client.post(f"{URL_BORROWING}{borrowing.id}/return/")
+        self.assertEqual(
+            self.next_available_on(), timezone_today() + timedelta(days=7)
+        )
+
+        Borrowing.objects.filter(user=self.users[0]).update(
+            hold_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        release_expired_holds()
+        self.assertIsNone(self.next_available_on())
+
+    def test_overdue_borrowing_is_expected_back_today(self):
+        self.borrow(self.users[0], 3)
+        self.borrow(self.users[1], 7)
+        overdue = timezone_today() - timedelta(days=2)
+        Borrowing.objects.filter(user=self.users[0]).update(
+            borrow_date=overdue - timedelta(days=5),
+            expected_return_date=overdue,
+            hold_expires_at=None,
+        )
+        Book.objects.filter(id=self.book.id).update(next_available_on=overdue)
+
+        response = self.borrow(self.users[2], 5)
+        self.assertIn(str(timezone_today()), str(response.data))
+        response = self.client.get(
+            reverse("book:book-detail", args=[self.book.id])
+        )
+        self.assertEqual(
+            response.data["next_available_on"], str(timezone_today())
+        )
+
+        Book.objects.refresh_next_available([self.book.id])
+        self.assertEqual(self.next_available_on(), timezone_today())
+
+    def test_book_shows_next_available_on(self):
+        self.borrow(self.users[0], 3)
+        self.client.force_authenticate(user=self.users[1])
+        response = self.client.get(
+            reverse("book:book-detail", args=[self.book.id])
+        )
+        self.assertEqual(
+            response.data["next_available_on"],
+            str(timezone_today() + timedelta(days=3)),
+        )
+
+
+class Cart(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="cart@example.com", password="password", telegram_id=42
+        )
+        self.client.force_authenticate(user=self.user)
+        self.books = [
+            sample_book(title=f"Cart {i}", inventory=1, daily_fee=i + 1)
+            for i in range(3)
+        ]
+        self.expected_return_date = timezone_today() + timedelta(days=2)
+        patcher = mock.patch(
+            "payment.stripe_client.breaker",
+            CircuitBreaker(failure_threshold=1, reset_timeout=30),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def checkout(self, books, query=""):
+        return self.client.post(
+            f"{URL_CART}{query}",
+            {
+                "books": [book.id for book in books],
+                "expected_return_date": self.expected_return_date,
+            },
+            format="json",
+        )
+
+    def inventories(self):
+        return list(
+            Book.objects.filter(id__in=[book.id for book in self.books])
+            .order_by("id")
+            .values_list("inventory", flat=True)
+        )
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_cart_is_one_session_and_one_payment(self, mock_get_client):
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.return_value = mock.MagicMock(
+            id="cs_cart", url="https://checkout.stripe.com/cs_cart"
+        )
+
+        response = self.checkout(self.books)
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response["Location"], create_session.return_value.url)
+        self.assertEqual(self.inventories(), [0, 0, 0])
+        borrowings = Borrowing.objects.filter(user=self.user)
+        self.assertEqual(borrowings.count(), 3)
+        create_session.assert_called_once()
+        line_items = create_session.call_args.kwargs["params"]["line_items"]
+        self.assertEqual(
+            [item["price_data"]["unit_amount"] for item in line_items],
+            [200, 400, 600],
+        )
+        payment = Payment.objects.get()
+        self.assertEqual(payment.amount, 12)
+        self.assertCountEqual(payment.borrowings.all(), borrowings)
+        self.assertEqual(Notification.objects.count(), 1)
+
+        complete_payment("cs_cart")
+        self.assertFalse(
+            borrowings.filter(hold_expires_at__isnull=False).exists()
+        )
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_out_of_stock_book_fails_whole_cart(self, mock_get_client):
+        Book.objects.filter(id=self.books[1].id).update(inventory=0)
+
+        response = self.checkout(self.books)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.books[1].id), str(response.data))
+        self.assertEqual(self.inventories(), [1, 0, 1])
+        self.assertFalse(Borrowing.objects.exists())
+        mock_get_client.assert_not_called()
+
+    def test_invalid_carts(self):
+        Borrowing.objects.create(
+            book=self.books[0],
+            user=self.user,
+            expected_return_date=self.expected_return_date,
+        )
+        for books in ([], self.books[1:2] * 2, self.books[:2]):
+            response = self.checkout(books)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, books
+            )
+
+    def test_unavailable_stripe_undoes_cart(self):
+        with mock.patch("payment.utils.stripe_client.get_client") as client:
+            client.return_value.checkout.sessions.create.side_effect = (
+                stripe.error.APIConnectionError("timed out")
+            )
+            response = self.checkout(self.books)
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(self.inventories(), [1, 1, 1])
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_rejected_checkout_undoes_cart(self):
+        with mock.patch("payment.utils.stripe_client.get_client") as client:
+            client.return_value.checkout.sessions.create.side_effect = (
+                stripe.error.InvalidRequestError("bad request", None)
+            )
+            response = self.checkout(self.books)
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(self.inventories(), [1, 1, 1])
+        self.assertFalse(Borrowing.objects.exists())
+
+    @mock.patch("payment.utils.async_task")
+    def test_deferred_cart_checkout(self, mock_async_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout(self.books, "?checkout=async")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(response.data["borrowings"]), 3)
+        payment = Payment.objects.get(id=response.data["payment"])
+        self.assertEqual(payment.borrowings.count(), 3)
+        mock_async_task.assert_called_once_with(
+            "payment.utils.create_deferred_session", payment.id
+        )
+
+
+class BulkReturn(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        post_save.disconnect(borrowing_created, sender=Borrowing)
+        self.addCleanup(post_save.connect, borrowing_created, sender=Borrowing)
+        self.staff = get_user_model().objects.create_user(
+            email="desk@example.com", password="password", is_staff=True
+        )
+        self.books = [sample_book(inventory=0, daily_fee=5) for _ in range(2)]
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"desk{i}@example.com") for i in range(60)
+        )
+        self.borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=self.books[i % 2],
+                user=user,
+                expected_return_date=timezone_today() + timedelta(days=1),
+            )
+            for i, user in enumerate(users)
+        )
+
+    def bulk_return(self, ids):
+        self.client.force_authenticate(user=self.staff)
+        return self.client.post(
+            URL_BULK_RETURN, {"borrowings": ids}, format="json"
+        )
+
+    def make_overdue(self, borrowing):
+        Borrowing.objects.filter(id=borrowing.id).update(
+            borrow_date=timezone_today() - timedelta(days=10),
+            expected_return_date=timezone_today() - timedelta(days=2),
+        )
+
+    def test_staff_only(self):
+        self.client.force_authenticate(user=self.borrowings[0].user)
+        response = self.client.post(
+            URL_BULK_RETURN, {"borrowings": [1]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_per_item_results(self):
+        returned, fined, paid, done = self.borrowings[:4]
+        self.make_overdue(fined)
+        self.make_overdue(paid)
+        Payment.objects.create(
+            borrowing=paid,
+            type="FINE",
+            status="PAID",
+            amount=20,
+            session_id="cs_desk_fine",
+        )
+        Borrowing.objects.filter(id=done.id).update(
+            actual_return_date=timezone_today()
+        )
+        missing = self.borrowings[-1].id + 1
+
+        response = self.bulk_return(
+            [returned.id, fined.id, paid.id, done.id, missing, returned.id]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["returned"], 2)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": returned.id, "status": "returned"},
+                {"id": fined.id, "status": "fine_required", "fine": "20.00"},
+                {"id": paid.id, "status": "returned"},
+                {"id": done.id, "status": "already_returned"},
+                {"id": missing, "status": "not_found"},
+            ],
+        )
+        self.assertIsNone(
+            Borrowing.objects.get(id=fined.id).actual_return_date
+        )
+        inventories = [
+            Book.objects.get(id=book.id).inventory for book in self.books
+        ]
+        self.assertEqual(inventories, [2, 0])
+
+    def test_queries_do_not_grow_with_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            self.bulk_return([b.id for b in self.borrowings[:4]])
+        with CaptureQueriesContext(connection) as large:
+            self.bulk_return([b.id for b in self.borrowings[4:]])
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(
+            sum(Book.objects.values_list("inventory", flat=True)), 60
+        )
+
+
+class Waitlist(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        post_save.disconnect(borrowing_created, sender=Borrowing)
+        self.addCleanup(post_save.connect, borrowing_created, sender=Borrowing)
+        self.book = sample_book(inventory=0)
+        (
+            self.reader,
+            self.first,
+            self.second,
+        ) = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"wait{i}@example.com", telegram_id=100 + i)
+            for i in range(3)
+        )
+        self.borrowing = Borrowing.objects.create(
+            book=self.book,
+            user=self.reader,
+            expected_return_date=timezone_today() + timedelta(days=1),
+        )
+
+    def join(self, user, book=None):
+        self.client.force_authenticate(user=user)
+        return self.client.post(URL_WAITLIST, {"book": (book or self.book).id})
+
+    def return_book(self):
+        self.client.force_authenticate(user=self.reader)
+        return self.client.post(f"{URL_BORROWING}{self.borrowing.id}/return/")
+
+    def test_join_waitlist(self):
+        response = self.join(self.first)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["position"], 1)
+        self.assertEqual(self.join(self.second).data["position"], 2)
+
+        response = self.join(self.first)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.join(self.reader)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.join(self.first, sample_book(inventory=1))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_return_offers_copy_to_queue_head(self):
+        self.join(self.first)
+        self.join(self.second)
+
+        self.assertEqual(self.return_book().status_code, status.HTTP_200_OK)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        offer = WaitlistEntry.objects.get(user=self.first)
+        self.assertEqual(offer.status, WaitlistEntry.Status.OFFERED)
+        self.assertIsNotNone(offer.offer_expires_at)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.telegram_id, self.first.telegram_id)
+        self.assertIn(self.book.title, notification.text)
+        self.assertEqual(
+            WaitlistEntry.objects.get(user=self.second).status,
+            WaitlistEntry.Status.WAITING,
+        )
+
+    @mock.patch("borrowing.views.create_stripe_session")
+    def test_offered_reader_claims_copy(self, mock_session_create):
+        mock_session_create.return_value = Response(
+            status=status.HTTP_303_SEE_OTHER
+        )
+        self.join(self.first)
+        self.join(self.second)
+        self.return_book()
+
+        # Nobody but the offered reader can take the held copy.
+        self.client.force_authenticate(user=self.second)
+        data = {
+            "book": self.book.id,
+            "expected_return_date": timezone_today() + timedelta(days=1),
+        }
+        response = self.client.post(URL_BORROWING, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.first)
+        response = self.client.post(URL_BORROWING, data)
+        self.assertEqual(response.status_code, status.HTTP_303_SEE_OTHER)
+        self.assertTrue(
+            Borrowing.objects.filter(user=self.first, book=self.book).exists()
+        )
+        self.assertEqual(
+            WaitlistEntry.objects.get(user=self.first).status,
+            WaitlistEntry.Status.CLAIMED,
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_expired_offer_passes_copy_on(self):
+        self.join(self.first)
+        self.join(self.second)
+        self.return_book()
+        WaitlistEntry.objects.filter(user=self.first).update(
+            offer_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+        self.assertEqual(expire_offers(), 1)
+
+        self.assertEqual(
+            WaitlistEntry.objects.get(user=self.first).status,
+            WaitlistEntry.Status.EXPIRED,
+        )
+        self.assertEqual(
+            WaitlistEntry.objects.get(user=self.second).status,
+            WaitlistEntry.Status.OFFERED,
+        )
+        WaitlistEntry.objects.filter(user=self.second).update(
+            offer_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(expire_offers(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+        self.assertEqual(expire_offers(), 0)
+
+    def test_cancel_offer_releases_copy(self):
+        entry_id = self.join(self.first).data["id"]
+        self.return_book()
+
+        self.client.force_authenticate(user=self.first)
+        response = self.client.delete(f"{URL_WAITLIST}{entry_id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(
+            WaitlistEntry.objects.get(id=entry_id).status,
+            WaitlistEntry.Status.CANCELLED,
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+        self.assertEqual(self.client.get(URL_WAITLIST).data, [])
+
+
+class QueryBudget(QueryBudgetMixin, TestCase):
+    def test_borrowing_list(self):
+        post_save.disconnect(borrowing_created, sender=Borrowing)
+        self.addCleanup(post_save.connect, borrowing_created, sender=Borrowing)
+        user = get_user_model().objects.create_user(
+            email="budget@example.com", password="password"
+        )
+
+        def add_borrowings(count):
+            books = Book.objects.bulk_create(
+                Book(**BOOK_DATA) for _ in range(count)
+            )
+            Borrowing.objects.bulk_create(
+                Borrowing(
+                    book=book,
+                    user=user,
+                    expected_return_date=timezone_today() + timedelta(days=1),
+                )
+                for book in books
+            )
+
+        # Authentication and the page.
+        self.assertQueryBudget(URL_BORROWING, 2, add_borrowings, user=user)
+
+
+class Schedules(TestCase):
+    def test_maintenance_is_scheduled_without_the_bot(self):
+        self.assertCountEqual(
+            Schedule.objects.filter(func__startswith="borrowing.").values_list(
+                "func", flat=True
+            ),
+            [
+                "borrowing.holds.release_expired_holds",
+                "borrowing.waitlist.expire_offers",
+            ],
+        )
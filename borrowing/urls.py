@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from borrowing.views import BorrowingViewSet
+from borrowing.views import BorrowingViewSet, WaitlistViewSet
 
 
 app_name = "borrowings"
 
 router = DefaultRouter()
+# Before the borrowings, whose detail route would take "waitlist" as a pk.
+router.register("waitlist", WaitlistViewSet, basename="waitlist")
 router.register("", BorrowingViewSet, basename="borrowings")
 
 urlpatterns = [
@@ -1,5 +1,6 @@
+import logging
+
 from django.db import transaction
-from django.db.models import F
 from django.views.generic.dates import timezone_today
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (
@@ -10,21 +11,46 @@ from drf_spectacular.utils import (
 )
 from rest_framework import viewsets, generics, mixins, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from stripe.error import StripeError
 
-from book.models import Book
-from borrowing.models import Borrowing
+from borrowing.models import Borrowing, WaitlistEntry
+from borrowing.pagination import BorrowingCursorPagination
 from borrowing.serializers import (
     BorrowingSerializer,
     BorrowingBookReturnSerializer,
+    BulkReturnSerializer,
+    CartSerializer,
     DetailBorrowingSerializer,
+    DetailWaitlistEntrySerializer,
+    WaitlistEntrySerializer,
 )
+from borrowing.returns import ReturnStatus, fine_amount, return_borrowings
+from borrowing.waitlist import cancel_entry, release_borrowed_copies
 from payment.models import Payment
 
-from payment.utils import create_stripe_session
+from payment.stripe_client import StripeRejected, StripeUnavailable
+from payment.utils import (
+    cancel_borrowings,
+    create_cart_session,
+    create_stripe_session,
+    defer_cart_session,
+    defer_stripe_session,
+    rental_fee,
+)
+
+logger = logging.getLogger(__name__)
 
-FINE_MULTIPLIER = 2
+
+def checkout_error(error: Exception) -> Exception:
+    """The error to answer a failed checkout with, once it is undone."""
+    if isinstance(error, StripeError):
+        logger.warning("Stripe rejected the checkout: %s", error)
+        return StripeRejected()
+    return error
 
 
 class BorrowingViewSet(
@@ -37,10 +63,11 @@ class BorrowingViewSet(
 
     serializer_class = BorrowingSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = BorrowingCursorPagination
 
     def get_queryset(self):
         """filtering by user and is_active"""
-        queryset = Borrowing.objects.all()
+        queryset = Borrowing.objects.select_related("book")
         if not self.request.user.is_staff:
             queryset = queryset.filter(user=self.request.user)
         user_id = self.request.query_params.get("user_id", None)
@@ -69,6 +96,19 @@ class BorrowingViewSet(
 
     @extend_schema(
         request=BorrowingSerializer,  # Вхідні дані
+        parameters=[
+            OpenApiParameter(
+                name="checkout",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                enum=["async"],
+                description=(
+                    "async: answer 202 right away and create the Stripe "
+                    "session in the background; poll the returned "
+                    "checkout URL for the payment page"
+                ),
+            ),
+        ],
         responses={
             303: OpenApiResponse(
                 description="Redirect to Stripe Checkout session",
@@ -81,6 +121,28 @@ class BorrowingViewSet(
                     )
                 ],
             ),
+            202: OpenApiResponse(
+                description="Async checkout: the payment is pending, poll "
+                "`checkout` for the Stripe session URL",
+                examples=[
+                    OpenApiExample(
+                        "Deferred checkout",
+                        value={
+                            "borrowing": 1,
+                            "payment": 1,
+                            "checkout": "http://localhost:8000/payments/1/checkout/",
+                        },
+                    )
+                ],
+            ),
+            502: OpenApiResponse(
+                description="Stripe rejected the checkout; nothing was "
+                "borrowed"
+            ),
+            503: OpenApiResponse(
+                description="Stripe is unavailable, retry after the "
+                "Retry-After header"
+            ),
         },
         description=(
             "Creates a new borrowing instance and initiates a Stripe Checkout "
@@ -92,24 +154,122 @@ class BorrowingViewSet(
         """When create borrowing call create_stripe_session"""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if request.query_params.get("checkout") == "async":
+            return self.create_deferred(serializer)
         borrowing = self.perform_create(serializer)
-        amount = (
-            borrowing.expected_return_date - borrowing.borrow_date
-        ).days * borrowing.book.daily_fee
-        return create_stripe_session(
-            borrowing=borrowing, amount=amount, payments_type="PAYMENT"
+        amount = self.borrowing_amount(borrowing)
+        try:
+            return create_stripe_session(
+                borrowing=borrowing, amount=amount, payments_type="PAYMENT"
+            )
+        except (StripeUnavailable, ValidationError, StripeError) as error:
+            # Undo the borrowing so the client can simply retry later.
+            cancel_borrowings([borrowing.id])
+            raise checkout_error(error)
+
+    def create_deferred(self, serializer):
+        """
+        Create the borrowing and its pending payment in one transaction and
+        leave the Stripe call to a django-q worker.
+        """
+        with transaction.atomic():
+            borrowing = self.perform_create(serializer)
+            payment = defer_stripe_session(
+                borrowing=borrowing,
+                amount=self.borrowing_amount(borrowing),
+                payments_type="PAYMENT",
+            )
+        return self.checkout_accepted(payment, borrowing=borrowing.id)
+
+    def checkout_accepted(self, payment, **data):
+        """202 answer of a deferred checkout, pointing at its poll URL."""
+        checkout = reverse(
+            "payments:payments-checkout",
+            kwargs={"pk": payment.id},
+            request=self.request,
+        )
+        return Response(
+            {**data, "payment": payment.id, "checkout": checkout},
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": checkout},
         )
 
+    @extend_schema(
+        request=CartSerializer,
+        parameters=[
+            OpenApiParameter(
+                name="checkout",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                enum=["async"],
+                description="As for creating a single borrowing",
+            ),
+        ],
+        responses={
+            303: OpenApiResponse(
+                description="Redirect to one Stripe Checkout session for "
+                "the whole cart"
+            ),
+            202: OpenApiResponse(
+                description="Async checkout: the payment is pending, poll "
+                "`checkout` for the Stripe session URL"
+            ),
+            400: OpenApiResponse(
+                description="A book is out of stock or already borrowed; "
+                "nothing was borrowed"
+            ),
+            502: OpenApiResponse(
+                description="Stripe rejected the checkout; nothing was "
+                "borrowed"
+            ),
+            503: OpenApiResponse(
+                description="Stripe is unavailable, retry after the "
+                "Retry-After header"
+            ),
+        },
+        description=(
+            "Borrows several books at once, all or nothing, and pays for "
+            "them with one Stripe Checkout session and one payment."
+        ),
+    )
+    @action(detail=False, methods=["post"], url_path="cart")
+    def cart(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.query_params.get("checkout") == "async":
+            with transaction.atomic():
+                borrowings = self.perform_create(serializer)
+                payment = defer_cart_session(borrowings)
+            return self.checkout_accepted(
+                payment,
+                borrowings=[borrowing.id for borrowing in borrowings],
+            )
+        borrowings = self.perform_create(serializer)
+        try:
+            return create_cart_session(borrowings)
+        except (StripeUnavailable, StripeError) as error:
+            # Undo the cart so the client can simply retry later.
+            cancel_borrowings([borrowing.id for borrowing in borrowings])
+            raise checkout_error(error)
+
+    @staticmethod
+    def borrowing_amount(borrowing: Borrowing):
+        return rental_fee(borrowing)
+
     def get_serializer_class(self):
         if self.action == "return_book":
             return BorrowingBookReturnSerializer
         if self.action == "retrieve":
             return DetailBorrowingSerializer
+        if self.action == "cart":
+            return CartSerializer
+        if self.action == "bulk_return":
+            return BulkReturnSerializer
         return BorrowingSerializer
 
     @extend_schema(
         description="Return a borrowed book, update its inventory, "
-                    "and handle late return fines.",
+        "and handle late return fines.",
         parameters=[
             OpenApiParameter(
                 name="borrow_id",
@@ -134,10 +294,8 @@ class BorrowingViewSet(
                     borrowing=borrowing, type="FINE", status="PAID"
                 ).exists()
             ):
-                amount = (
-                    (timezone_today() - borrowing.expected_return_date).days
-                    * borrowing.book.daily_fee
-                    * FINE_MULTIPLIER
+                amount = fine_amount(
+                    borrowing.expected_return_date, borrowing.book.daily_fee
                 )
                 return create_stripe_session(
                     borrowing=borrowing, amount=amount, payments_type="FINE"
@@ -146,21 +304,69 @@ class BorrowingViewSet(
             with transaction.atomic():
                 borrowing.actual_return_date = timezone_today()
                 borrowing.save()
-                book_id = borrowing.book.id
                 serializer.save()
-                Book.objects.filter(pk=book_id).update(
-                    inventory=F("inventory") + 1
-                )
+                release_borrowed_copies({borrowing.book_id: 1})
                 return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @extend_schema(
+        request=BulkReturnSerializer,
+        responses={
+            200: OpenApiResponse(
+                description="What happened to each borrowing",
+                examples=[
+                    OpenApiExample(
+                        "Batch from the desk scanner",
+                        value={
+                            "returned": 1,
+                            "results": [
+                                {"id": 1, "status": "returned"},
+                                {
+                                    "id": 2,
+                                    "status": "fine_required",
+                                    "fine": "20.00",
+                                },
+                                {"id": 3, "status": "already_returned"},
+                                {"id": 4, "status": "not_found"},
+                            ],
+                        },
+                    )
+                ],
+            ),
+        },
+        description=(
+            "Staff only. Returns a batch of borrowings in one transaction. "
+            "Overdue borrowings without a paid fine are not returned; they "
+            "are reported with the fine for a FINE checkout."
+        ),
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-return",
+        permission_classes=(IsAdminUser,),
+    )
+    def bulk_return(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = return_borrowings(serializer.validated_data["borrowings"])
+        return Response(
+            {
+                "returned": sum(
+                    result["status"] == ReturnStatus.RETURNED
+                    for result in results
+                ),
+                "results": results,
+            }
+        )
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
                 "user_id",
                 type=OpenApiTypes.INT,
                 description="Filter by user ID "
-                            "(available only for staff users).",
+                "(available only for staff users).",
                 location=OpenApiParameter.QUERY,
                 required=False,
             ),
@@ -178,3 +384,42 @@ class BorrowingViewSet(
     def list(self, request, *args, **kwargs):
         """Get list of borrowings"""
         return super().list(request, *args, **kwargs)
+
+
+class WaitlistViewSet(
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Queue for out-of-stock books. A returned copy is offered to the first
+    reader in the queue and held for them; they are told on Telegram.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        queryset = WaitlistEntry.objects.filter(user=self.request.user)
+        if self.action == "list":
+            queryset = queryset.filter(status__in=WaitlistEntry.ACTIVE)
+        return queryset.order_by("-id")
+
+    def get_serializer_class(self):
+        if self.action in ("create", "retrieve"):
+            return DetailWaitlistEntrySerializer
+        return WaitlistEntrySerializer
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @extend_schema(
+        description=(
+            "Leave the waitlist. A copy already offered to you goes to the "
+            "next reader."
+        )
+    )
+    def destroy(self, request, *args, **kwargs):
+        cancel_entry(self.get_object().id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,197 @@
+"""
+Waitlists for out-of-stock books.
+
+A returned copy goes to the head of the book's queue instead of back to
+inventory: the reader's entry becomes an offer, the copy is held for
+them until the offer expires, and a Telegram message is queued in the
+outbox for the django-q cluster. Borrowing the book claims the offer. A
+periodic django-q job passes the copies of expired offers on to the next
+reader, or back to inventory once nobody is waiting.
+
+Queue heads are found through the partial index on (book, id) of waiting
+entries, so every queue operation is an index lookup however long the
+queue grows.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import WaitlistEntry
+from telegram_bot.notifications import waitlist_offer_text
+from telegram_bot.outbox import enqueue
+
+WAITLIST_OFFER_TTL = timedelta(hours=24)
+OFFER_BATCH_SIZE = 500
+
+
+def offer_deadline():
+    return timezone.now() + WAITLIST_OFFER_TTL
+
+
+def release_copies(copies: dict[int, int]) -> int:
+    """
+    Put freed copies back: each copy is offered to the next waiting
+    reader of its book and the rest return to inventory in one UPDATE.
+    `copies` maps book ids to numbers of copies. SKIP LOCKED lets
+    concurrent returns of one book make offers to different readers.
+    Returns the number of offers made.
+    """
+    offered = []
+    leftover = Counter(copies)
+    with transaction.atomic():
+        # Most freed books have nobody waiting; find the ones that do in
+        # one query and only look up queue heads for those.
+        queued = (
+            WaitlistEntry.objects.filter(
+                book_id__in=copies, status=WaitlistEntry.Status.WAITING
+            )
+            .order_by()
+            .values_list("book_id", flat=True)
+            .distinct()
+        )
+        for book_id in queued:
+            count = copies[book_id]
+            heads = list(
+                WaitlistEntry.objects.select_for_update(skip_locked=True)
+                .filter(book_id=book_id, status=WaitlistEntry.Status.WAITING)
+                .order_by("id")
+                .values_list("id", flat=True)[:count]
+            )
+            offered += heads
+            leftover[book_id] -= len(heads)
+        if offered:
+            expires_at = offer_deadline()
+            WaitlistEntry.objects.filter(id__in=offered).update(
+                status=WaitlistEntry.Status.OFFERED,
+                offer_expires_at=expires_at,
+            )
+            notify_offers(offered, expires_at)
+        # Unary plus drops the books whose copies all went to readers.
+        Book.objects.release_many(+leftover)
+    return len(offered)
+
+
+def release_borrowed_copies(copies: dict[int, int]) -> int:
+    """
+    Release the copies of borrowings that were just returned or
+    cancelled, and move the next available dates of their books on.
+    """
+    Book.objects.refresh_next_available(copies)
+    return release_copies(copies)
+
+
+def notify_offers(entry_ids: list[int], expires_at) -> None:
+    for telegram_id, title in WaitlistEntry.objects.filter(
+        id__in=entry_ids, user__telegram_id__isnull=False
+    ).values_list("user__telegram_id", "book__title"):
+        enqueue(
+            telegram_id=telegram_id,
+            text=waitlist_offer_text(title, expires_at),
+        )
+
+
+def claim_offer(book_id: int, user_id: int) -> bool:
+    """
+    Take the copy offered to the user, if the offer is still open.
+    Returns True if the user now has the copy.
+    """
+    return bool(
+        WaitlistEntry.objects.filter(
+            book_id=book_id,
+            user_id=user_id,
+            status=WaitlistEntry.Status.OFFERED,
+            offer_expires_at__gt=timezone.now(),
+        ).update(status=WaitlistEntry.Status.CLAIMED)
+    )
+
+
+def claim_offers(book_ids, user_id: int) -> set[int]:
+    """
+    Take the copies offered to the user for any of the books, locking
+    the offers so an expiry running at the same time can not pass them
+    on. Returns the ids of the books the user now has a copy of.
+    """
+    with transaction.atomic():
+        offers = dict(
+            WaitlistEntry.objects.select_for_update()
+            .filter(
+                book_id__in=book_ids,
+                user_id=user_id,
+                status=WaitlistEntry.Status.OFFERED,
+                offer_expires_at__gt=timezone.now(),
+            )
+            .values_list("id", "book_id")
+        )
+        if offers:
+            WaitlistEntry.objects.filter(id__in=offers).update(
+                status=WaitlistEntry.Status.CLAIMED
+            )
+    return set(offers.values())
+
+
+def leave_queue(book_id: int, user_id: int) -> None:
+    """Drop the user from the book's queue once they got a copy."""
+    leave_queues([book_id], user_id)
+
+
+def leave_queues(book_ids, user_id: int) -> None:
+    """Drop the user from the queues of the books they got copies of."""
+    WaitlistEntry.objects.filter(
+        book_id__in=book_ids,
+        user_id=user_id,
+        status=WaitlistEntry.Status.WAITING,
+    ).update(status=WaitlistEntry.Status.CLAIMED)
+
+
+def cancel_entry(entry_id: int) -> bool:
+    """
+    Take the reader off the waitlist. A copy already offered to them
+    goes to the next reader. Returns False if the entry was not active.
+    """
+    with transaction.atomic():
+        entry = (
+            WaitlistEntry.objects.select_for_update()
+            .filter(id=entry_id, status__in=WaitlistEntry.ACTIVE)
+            .first()
+        )
+        if entry is None:
+            return False
+        WaitlistEntry.objects.filter(id=entry.id).update(
+            status=WaitlistEntry.Status.CANCELLED
+        )
+        if entry.status == WaitlistEntry.Status.OFFERED:
+            release_copies({entry.book_id: 1})
+    return True
+
+
+def expire_offers(batch_size: int = OFFER_BATCH_SIZE) -> int:
+    """
+    Expire offers that were not claimed in time and pass their copies
+    on. Open offers are found through the partial index on
+    offer_expires_at and claimed with SKIP LOCKED, so an offer being
+    claimed right now is left alone. Returns the number of expired
+    offers.
+    """
+    expired_total = 0
+    while True:
+        with transaction.atomic():
+            expired = dict(
+                WaitlistEntry.objects.select_for_update(skip_locked=True)
+                .filter(
+                    status=WaitlistEntry.Status.OFFERED,
+                    offer_expires_at__lt=timezone.now(),
+                )
+                .order_by("offer_expires_at")
+                .values_list("id", "book_id")[:batch_size]
+            )
+            if not expired:
+                return expired_total
+            WaitlistEntry.objects.filter(id__in=expired).update(
+                status=WaitlistEntry.Status.EXPIRED
+            )
+            release_copies(Counter(expired.values()))
+            expired_total += len(expired)
@@ -0,0 +1,95 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from payment.models import StripeEvent
+from payment.utils import complete_payment, expire_payment
+
+logger = logging.getLogger(__name__)
+
+EVENT_BATCH_SIZE = 100
+EVENT_MAX_ATTEMPTS = 5
+
+CHECKOUT_COMPLETED_EVENTS = (
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+)
+
+
+def record_event(event: dict) -> bool:
+    """
+    Store a verified webhook event and ask django-q to process it once
+    the row is committed. Returns False for an event that was already
+    recorded, which costs a single failed INSERT and schedules nothing.
+    """
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(
+                id=event["id"], type=event["type"], payload=event
+            )
+    except IntegrityError:
+        return False
+    transaction.on_commit(schedule_processing)
+    return True
+
+
+def schedule_processing() -> None:
+    try:
+        async_task("payment.events.process_pending")
+    except Exception as error:
+        # The periodic schedule picks the event up on its next run.
+        logger.warning("Could not queue Stripe event processing: %s", error)
+
+
+def handle_event(event: StripeEvent) -> None:
+    if event.type in CHECKOUT_COMPLETED_EVENTS:
+        complete_payment(session_id=event.payload["data"]["object"]["id"])
+    elif event.type == "checkout.session.expired":
+        expire_payment(session_id=event.payload["data"]["object"]["id"])
+
+
+def process_pending(batch_size: int = EVENT_BATCH_SIZE) -> int:
+    """
+    Process recorded events in batches, oldest first. Events are claimed
+    with SKIP LOCKED, so several workers can share the backlog and no
+    event is handled twice. Returns the number of processed events.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StripeEvent.objects.select_for_update(skip_locked=True)
+                .filter(status=StripeEvent.Status.PENDING)
+                .order_by("received_at")[:batch_size]
+            )
+            if not batch:
+                return processed
+            done_ids = []
+            for event in batch:
+                try:
+                    with transaction.atomic():
+                        handle_event(event)
+                except Exception as error:
+                    _record_failure(event, error)
+                else:
+                    done_ids.append(event.id)
+            StripeEvent.objects.filter(id__in=done_ids).update(
+                status=StripeEvent.Status.PROCESSED,
+                processed_at=timezone.now(),
+            )
+            processed += len(done_ids)
+            if len(done_ids) < len(batch):
+                # Failed events stay pending; leave them for the next run
+                # instead of retrying them in a tight loop.
+                return processed
+
+
+def _record_failure(event: StripeEvent, error: Exception) -> None:
+    logger.warning("Stripe event %s failed: %s", event.id, error)
+    event.attempts += 1
+    event.last_error = str(error)
+    if event.attempts >= EVENT_MAX_ATTEMPTS:
+        event.status = StripeEvent.Status.FAILED
+    event.save(update_fields=["attempts", "last_error", "status"])
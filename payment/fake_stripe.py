@@ -0,0 +1,126 @@
+"""
+Local stand-in for the parts of the Stripe API the service uses, for
+benchmarks and offline runs.
+
+It creates and retrieves Checkout Sessions and builds webhook events
+signed with a test secret, exactly like Stripe signs them, so they pass
+stripe.Webhook.construct_event in the webhook view.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+FAKE_STRIPE_LATENCY = 0.05
+# Stripe's default Checkout Session lifetime, in seconds.
+SESSION_LIFETIME = 24 * 60 * 60
+
+
+class FakeStripe:
+    def __init__(self, webhook_secret: str, latency=FAKE_STRIPE_LATENCY):
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.sessions = {}
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    @staticmethod
+    def _amount_total(data) -> int:
+        """Sum of the form-encoded line items, as Stripe reports it."""
+        total = 0
+        for key, value in data.items():
+            if key.endswith("[price_data][unit_amount]"):
+                item = key[: key.index("[price_data]")]
+                total += int(value) * int(data.get(f"{item}[quantity]", 1))
+        return total
+
+    def _session(self, session_id: str, data) -> dict:
+        return {
+            "id": session_id,
+            "object": "checkout.session",
+            "amount_total": self._amount_total(data),
+            "currency": "usd",
+            "mode": data.get("mode", "payment"),
+            "status": "open",
+            "payment_status": "unpaid",
+            "url": f"{self.url}/pay/{session_id}",
+            "created": int(time.time()),
+            "expires_at": int(
+                data.get("expires_at", time.time() + SESSION_LIFETIME)
+            ),
+        }
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        data = await request.post()
+        await asyncio.sleep(self.latency)
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = self._session(session_id, data)
+        return web.json_response(self.sessions[session_id])
+
+    async def retrieve_session(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            return web.json_response(
+                {
+                    "error": {
+                        "type": "invalid_request_error",
+                        "message": "No such checkout.session",
+                    }
+                },
+                status=404,
+            )
+        return web.json_response(session)
+
+    def complete(self, session_id: str) -> dict:
+        """Mark the session paid and return its completion event."""
+        session = self.sessions[session_id]
+        session.update(status="complete", payment_status="paid")
+        return {
+            "id": f"evt_{uuid.uuid4().hex}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "created": int(time.time()),
+            "data": {"object": session},
+        }
+
+    def sign(self, payload: bytes) -> str:
+        """Stripe-Signature header for the payload."""
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode(),
+            f"{timestamp}.".encode() + payload,
+            hashlib.sha256,
+        ).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    def signed_event(self, session_id: str) -> tuple[bytes, str]:
+        """Payload and signature of the session's completion webhook."""
+        payload = json.dumps(self.complete(session_id)).encode()
+        return payload, self.sign(payload)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and return the base URL for STRIPE_API_BASE."""
+        app = web.Application()
+        app.router.add_post("/v1/checkout/sessions", self.create_session)
+        app.router.add_get(
+            "/v1/checkout/sessions/{session_id}", self.retrieve_session
+        )
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
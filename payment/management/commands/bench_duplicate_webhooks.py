@@ -0,0 +1,116 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.views.generic.dates import timezone_today
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.events import process_pending, record_event
+from payment.models import Payment, StripeEvent
+from payment.utils import complete_payment
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires N duplicate checkout events for one fine payment from "
+        "parallel workers and checks that it is completed exactly once"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=32)
+
+    def handle(self, *args, **options):
+        events = options["events"]
+        workers = options["workers"]
+        tag = uuid.uuid4().hex[:12]
+
+        user = get_user_model().objects.create(
+            email=f"bench-{tag}@example.com"
+        )
+        book = Book.objects.create(
+            title="bench fine book",
+            author="bench",
+            cover=Book.Cover.SOFT,
+            inventory=5,
+            daily_fee=1,
+        )
+        borrowing = Borrowing.objects.create(
+            book=book,
+            user=user,
+            expected_return_date=timezone_today() + timedelta(days=1),
+        )
+        payment = Payment.objects.create(
+            borrowing=borrowing,
+            type="FINE",
+            amount=1,
+            session_id=f"cs_bench_{tag}",
+            session_url="https://checkout.stripe.com/bench",
+        )
+        event = {
+            "id": f"evt_bench_{tag}",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": payment.session_id}},
+        }
+
+        def in_worker(func):
+            def run(_):
+                try:
+                    return func()
+                finally:
+                    connection.close()
+
+            return run
+
+        def fire(func) -> tuple[list, float]:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(in_worker(func), range(events)))
+            return results, time.perf_counter() - started
+
+        try:
+            recorded, record_time = fire(lambda: record_event(event))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                processed = sum(
+                    pool.map(in_worker(process_pending), range(workers))
+                )
+            completed, complete_time = fire(
+                lambda: complete_payment(payment.session_id)
+            )
+
+            payment.refresh_from_db()
+            borrowing.refresh_from_db()
+            book.refresh_from_db()
+            stored = StripeEvent.objects.filter(id=event["id"]).count()
+            self.stdout.write(
+                f"events: {events}, workers: {workers}\n"
+                f"webhook ingest: {events / record_time:.1f} events/s, "
+                f"stored: {stored}, new: {sum(recorded)}, "
+                f"processed: {processed}\n"
+                f"direct completion: {events / complete_time:.1f} calls/s, "
+                f"completed again: {sum(completed)}\n"
+                f"payment: {payment.status}, returned: "
+                f"{borrowing.actual_return_date}, inventory: 5 -> "
+                f"{book.inventory}"
+            )
+            if (
+                stored == 1
+                and sum(recorded) == 1
+                and processed == 1
+                and sum(completed) == 0
+                and payment.status == "PAID"
+                and borrowing.actual_return_date is not None
+                and book.inventory == 6
+            ):
+                self.stdout.write(self.style.SUCCESS("Invariants hold"))
+            else:
+                self.stdout.write(self.style.ERROR("Invariant broken"))
+        finally:
+            StripeEvent.objects.filter(id=event["id"]).delete()
+            book.delete()
+            user.delete()
@@ -0,0 +1,181 @@
+import statistics
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from book.models import Book
+from borrowing.models import Borrowing
+from payment.models import Payment
+from payment.views import PaymentListView
+
+SCENARIOS = {
+    "own": ("user", {}),
+    "staff all": ("staff", {}),
+    "staff status=PENDING": ("staff", {"status": "PENDING"}),
+    "staff type=FINE": ("staff", {"type": "FINE"}),
+    "staff status+type": ("staff", {"status": "PAID", "type": "FINE"}),
+    "staff last 30 days": ("staff", {"created_after": 30}),
+    "staff user_id": ("staff", {"user_id": None}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds payments in steps and measures PaymentListView latency and "
+        "query count for the first and a deep page at each table size"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10_000, 100_000, 1_000_000],
+            help="Table sizes to measure, e.g. 10000 1000000 10000000",
+        )
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--repeats", type=int, default=20)
+        parser.add_argument("--depth", type=int, default=10)
+
+    def handle(self, *args, **options):
+        book = Book.objects.create(
+            title="bench payment book",
+            author="bench",
+            cover=Book.Cover.SOFT,
+            inventory=0,
+            daily_fee=1,
+        )
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"bench-pay-{book.id}-{i}@example.com")
+            for i in range(options["users"])
+        )
+        staff = get_user_model().objects.create(
+            email=f"bench-pay-{book.id}-staff@example.com", is_staff=True
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=user,
+                expected_return_date=timezone.localdate(),
+                actual_return_date=timezone.localdate(),
+            )
+            for user in users
+        )
+        self.factory = APIRequestFactory()
+        self.view = PaymentListView.as_view()
+        self.actors = {"user": users[0], "staff": staff}
+        self.user_id = users[0].id
+        try:
+            seeded = 0
+            for size in sorted(options["sizes"]):
+                self.seed(book, borrowings, seeded, size)
+                seeded = size
+                self.stdout.write(f"--- {size} payments")
+                for name, (actor, params) in SCENARIOS.items():
+                    first, deep, queries = self.measure(
+                        actor, params, options["repeats"], options["depth"]
+                    )
+                    self.stdout.write(
+                        f"{name:<22} first page p50 {first:7.2f} ms, "
+                        f"page {options['depth']} p50 {deep:7.2f} ms, "
+                        f"{queries} queries"
+                    )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Payment._meta.db_table} "
+                    f"WHERE session_id LIKE %s",
+                    [f"cs_bench_{book.id}_%"],
+                )
+            Borrowing.objects.filter(book=book).delete()
+            book.delete()
+            get_user_model().objects.filter(
+                id__in=[user.id for user in users] + [staff.id]
+            ).delete()
+
+    def seed(self, book, borrowings, start, stop):
+        """
+        Insert payments start + 1..stop in one statement, spread over the
+        last ten years. Every fourth payment is a fine, older payments
+        are paid and the newest ones are still pending.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Payment._meta.db_table}
+                    (status, type, borrowing_id, session_id, session_url,
+                     amount, created_at)
+                SELECT
+                    CASE WHEN i %% 50 = 0 THEN 'PENDING' ELSE 'PAID' END,
+                    CASE WHEN i %% 4 = 0 THEN 'FINE' ELSE 'PAYMENT' END,
+                    (%(borrowing_ids)s::bigint[])[1 + i %% %(borrowings)s],
+                    'cs_bench_' || %(book)s || '_' || i,
+                    'https://checkout.stripe.com/bench',
+                    10,
+                    now() - (i %% 3650) * interval '1 day'
+                        - (i %% 86400) * interval '1 second'
+                FROM generate_series(%(start)s, %(stop)s) AS i
+                """,
+                {
+                    "borrowing_ids": [
+                        borrowing.id for borrowing in borrowings
+                    ],
+                    "borrowings": len(borrowings),
+                    "book": book.id,
+                    "start": start + 1,
+                    "stop": stop,
+                },
+            )
+            cursor.execute(f"ANALYZE {Payment._meta.db_table}")
+
+    def get(self, actor, params):
+        request = self.factory.get(
+            "/payments/", params, SERVER_NAME="localhost"
+        )
+        force_authenticate(request, user=self.actors[actor])
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.view(request)
+            response.render()
+            elapsed = (time.perf_counter() - started) * 1000
+        return elapsed, response, len(queries)
+
+    def measure(self, actor, params, repeats, depth):
+        params = {
+            key: self.resolve(key, value) for key, value in params.items()
+        }
+        first, deep = [], []
+        for _ in range(repeats):
+            elapsed, response, queries = self.get(actor, params)
+            first.append(elapsed)
+        next_url = response.data["next"]
+        for _ in range(depth - 1):
+            if next_url is None:
+                break
+            _, response, _ = self.get(actor, self.cursor(next_url, params))
+            next_url = response.data["next"]
+        for _ in range(repeats):
+            elapsed, _, _ = self.get(actor, self.cursor(next_url, params))
+            deep.append(elapsed)
+        return statistics.median(first), statistics.median(deep), queries
+
+    def resolve(self, key, value):
+        if key == "user_id":
+            return self.user_id
+        if key == "created_after":
+            return (timezone.localdate() - timedelta(days=value)).isoformat()
+        return value
+
+    @staticmethod
+    def cursor(url, params):
+        if url is None:
+            return params
+        cursor = parse_qs(urlsplit(url).query)["cursor"][0]
+        return {**params, "cursor": cursor}
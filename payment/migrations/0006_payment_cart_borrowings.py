@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-17 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0005_borrowing_active_book_idx"),
+        ("payment", "0005_payment_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="borrowings",
+            field=models.ManyToManyField(
+                blank=True, related_name="cart_payments", to="borrowing.borrowing"
+            ),
+        ),
+    ]
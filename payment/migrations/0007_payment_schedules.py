@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Registered here rather than by the bot, so payments are maintained on
+# every deployment, with or without the Telegram bot.
+SCHEDULES = {
+    "process stripe events": {
+        "func": "payment.events.process_pending",
+        "schedule_type": "I",
+        "minutes": 1,
+        "repeats": -1,
+    },
+    "expire stale stripe sessions": {
+        "func": "payment.utils.expire_stale_sessions",
+        "schedule_type": "H",
+        "repeats": -1,
+    },
+}
+
+
+def create_schedules(apps, schema_editor):
+    schedule = apps.get_model("django_q", "Schedule")
+    for name, fields in SCHEDULES.items():
+        schedule.objects.update_or_create(name=name, defaults=fields)
+
+
+def delete_schedules(apps, schema_editor):
+    schedule = apps.get_model("django_q", "Schedule")
+    schedule.objects.filter(name__in=SCHEDULES).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_q", "0014_schedule_cluster"),
+        ("payment", "0006_payment_cart_borrowings"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_schedules, delete_schedules),
+    ]
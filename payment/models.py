@@ -4,7 +4,11 @@ from borrowing.models import Borrowing
 
 
 class Payment(models.Model):
-    STATUS_CHOICES = [("PENDING", "Pending"), ("PAID", "Paid")]
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("PAID", "Paid"),
+        ("EXPIRED", "Expired"),
+    ]
     TYPE_CHOICES = [("PAYMENT", "Payment"), ("FINE", "Fine")]
     status = models.CharField(
         max_length=10, choices=STATUS_CHOICES, default="PENDING"
@@ -15,10 +19,81 @@ class Payment(models.Model):
     borrowing = models.ForeignKey(
         Borrowing, on_delete=models.CASCADE, related_name="payments"
     )
-    session_id = models.CharField(max_length=255, unique=True)
-    session_url = models.URLField(max_length=500)
+    # A cart checkout pays for all of these borrowings; `borrowing` is the
+    # first of them.
+    borrowings = models.ManyToManyField(
+        Borrowing, blank=True, related_name="cart_payments"
+    )
+    # Empty until a worker opens the session of a deferred checkout.
+    session_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True
+    )
+    session_url = models.URLField(max_length=500, blank=True)
     amount = models.DecimalField(decimal_places=2, max_digits=10)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at", "id"], name="payment_created_idx"
+            ),
+            models.Index(
+                fields=["status", "created_at", "id"],
+                name="payment_status_created_idx",
+            ),
+            models.Index(
+                fields=["type", "created_at", "id"],
+                name="payment_type_created_idx",
+            ),
+            models.Index(
+                fields=["borrowing", "type", "status"],
+                name="payment_borrowing_type_idx",
+            ),
+            models.Index(
+                fields=["expires_at"],
+                condition=models.Q(status="PENDING"),
+                name="payment_pending_expiry_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"Payment - {self.id}, borrowing - {self.borrowing_id}, "
+            f"book - {self.borrowing.book.title}"
+        )
+
+
+class StripeEvent(models.Model):
+    """
+    Append-only log of verified Stripe webhook events, keyed by the Stripe
+    event id so that redelivered events are stored only once.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        PROCESSED = "processed", "Processed"
+        FAILED = "failed", "Failed"
+
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=255)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=9, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["received_at"],
+                condition=models.Q(status="pending"),
+                name="stripe_event_pending_idx",
+            ),
+        ]
 
     def __str__(self):
-        return (f"Payment - {self.id}, borrowing - {self.borrowing.id}, "
-                f"book - {self.borrowing.book.title}")
+        return f"Stripe event {self.id} ({self.type}, {self.status})"
@@ -16,3 +16,13 @@ class PaymentSerializer(serializers.ModelSerializer):
             "amount",
         )
         read_only_fields = ("id",)
+
+
+class PaymentListSerializer(PaymentSerializer):
+    user = serializers.EmailField(
+        source="borrowing.user.email", read_only=True
+    )
+    book = serializers.CharField(source="borrowing.book.title", read_only=True)
+
+    class Meta(PaymentSerializer.Meta):
+        fields = PaymentSerializer.Meta.fields + ("user", "book", "created_at")
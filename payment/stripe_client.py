@@ -0,0 +1,214 @@
+"""
+Stripe API access with explicit timeouts, a pooled HTTP session, bounded
+retries, a circuit breaker and per-operation latency histograms.
+
+Retries are left to the Stripe library (max_network_retries), which backs
+off exponentially with jitter and sends idempotency keys, so a retried
+POST can not create a second checkout session.
+"""
+
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from books_rent_config.metrics import incr_many
+
+logger = logging.getLogger(__name__)
+
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_READ_TIMEOUT = 10
+STRIPE_MAX_NETWORK_RETRIES = 2
+STRIPE_POOL_SIZE = 20
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STRIPE_OPERATIONS = ("checkout.session.create",)
+
+# Errors that mean Stripe could not serve the request, as opposed to
+# Stripe rejecting it.
+UNAVAILABLE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+
+class StripeUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Payment service is temporarily unavailable, try again."
+    default_code = "payment_service_unavailable"
+
+    def __init__(self, wait: float = BREAKER_RESET_TIMEOUT):
+        super().__init__()
+        # DRF turns `wait` into a Retry-After header.
+        self.wait = max(int(wait), 1)
+
+
+class StripeRejected(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = "Payment service rejected the checkout."
+    default_code = "payment_service_rejected"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and fails fast
+    for `reset_timeout` seconds. After that one trial call is let through:
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (
+                time.monotonic() - self.opened_at
+            )
+            if remaining > 0:
+                raise StripeUnavailable(wait=remaining)
+            # Let this call through as the trial and keep failing fast
+            # for everybody else until it finishes.
+            self.opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def get_client() -> stripe.StripeClient:
+    """Process-wide Stripe client sharing one keep-alive connection pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    http_client = stripe.RequestsClient(
+        timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT),
+        session=session,
+    )
+    base_addresses = {}
+    if settings.STRIPE_API_BASE:
+        base_addresses["api"] = settings.STRIPE_API_BASE
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        max_network_retries=STRIPE_MAX_NETWORK_RETRIES,
+        base_addresses=base_addresses,
+    )
+
+
+def call(operation: str, func, *args, **kwargs):
+    """
+    Run a Stripe API call through the circuit breaker and record its
+    latency. Raises StripeUnavailable (503) when Stripe can not be reached
+    or the breaker is open.
+    """
+    breaker.before_call()
+    started = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except UNAVAILABLE_ERRORS as error:
+        breaker.record_failure()
+        observe(operation, time.perf_counter() - started, failed=True)
+        logger.warning("Stripe %s failed: %s", operation, error)
+        raise StripeUnavailable() from error
+    except stripe.error.StripeError:
+        # Stripe answered, it just did not like the request.
+        breaker.record_success()
+        observe(operation, time.perf_counter() - started, failed=True)
+        raise
+    breaker.record_success()
+    observe(operation, time.perf_counter() - started)
+    return result
+
+
+def _metric_key(operation: str, name: str) -> str:
+    return f"stripe:latency:{operation}:{name}"
+
+
+def _bucket_name(seconds: float) -> str:
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+def observe(operation: str, seconds: float, failed: bool = False) -> None:
+    """
+    Add one call to the operation's histogram. The counters live in the
+    shared cache, so the histogram covers every worker process.
+    """
+    try:
+        incr_many(
+            {
+                _metric_key(operation, _bucket_name(seconds)): 1,
+                _metric_key(operation, "count"): 1,
+                _metric_key(operation, "sum_ms"): round(seconds * 1000),
+                _metric_key(operation, "errors"): int(failed),
+            }
+        )
+    except Exception as error:
+        logger.warning("Stripe metrics are unavailable: %s", error)
+
+
+def latency_metrics() -> dict:
+    """Cumulative latency histograms per Stripe operation."""
+    names = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+    keys = [
+        _metric_key(operation, name)
+        for operation in STRIPE_OPERATIONS
+        for name in names + ["count", "sum_ms", "errors"]
+    ]
+    values = cache.get_many(keys)
+    operations = {}
+    for operation in STRIPE_OPERATIONS:
+        buckets = {}
+        total = 0
+        for name in names:
+            total += values.get(_metric_key(operation, name), 0)
+            buckets[name] = total
+        operations[operation] = {
+            "buckets": buckets,
+            "count": values.get(_metric_key(operation, "count"), 0),
+            "sum_seconds": values.get(_metric_key(operation, "sum_ms"), 0)
+            / 1000,
+            "errors": values.get(_metric_key(operation, "errors"), 0),
+        }
+    return {"circuit_breaker": breaker.state, "operations": operations}
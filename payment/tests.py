@@ -1,13 +1,18 @@
+import json
 import time
 from datetime import timedelta
 from decimal import Decimal
 from unittest import mock
 from unittest.mock import MagicMock
 
+import stripe
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.http import HttpResponseRedirect
 from django.views.generic.dates import timezone_today
+from django_q.models import Schedule
 
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient, APITestCase
@@ -16,12 +21,25 @@ from rest_framework import status
 from book.models import Book
 from borrowing.models import Borrowing
 from borrowing.signals import borrowing_created
-from payment.models import Payment
-from payment.serialisers import PaymentSerializer
+from books_rent_config.testing import QueryBudgetMixin
+from payment.events import process_pending, record_event
+from payment.fake_stripe import FakeStripe
+from payment.models import Payment, StripeEvent
+from payment.serialisers import PaymentListSerializer, PaymentSerializer
+from payment.stripe_client import (
+    CircuitBreaker,
+    StripeUnavailable,
+    call,
+    latency_metrics,
+)
 from payment.utils import (
+    CHECKOUT_MAX_ATTEMPTS,
     create_stripe_session,
     create_payment,
     complete_payment,
+    create_deferred_session,
+    defer_stripe_session,
+    expire_stale_sessions,
 )
 
 
@@ -89,9 +107,11 @@ class AuthenticatedTestCase(APITestCase):
         self.client.force_authenticate(user=user)
         response = self.client.get(URL_PAYMENT_LIST)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        payments = Payment.objects.filter(borrowing__user=user)
-        serializer = PaymentSerializer(payments, many=True)
-        self.assertEqual(response.data, serializer.data)
+        payments = Payment.objects.filter(borrowing__user=user).order_by(
+            "-created_at", "-id"
+        )
+        serializer = PaymentListSerializer(payments, many=True)
+        self.assertEqual(response.data["results"], serializer.data)
 
     def test_should_retrieve_own_payment(self):
         user, admin, book_1, book_2 = make_test_db()
@@ -124,9 +144,9 @@ class AdminUserTestCase(APITestCase):
         self.client.force_authenticate(user=admin)
         response = self.client.get(URL_PAYMENT_LIST)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        payments = Payment.objects.all()
-        serializer = PaymentSerializer(payments, many=True)
-        self.assertEqual(response.data, serializer.data)
+        payments = Payment.objects.order_by("-created_at", "-id")
+        serializer = PaymentListSerializer(payments, many=True)
+        self.assertEqual(response.data["results"], serializer.data)
 
     def test_should_retrieve_others_payment(self):
         user, admin, book_1, book_2 = make_test_db()
@@ -162,6 +182,12 @@ class CreateStripeSession(APITestCase):
         )
         self.amount = Decimal("10.00")
         self.payments_type = "PAYMENT"
+        patcher = mock.patch(
+            "payment.stripe_client.breaker",
+            CircuitBreaker(failure_threshold=5, reset_timeout=30),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @classmethod
     def tearDownClass(cls):
@@ -169,17 +195,19 @@ class CreateStripeSession(APITestCase):
         super().tearDownClass()
 
     @mock.patch("payment.utils.create_payment")
-    @mock.patch("payment.utils.stripe.checkout.Session.create")
+    @mock.patch("payment.utils.stripe_client.get_client")
     def test_should_calling_functions(
-        self, mock_create_session, mock_create_payment
+        self, mock_get_client, mock_create_payment
     ):
         """
-        Test that stripe.checkout.Session.create is called, and create_payment
+        Test that the Stripe checkout session is created, and create_payment
         is called with correct arguments
         """
         mock_session = MagicMock()
         mock_session.id = "test_session_id"
         mock_session.url = "https://checkout.stripe.com/test_session"
+        mock_client = mock_get_client.return_value
+        mock_create_session = mock_client.checkout.sessions.create
         mock_create_session.return_value = mock_session
 
         response = create_stripe_session(
@@ -197,6 +225,7 @@ class CreateStripeSession(APITestCase):
             session_id=mock_session.id,
             session_url=mock_session.url,
             status="PENDING",
+            expires_at=mock.ANY,
         )
         self.assertIsInstance(response, HttpResponseRedirect)
         self.assertEqual(response.url, mock_session.url)
@@ -241,33 +270,32 @@ class CompletePaymentTestCase(APITestCase):
         correct_data["session_id"] = "another_session_id"
         self.fine_payment = create_payment(**correct_data)
 
-    @mock.patch("payment.views.complete_payment")
+    @mock.patch("payment.events.async_task")
     @mock.patch("payment.views.stripe.Webhook.construct_event")
-    def test_webhook_is_calling(
-        self, mock_construct_event, mock_complete_payment
-    ):
+    def test_webhook_is_calling(self, mock_construct_event, mock_async_task):
         """
-        Test that stripe.Webhook.construct_event is called, and
-        complete_payment is called with correct arguments with correct data
+        Test that stripe.Webhook.construct_event is called, and the event
+        is stored and queued for processing
         """
-        mock_event = MagicMock()
-        mock_event = {
-            "type": "checkout.session.completed",
-            "data": {"object": {"id": self.payment.session_id}},
-        }
-        mock_construct_event.return_value = mock_event
-
         fake_signature = "test_signature"
-        fake_payload = b"{}"
-        response = self.client.post(
-            reverse("payments:payments-webhook"),
-            data=fake_payload,
-            content_type="application/json",
-            **{"HTTP_STRIPE_SIGNATURE": fake_signature},
+        fake_payload = json.dumps(
+            {
+                "id": "evt_test",
+                "type": "checkout.session.completed",
+                "data": {"object": {"id": self.payment.session_id}},
+            }
         )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("payments:payments-webhook"),
+                data=fake_payload,
+                content_type="application/json",
+                **{"HTTP_STRIPE_SIGNATURE": fake_signature},
+            )
         mock_construct_event.assert_called_once()
-        mock_complete_payment.assert_called_once_with(
-            session_id=self.payment.session_id
+        self.assertTrue(StripeEvent.objects.filter(id="evt_test").exists())
+        mock_async_task.assert_called_once_with(
+            "payment.events.process_pending"
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
@@ -277,7 +305,7 @@ class CompletePaymentTestCase(APITestCase):
         updated_payment = Payment.objects.get(
             session_id=session_id, id=self.payment.id
         )
-        self.assertEqual(updated_payment.status, "COMPLETED")
+        self.assertEqual(updated_payment.status, "PAID")
 
     def test_if_fine_payment_book_inventory_is_updated(self):
         session_id = self.fine_payment.session_id
@@ -286,6 +314,527 @@ class CompletePaymentTestCase(APITestCase):
         updated_payment = Payment.objects.get(
             session_id=session_id, id=self.fine_payment.id
         )
-        self.assertEqual(updated_payment.status, "COMPLETED")
+        self.assertEqual(updated_payment.status, "PAID")
         book_inventory_after = updated_payment.borrowing.book.inventory
         self.assertEqual(book_inventory_after, book_inventory_before + 1)
+
+
+def make_payment(type: str = "PAYMENT", session_id: str = "cs_event"):
+    """Payment for a new borrowing, created without calling Stripe."""
+    post_save.disconnect(borrowing_created, sender=Borrowing)
+    user = get_user_model().objects.create_user(
+        email=f"<{session_id}_EMAIL>", password="<PASSWORD>"
+    )
+    book = Book.objects.create(
+        title="Event Book",
+        author="Test Author",
+        cover="hard",
+        inventory=10,
+        daily_fee=10,
+    )
+    borrowing = Borrowing.objects.create(
+        book=book,
+        user=user,
+        expected_return_date=timezone_today() + timedelta(days=1),
+    )
+    post_save.connect(borrowing_created, sender=Borrowing)
+    return Payment.objects.create(
+        borrowing=borrowing,
+        type=type,
+        amount=Decimal("10.00"),
+        session_id=session_id,
+        session_url=f"https://checkout.stripe.com/{session_id}",
+    )
+
+
+class StripeEventTestCase(APITestCase):
+    def setUp(self):
+        self.payment = make_payment()
+        self.event = {
+            "id": "evt_1",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": "cs_event"}},
+        }
+
+    @mock.patch("payment.events.async_task")
+    def test_replayed_event_is_stored_and_queued_once(self, mock_async_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(record_event(self.event))
+            self.assertFalse(record_event(self.event))
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        mock_async_task.assert_called_once()
+
+    @override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+    @mock.patch("payment.events.async_task")
+    def test_webhook_accepts_event_signed_by_fake_stripe(
+        self, mock_async_task
+    ):
+        fake = FakeStripe("whsec_test")
+        fake.sessions["cs_event"] = {"id": "cs_event"}
+        payload, signature = fake.signed_event("cs_event")
+        response = self.client.post(
+            reverse("payments:payments-webhook"),
+            data=payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.payload["data"]["object"]["id"], "cs_event")
+
+    @mock.patch("payment.views.stripe.Webhook.construct_event")
+    def test_webhook_rejects_bad_signature(self, mock_construct_event):
+        mock_construct_event.side_effect = (
+            stripe.error.SignatureVerificationError("bad", "sig")
+        )
+        response = self.client.post(
+            reverse("payments:payments-webhook"),
+            data=json.dumps(self.event),
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE="bad",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @mock.patch("payment.events.async_task")
+    def test_pending_events_are_processed(self, mock_async_task):
+        record_event(self.event)
+        record_event({**self.event, "id": "evt_2", "type": "charge.updated"})
+        self.assertEqual(process_pending(), 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PAID")
+        self.assertFalse(
+            StripeEvent.objects.exclude(
+                status=StripeEvent.Status.PROCESSED
+            ).exists()
+        )
+        self.assertEqual(process_pending(), 0)
+
+    @mock.patch("payment.events.async_task")
+    def test_failed_event_is_kept_for_retry(self, mock_async_task):
+        record_event(
+            {
+                **self.event,
+                "data": {"object": {"id": "cs_unknown"}},
+            }
+        )
+        self.assertEqual(process_pending(), 0)
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.status, StripeEvent.Status.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("does not exist", event.last_error)
+
+
+class IdempotentCompletePaymentTestCase(APITestCase):
+    def setUp(self):
+        self.fine = make_payment(type="FINE", session_id="cs_fine")
+
+    def test_fine_is_completed_exactly_once(self):
+        book = self.fine.borrowing.book
+        self.assertTrue(complete_payment(session_id="cs_fine"))
+        self.assertFalse(complete_payment(session_id="cs_fine"))
+        self.fine.refresh_from_db()
+        book.refresh_from_db()
+        self.assertEqual(self.fine.status, "PAID")
+        self.assertEqual(book.inventory, 11)
+        self.assertEqual(
+            self.fine.borrowing.actual_return_date, timezone_today()
+        )
+
+    def test_paying_for_borrowing_clears_its_hold(self):
+        payment = make_payment(session_id="cs_held")
+        borrowing = payment.borrowing
+        borrowing.hold_expires_at = timezone.now() + timedelta(hours=1)
+        borrowing.save()
+        self.assertTrue(complete_payment(session_id="cs_held"))
+        borrowing.refresh_from_db()
+        self.assertIsNone(borrowing.hold_expires_at)
+
+    def test_unknown_session_is_an_error(self):
+        with self.assertRaises(Payment.DoesNotExist):
+            complete_payment(session_id="cs_unknown")
+
+
+class SessionReuseTestCase(APITestCase):
+    def setUp(self):
+        self.payment = make_payment(session_id="cs_open")
+        self.payment.expires_at = timezone.now() + timedelta(minutes=30)
+        self.payment.save()
+        patcher = mock.patch(
+            "payment.stripe_client.breaker",
+            CircuitBreaker(failure_threshold=5, reset_timeout=30),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_pending_session_is_reused(self, mock_get_client):
+        response = create_stripe_session(
+            borrowing=self.payment.borrowing,
+            amount=self.payment.amount,
+            payments_type="PAYMENT",
+        )
+        self.assertEqual(response.url, self.payment.session_url)
+        mock_get_client.assert_not_called()
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_other_amount_or_expiring_session_is_not_reused(
+        self, mock_get_client
+    ):
+        mock_session = MagicMock()
+        mock_session.id = "cs_new"
+        mock_session.url = "https://checkout.stripe.com/cs_new"
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.return_value = mock_session
+
+        create_stripe_session(
+            borrowing=self.payment.borrowing,
+            amount=Decimal("20.00"),
+            payments_type="PAYMENT",
+        )
+        self.payment.expires_at = timezone.now() + timedelta(minutes=1)
+        self.payment.save()
+        mock_session.id = "cs_newer"
+        create_stripe_session(
+            borrowing=self.payment.borrowing,
+            amount=self.payment.amount,
+            payments_type="PAYMENT",
+        )
+
+        self.assertEqual(create_session.call_count, 2)
+        self.assertIn("expires_at", create_session.call_args.kwargs["params"])
+        self.assertEqual(Payment.objects.count(), 3)
+
+    def test_stale_sessions_are_expired(self):
+        stale = make_payment(session_id="cs_stale")
+        stale.expires_at = timezone.now() - timedelta(days=1)
+        stale.save()
+        self.assertEqual(expire_stale_sessions(), 1)
+        stale.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(stale.status, "EXPIRED")
+        self.assertEqual(self.payment.status, "PENDING")
+
+    @mock.patch("payment.events.async_task")
+    def test_expired_event_expires_pending_payment(self, mock_async_task):
+        record_event(
+            {
+                "id": "evt_expired",
+                "type": "checkout.session.expired",
+                "data": {"object": {"id": "cs_open"}},
+            }
+        )
+        self.assertEqual(process_pending(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "EXPIRED")
+        self.assertFalse(complete_payment(session_id="cs_open"))
+
+
+class DeferredCheckoutTestCase(APITestCase):
+    def setUp(self):
+        payment = make_payment(session_id="cs_placeholder")
+        self.borrowing = payment.borrowing
+        payment.delete()
+        with mock.patch("payment.utils.async_task"):
+            self.payment = defer_stripe_session(
+                self.borrowing, Decimal("10.00"), "PAYMENT"
+            )
+        self.url = reverse(
+            "payments:payments-checkout", kwargs={"pk": self.payment.id}
+        )
+        self.client.force_authenticate(user=self.borrowing.user)
+        patcher = mock.patch(
+            "payment.stripe_client.breaker",
+            CircuitBreaker(failure_threshold=5, reset_timeout=30),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_poll_answers_202_until_session_is_created(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response["Retry-After"], "1")
+
+        self.payment.session_id = "cs_deferred"
+        self.payment.session_url = "https://checkout.stripe.com/cs_deferred"
+        self.payment.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["session_url"], self.payment.session_url
+        )
+
+    def test_poll_is_limited_to_owner(self):
+        other = get_user_model().objects.create_user(
+            email="other@example.com", password="<PASSWORD>"
+        )
+        self.client.force_authenticate(user=other)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_worker_stores_session_once(self, mock_get_client):
+        mock_session = MagicMock()
+        mock_session.id = "cs_deferred"
+        mock_session.url = "https://checkout.stripe.com/cs_deferred"
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.return_value = mock_session
+
+        self.assertTrue(create_deferred_session(self.payment.id))
+        self.assertFalse(create_deferred_session(self.payment.id))
+
+        create_session.assert_called_once()
+        expires_at = int(self.payment.expires_at.timestamp())
+        self.assertEqual(
+            create_session.call_args.kwargs["options"],
+            {
+                "idempotency_key": (
+                    f"checkout-payment-{self.payment.id}-{expires_at}"
+                )
+            },
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.session_url, mock_session.url)
+
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_late_retry_pushes_expiry_back(self, mock_get_client):
+        mock_session = MagicMock()
+        mock_session.id = "cs_late"
+        mock_session.url = "https://checkout.stripe.com/cs_late"
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.return_value = mock_session
+        Payment.objects.filter(id=self.payment.id).update(
+            expires_at=timezone.now() + timedelta(minutes=10)
+        )
+
+        self.assertTrue(create_deferred_session(self.payment.id))
+
+        expires_at = create_session.call_args.kwargs["params"]["expires_at"]
+        self.assertGreaterEqual(
+            expires_at, time.time() + timedelta(minutes=30).total_seconds()
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(int(self.payment.expires_at.timestamp()), expires_at)
+
+    @mock.patch("payment.utils.schedule")
+    @mock.patch("payment.utils.stripe_client.get_client")
+    def test_worker_retries_then_cancels_borrowing(
+        self, mock_get_client, mock_schedule
+    ):
+        create_session = mock_get_client.return_value.checkout.sessions.create
+        create_session.side_effect = stripe.error.APIConnectionError("down")
+        book = self.borrowing.book
+
+        self.assertFalse(create_deferred_session(self.payment.id))
+        mock_schedule.assert_called_once()
+        self.assertEqual(
+            mock_schedule.call_args.args[1:], (self.payment.id, 2)
+        )
+
+        self.assertFalse(
+            create_deferred_session(
+                self.payment.id, attempt=CHECKOUT_MAX_ATTEMPTS
+            )
+        )
+        self.assertFalse(
+            Borrowing.objects.filter(id=self.borrowing.id).exists()
+        )
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 11)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CircuitBreakerTestCase(TestCase):
+    def test_breaker_opens_fails_fast_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(StripeUnavailable) as raised:
+            breaker.before_call()
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertGreater(raised.exception.wait, 0)
+
+        breaker.opened_at -= 30
+        self.assertEqual(breaker.state, "half-open")
+        breaker.before_call()
+        with self.assertRaises(StripeUnavailable):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+
+class StripeClientTestCase(APITestCase):
+    def setUp(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        patcher = mock.patch("payment.stripe_client.breaker", breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unavailable_stripe_returns_503_and_undoes_borrowing(self):
+        user = get_user_model().objects.create_user(
+            email="<STRIPE_DOWN>", password="<PASSWORD>"
+        )
+        book = Book.objects.create(
+            title="Test Book",
+            author="Test Author",
+            cover="hard",
+            inventory=1,
+            daily_fee=10,
+        )
+        self.client.force_authenticate(user=user)
+        payload = {
+            "expected_return_date": timezone_today() + timedelta(days=1),
+            "book": book.id,
+        }
+        with mock.patch("payment.utils.stripe_client.get_client") as client:
+            client.return_value.checkout.sessions.create.side_effect = (
+                stripe.error.APIConnectionError("timed out")
+            )
+            response = self.client.post(URL_CREATE_BORROWING, data=payload)
+            self.assertEqual(
+                response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            self.assertIn("Retry-After", response)
+            response = self.client.post(URL_CREATE_BORROWING, data=payload)
+            self.assertEqual(
+                response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            # The open breaker did not let the second request reach Stripe.
+            client.return_value.checkout.sessions.create.assert_called_once()
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 1)
+        self.assertFalse(Borrowing.objects.filter(book=book).exists())
+
+    def test_latency_is_recorded_per_operation(self):
+        call("checkout.session.create", lambda: None)
+        with self.assertRaises(StripeUnavailable):
+            call(
+                "checkout.session.create",
+                mock.Mock(side_effect=stripe.error.APIError("boom")),
+            )
+        metrics = latency_metrics()["operations"]["checkout.session.create"]
+        self.assertEqual(metrics["count"], 2)
+        self.assertEqual(metrics["errors"], 1)
+        self.assertEqual(metrics["buckets"]["+Inf"], 2)
+        self.assertEqual(latency_metrics()["circuit_breaker"], "open")
+
+    def test_metrics_endpoint_is_staff_only(self):
+        url = reverse("payments:payments-stripe-metrics")
+        user = get_user_model().objects.create_user(
+            email="<METRICS>", password="<PASSWORD>"
+        )
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("checkout.session.create", response.data["operations"])
+
+
+class PaymentListFilterTestCase(APITestCase):
+    def setUp(self):
+        self.paid = make_payment(session_id="cs_paid")
+        self.fine = make_payment(type="FINE", session_id="cs_fine")
+        self.old = make_payment(session_id="cs_old")
+        Payment.objects.filter(id=self.paid.id).update(status="PAID")
+        Payment.objects.filter(id=self.old.id).update(
+            created_at=timezone.now() - timedelta(days=40)
+        )
+        self.client.force_authenticate(
+            user=get_user_model().objects.create(
+                email="staff@example.com", is_staff=True
+            )
+        )
+
+    def ids(self, **params):
+        response = self.client.get(URL_PAYMENT_LIST, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [payment["id"] for payment in response.data["results"]]
+
+    def test_newest_first(self):
+        self.assertEqual(self.ids(), [self.fine.id, self.paid.id, self.old.id])
+
+    def test_filters(self):
+        self.assertEqual(self.ids(status="paid"), [self.paid.id])
+        self.assertEqual(self.ids(type="FINE"), [self.fine.id])
+        since = (timezone_today() - timedelta(days=30)).isoformat()
+        self.assertEqual(
+            self.ids(created_after=since), [self.fine.id, self.paid.id]
+        )
+        self.assertEqual(self.ids(created_before=since), [self.old.id])
+        self.assertEqual(
+            self.ids(user_id=self.fine.borrowing.user_id), [self.fine.id]
+        )
+        self.assertEqual(len(self.ids(created_after="not a date")), 3)
+
+    def test_rows_include_user_and_book(self):
+        response = self.client.get(URL_PAYMENT_LIST, {"type": "FINE"})
+        row = response.data["results"][0]
+        self.assertEqual(row["user"], self.fine.borrowing.user.email)
+        self.assertEqual(row["book"], self.fine.borrowing.book.title)
+
+
+class QueryBudget(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.payment = make_payment(session_id="cs_budget")
+        self.user = self.payment.borrowing.user
+
+    def add_payments(self, count):
+        books = Book.objects.bulk_create(
+            Book(
+                title="Budget Book",
+                author="Test Author",
+                cover="hard",
+                inventory=10,
+                daily_fee=10,
+            )
+            for _ in range(count)
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=self.user,
+                expected_return_date=timezone_today() + timedelta(days=1),
+            )
+            for book in books
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                borrowing=borrowing,
+                amount=Decimal("10.00"),
+                session_id=f"cs_budget_{borrowing.id}",
+                session_url="https://checkout.stripe.com/budget",
+            )
+            for borrowing in borrowings
+        )
+
+    def test_payment_list(self):
+        # Authentication and the list.
+        self.assertQueryBudget(
+            URL_PAYMENT_LIST, 2, self.add_payments, user=self.user
+        )
+
+    def test_payment_detail(self):
+        url = reverse(
+            "payments:payments-detail", kwargs={"pk": self.payment.id}
+        )
+        self.assertQueryBudget(url, 2, self.add_payments, user=self.user)
+
+
+class SchedulesTestCase(TestCase):
+    def test_maintenance_is_scheduled_without_the_bot(self):
+        self.assertCountEqual(
+            Schedule.objects.filter(func__startswith="payment.").values_list(
+                "func", flat=True
+            ),
+            [
+                "payment.events.process_pending",
+                "payment.utils.expire_stale_sessions",
+            ],
+        )
@@ -1,6 +1,12 @@
 from django.urls import path, include
 
-from payment.views import PaymentListView, PaymentDetailView, my_webhook_view
+from payment.views import (
+    PaymentListView,
+    PaymentDetailView,
+    PaymentCheckoutView,
+    StripeMetricsView,
+    my_webhook_view,
+)
 
 
 app_name = "payments"
@@ -9,5 +15,15 @@ app_name = "payments"
 urlpatterns = [
     path("", PaymentListView.as_view(), name="payments-list"),
     path("<int:pk>/", PaymentDetailView.as_view(), name="payments-detail"),
+    path(
+        "<int:pk>/checkout/",
+        PaymentCheckoutView.as_view(),
+        name="payments-checkout",
+    ),
     path("webhook/", my_webhook_view, name="payments-webhook"),
+    path(
+        "stripe/metrics/",
+        StripeMetricsView.as_view(),
+        name="payments-stripe-metrics",
+    ),
 ]
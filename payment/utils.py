@@ -1,24 +1,40 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
 from decimal import Decimal
 import stripe
 
 from django.conf import settings
 from django.db import transaction
-from django.db.models import F
 from django.http import HttpResponseRedirect
 from django.shortcuts import redirect
 from django.utils import timezone
+from django_q.tasks import async_task, schedule
 
 from rest_framework.exceptions import ValidationError
 
-from book.models import Book
 from borrowing.models import Borrowing
+from borrowing.waitlist import release_borrowed_copies
+from payment import stripe_client
 from payment.models import Payment
 from payment.serialisers import PaymentSerializer
 
+logger = logging.getLogger(__name__)
+
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Stripe accepts session lifetimes between 30 minutes and 24 hours.
+STRIPE_SESSION_LIFETIME = timedelta(hours=1)
+# The shortest lifetime asked for, with a minute for the request itself.
+STRIPE_MIN_SESSION_LIFETIME = timedelta(minutes=31)
+SESSION_REUSE_MARGIN = timedelta(minutes=5)
+SESSION_EXPIRY_GRACE = timedelta(hours=1)
+CHECKOUT_MAX_ATTEMPTS = 5
+
 
-def create_payment(borrowing, amount, type, session_id, session_url, status):
+def create_payment(
+    borrowing, amount, type, session_id, session_url, status, expires_at=None
+):
     payload = {
         "borrowing": borrowing,
         "amount": amount,
@@ -29,35 +45,98 @@ def create_payment(borrowing, amount, type, session_id, session_url, status):
     }
     serializer = PaymentSerializer(data=payload)
     if serializer.is_valid():
-        return serializer.save()
+        return serializer.save(expires_at=expires_at)
     raise ValidationError(serializer.errors)
 
 
+def pending_session(
+    borrowing: Borrowing, amount: Decimal, payments_type: str
+) -> Payment | None:
+    """
+    Open Stripe session of the borrowing for the same type and amount,
+    if it stays valid long enough for the user to pay.
+    """
+    return (
+        Payment.objects.filter(
+            borrowing=borrowing,
+            type=payments_type,
+            status="PENDING",
+            amount=amount,
+            session_id__isnull=False,
+            expires_at__gt=timezone.now() + SESSION_REUSE_MARGIN,
+        )
+        .order_by("-expires_at")
+        .first()
+    )
+
+
+def rental_fee(borrowing: Borrowing) -> Decimal:
+    return (
+        borrowing.expected_return_date - borrowing.borrow_date
+    ).days * borrowing.book.daily_fee
+
+
+def line_item(borrowing: Borrowing, amount: Decimal) -> dict:
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": f"Borrowing {borrowing.id} {borrowing}",
+            },
+            "unit_amount": int(amount * 100),
+        },
+        "quantity": 1,
+    }
+
+
+def payment_line_items(payment: Payment) -> list[dict]:
+    """One line item per borrowing of a cart payment, else just one."""
+    cart = payment.borrowings.select_related("book").order_by("id")
+    if cart:
+        return [
+            line_item(borrowing, rental_fee(borrowing)) for borrowing in cart
+        ]
+    return [line_item(payment.borrowing, payment.amount)]
+
+
+def open_stripe_session(
+    line_items: list[dict],
+    expires_at: datetime,
+    idempotency_key: str | None = None,
+):
+    """Create a Stripe Checkout Session for the line items."""
+    options = {}
+    if idempotency_key is not None:
+        options["idempotency_key"] = idempotency_key
+    return stripe_client.call(
+        "checkout.session.create",
+        stripe_client.get_client().checkout.sessions.create,
+        params={
+            "payment_method_types": ["card"],
+            "line_items": line_items,
+            "mode": "payment",
+            "expires_at": int(expires_at.timestamp()),
+            "success_url": "http://localhost:8000/success/",
+            "cancel_url": "http://localhost:8000/cancel/",
+        },
+        options=options,
+    )
+
+
 def create_stripe_session(
     borrowing: Borrowing, amount: Decimal, payments_type: str
-) -> HttpResponseRedirect | None:
+) -> HttpResponseRedirect:
     """
     Створює Stripe Payment Session для оплати.
+
+    A pending session for the same borrowing, type and amount is reused,
+    so repeated attempts do not create new sessions and payments.
     """
-    print("start create session")
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": f"Borrowing {borrowing.id} {borrowing}",
-                    },
-                    "unit_amount": int(amount * 100),
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url="http://localhost:8000/success/",
-        cancel_url="http://localhost:8000/cancel/",
-    )
+    payment = pending_session(borrowing, amount, payments_type)
+    if payment is not None:
+        return redirect(payment.session_url, code=303)
+    expires_at = timezone.now() + STRIPE_SESSION_LIFETIME
+    session = open_stripe_session([line_item(borrowing, amount)], expires_at)
     try:
         create_payment(
             borrowing=borrowing.id,
@@ -66,23 +145,224 @@ def create_stripe_session(
             session_id=session.id,
             session_url=session.url,
             status="PENDING",
+            expires_at=expires_at,
         )
-        print("Payment created successfully")
-        return redirect(session.url, code=303)
-    except ValidationError as e:
-        print(f"Payment creation failed: {e}")
-        return None
-
-
-def complete_payment(session_id: str):
-    payment = Payment.objects.get(session_id=session_id)
-    payment.status = "COMPLETED"
-    payment.save()
-    if payment.type == "FINE":
-        with transaction.atomic():
-            Borrowing.objects.filter(id=payment.borrowing.id).update(
-                actual_return_date=timezone.now().date()
-            )
-            Book.objects.filter(id=payment.borrowing.book.id).update(
-                inventory=F("inventory") + 1
+    except ValidationError as error:
+        logger.error(
+            "Payment of borrowing %s was not created: %s",
+            borrowing.id,
+            error.detail,
+        )
+        raise
+    return redirect(session.url, code=303)
+
+
+def defer_stripe_session(
+    borrowing: Borrowing, amount: Decimal, payments_type: str
+) -> Payment:
+    """
+    Create a PENDING payment without a session and leave the Stripe call
+    to a django-q worker once the transaction commits. The client polls
+    the payment's checkout endpoint for the session URL.
+    """
+    payment = Payment.objects.create(
+        borrowing=borrowing,
+        amount=amount,
+        type=payments_type,
+        status="PENDING",
+        expires_at=timezone.now() + STRIPE_SESSION_LIFETIME,
+    )
+    transaction.on_commit(
+        lambda: async_task("payment.utils.create_deferred_session", payment.id)
+    )
+    return payment
+
+
+def create_cart_session(borrowings: list[Borrowing]) -> HttpResponseRedirect:
+    """
+    Open one Stripe session with a line item per borrowing of the cart
+    and a single payment linked to all of them.
+    """
+    expires_at = timezone.now() + STRIPE_SESSION_LIFETIME
+    fees = [rental_fee(borrowing) for borrowing in borrowings]
+    session = open_stripe_session(
+        [
+            line_item(borrowing, fee)
+            for borrowing, fee in zip(borrowings, fees)
+        ],
+        expires_at,
+    )
+    with transaction.atomic():
+        payment = Payment.objects.create(
+            borrowing=borrowings[0],
+            amount=sum(fees),
+            type="PAYMENT",
+            status="PENDING",
+            session_id=session.id,
+            session_url=session.url,
+            expires_at=expires_at,
+        )
+        payment.borrowings.set(borrowings)
+    return redirect(session.url, code=303)
+
+
+def defer_cart_session(borrowings: list[Borrowing]) -> Payment:
+    """Deferred checkout of a cart, see defer_stripe_session."""
+    payment = defer_stripe_session(
+        borrowing=borrowings[0],
+        amount=sum(rental_fee(borrowing) for borrowing in borrowings),
+        payments_type="PAYMENT",
+    )
+    payment.borrowings.set(borrowings)
+    return payment
+
+
+def create_deferred_session(payment_id: int, attempt: int = 1) -> bool:
+    """
+    Open the Stripe session of a deferred payment. While Stripe is
+    unavailable the call is rescheduled after the breaker's wait; once
+    CHECKOUT_MAX_ATTEMPTS are spent, or Stripe rejects the request, the
+    borrowing is cancelled and the copy released, as in the synchronous
+    flow. A retry that comes too late for the payment's expiry pushes it
+    back to the shortest lifetime Stripe accepts. Returns True if the
+    session was stored.
+    """
+    payment = (
+        Payment.objects.select_related("borrowing__book")
+        .filter(id=payment_id, status="PENDING", session_id__isnull=True)
+        .first()
+    )
+    if payment is None:
+        return False
+    expires_at = max(
+        payment.expires_at, timezone.now() + STRIPE_MIN_SESSION_LIFETIME
+    )
+    try:
+        session = open_stripe_session(
+            payment_line_items(payment),
+            expires_at,
+            # Stripe answers a repeated key with the session it already
+            # created, so a task that runs twice opens one session. The
+            # key changes with the expiry, as Stripe rejects a repeated
+            # key with other parameters.
+            idempotency_key=(
+                f"checkout-payment-{payment.id}-{int(expires_at.timestamp())}"
+            ),
+        )
+    except stripe_client.StripeUnavailable as error:
+        if attempt < CHECKOUT_MAX_ATTEMPTS:
+            schedule(
+                "payment.utils.create_deferred_session",
+                payment_id,
+                attempt + 1,
+                next_run=timezone.now() + timedelta(seconds=error.wait),
             )
+            return False
+        logger.warning("Deferred checkout of payment %s failed", payment_id)
+        cancel_deferred_checkout(payment)
+        return False
+    except stripe.error.StripeError as error:
+        logger.warning(
+            "Deferred checkout of payment %s failed: %s", payment_id, error
+        )
+        cancel_deferred_checkout(payment)
+        return False
+    return bool(
+        Payment.objects.filter(id=payment.id, session_id__isnull=True).update(
+            session_id=session.id,
+            session_url=session.url,
+            expires_at=expires_at,
+        )
+    )
+
+
+def cancel_deferred_checkout(payment: Payment) -> None:
+    cancel_borrowings(
+        [payment.borrowing_id]
+        + list(payment.borrowings.values_list("id", flat=True))
+    )
+
+
+def cancel_borrowings(borrowing_ids) -> None:
+    """
+    Delete unreturned borrowings whose checkout failed, with their
+    payments, and release their copies.
+    """
+    with transaction.atomic():
+        cancelled = dict(
+            Borrowing.objects.select_for_update()
+            .filter(id__in=borrowing_ids, actual_return_date__isnull=True)
+            .values_list("id", "book_id")
+        )
+        if cancelled:
+            Borrowing.objects.filter(id__in=cancelled).delete()
+            release_borrowed_copies(Counter(cancelled.values()))
+
+
+def expire_stale_sessions() -> int:
+    """
+    Mark pending payments whose Stripe session has expired as EXPIRED in
+    one UPDATE. The grace period leaves time for the webhook of a session
+    paid just before it expired. Returns the number of expired payments.
+    """
+    return Payment.objects.filter(
+        status="PENDING",
+        expires_at__lt=timezone.now() - SESSION_EXPIRY_GRACE,
+    ).update(status="EXPIRED")
+
+
+def complete_payment(session_id: str) -> bool:
+    """
+    Mark the payment of a Stripe session as paid and, for a fine, return
+    the borrowed book.
+
+    The PENDING -> PAID transition is a single conditional UPDATE and the
+    side effects run in the same transaction only if it changed a row, so
+    a payment is completed exactly once however often Stripe reports it.
+    Returns False if the payment had already been completed.
+    """
+    with transaction.atomic():
+        # Clear the inventory hold first: the hold sweeper locks the
+        # borrowing before its payments, and so must we.
+        Borrowing.objects.filter(
+            payments__session_id=session_id,
+            payments__type="PAYMENT",
+            payments__status="PENDING",
+            hold_expires_at__isnull=False,
+        ).update(hold_expires_at=None)
+        Borrowing.objects.filter(
+            cart_payments__session_id=session_id,
+            cart_payments__status="PENDING",
+            hold_expires_at__isnull=False,
+        ).update(hold_expires_at=None)
+        paid = Payment.objects.filter(
+            session_id=session_id, status="PENDING"
+        ).update(status="PAID")
+        if not paid:
+            if not Payment.objects.filter(session_id=session_id).exists():
+                raise Payment.DoesNotExist(
+                    f"Payment for session {session_id} does not exist"
+                )
+            return False
+        payment = Payment.objects.select_related("borrowing").get(
+            session_id=session_id
+        )
+        if payment.type == "FINE":
+            returned = Borrowing.objects.filter(
+                id=payment.borrowing_id, actual_return_date__isnull=True
+            ).update(actual_return_date=timezone.now().date())
+            if returned:
+                release_borrowed_copies({payment.borrowing.book_id: 1})
+    return True
+
+
+def expire_payment(session_id: str) -> bool:
+    """
+    Mark the payment of an expired Stripe session as EXPIRED unless it has
+    already been paid. Returns False if nothing changed.
+    """
+    return bool(
+        Payment.objects.filter(session_id=session_id, status="PENDING").update(
+            status="EXPIRED"
+        )
+    )
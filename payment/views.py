@@ -1,46 +1,189 @@
+import json
+import logging
+from datetime import datetime
+
 import stripe
 from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render
-from drf_spectacular.utils import extend_schema
-from rest_framework import generics, permissions
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    extend_schema,
+    OpenApiParameter,
+    OpenApiResponse,
+)
+from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from payment.permissions import IsAdminOrOwner
 
 from payment.models import Payment
-from payment.serialisers import PaymentSerializer
-from payment.utils import complete_payment
+from payment.pagination import PaymentCursorPagination
+from payment.serialisers import PaymentListSerializer, PaymentSerializer
+from payment.events import record_event
+from payment.stripe_client import latency_metrics
 
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
+logger = logging.getLogger(__name__)
+
+CHECKOUT_RETRY_AFTER = 1
+
 
 class PaymentListView(generics.ListAPIView):
-    serializer_class = PaymentSerializer
+    serializer_class = PaymentListSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = PaymentCursorPagination
 
     def get_queryset(self):
-        if self.request.user.is_staff:
-            return Payment.objects.all()
-        else:
-            return Payment.objects.filter(borrowing__user=self.request.user)
+        """filtering by user, status, type and creation date"""
+        queryset = Payment.objects.select_related(
+            "borrowing__user", "borrowing__book"
+        )
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(borrowing__user=self.request.user)
+        params = self.request.query_params
+
+        user_id = params.get("user_id")
+        if user_id is not None and self.request.user.is_staff:
+            try:
+                queryset = queryset.filter(borrowing__user_id=int(user_id))
+            except ValueError:
+                pass
+        if params.get("status"):
+            queryset = queryset.filter(status=params["status"].upper())
+        if params.get("type"):
+            queryset = queryset.filter(type=params["type"].upper())
+        for param, lookup in (
+            ("created_after", "created_at__gte"),
+            ("created_before", "created_at__lt"),
+        ):
+            moment = self.parse_moment(params.get(param))
+            if moment is not None:
+                queryset = queryset.filter(**{lookup: moment})
+        return queryset
+
+    @staticmethod
+    def parse_moment(value):
+        """A datetime or a date (its midnight), None if not valid."""
+        if not value:
+            return None
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                if day is None:
+                    return None
+                moment = datetime.combine(day, datetime.min.time())
+        except ValueError:
+            return None
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="status",
+                type=OpenApiTypes.STR,
+                enum=[choice for choice, _ in Payment.STATUS_CHOICES],
+                description="Filter by payment status",
+            ),
+            OpenApiParameter(
+                name="type",
+                type=OpenApiTypes.STR,
+                enum=[choice for choice, _ in Payment.TYPE_CHOICES],
+                description="Filter by payment type",
+            ),
+            OpenApiParameter(
+                name="created_after",
+                type=OpenApiTypes.DATETIME,
+                description="Payments created at or after this date or time",
+            ),
+            OpenApiParameter(
+                name="created_before",
+                type=OpenApiTypes.DATETIME,
+                description="Payments created before this date or time",
+            ),
+            OpenApiParameter(
+                name="user_id",
+                type=OpenApiTypes.INT,
+                description="Filter by user (staff only)",
+            ),
+        ],
         description=(
             "List all payments for staff, or only the user's"
-            " payments for non-staff."
-        )
+            " payments for non-staff. Newest first, cursor-paginated"
+            " (`cursor`, `page_size`)."
+        ),
     )
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
 
 class PaymentDetailView(generics.RetrieveAPIView):
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related("borrowing")
     serializer_class = PaymentSerializer
     permission_classes = (IsAdminOrOwner,)
 
 
+class PaymentCheckoutView(APIView):
+    """
+    Session URL of a deferred checkout, for polling. It answers at once,
+    so a poll never holds a worker.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    @extend_schema(
+        responses={
+            200: OpenApiResponse(
+                description="The session is open, or the payment is done"
+            ),
+            202: OpenApiResponse(
+                description="The session is not created yet, poll again "
+                "after the Retry-After header"
+            ),
+            404: OpenApiResponse(
+                description="No such payment, or its checkout failed and "
+                "the borrowing was cancelled"
+            ),
+        },
+    )
+    def get(self, request, pk):
+        payments = Payment.objects.filter(id=pk)
+        if not request.user.is_staff:
+            payments = payments.filter(borrowing__user=request.user)
+        checkout = payments.values("id", "status", "session_url").first()
+        if checkout is None:
+            raise Http404
+        if checkout["session_url"] or checkout["status"] != "PENDING":
+            return Response(checkout)
+        return Response(
+            checkout,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Retry-After": str(CHECKOUT_RETRY_AFTER)},
+        )
+
+
+class StripeMetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    @extend_schema(
+        description=(
+            "Latency histograms per Stripe operation and the state of the "
+            "Stripe circuit breaker."
+        )
+    )
+    def get(self, request):
+        return Response(latency_metrics())
+
+
 def payment_success(request):
     """redirect to success page"""
     return render(request, "payment/success.html")
@@ -51,32 +194,26 @@ def payment_cancel(request):
     return render(request, "payment/cancel.html")
 
 
-endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
-
-
 @api_view(["POST"])
 @csrf_exempt
 def my_webhook_view(request):
-    print("start webhook")
+    """
+    Verify the Stripe signature, store the event and answer right away.
+    The event itself is handled by django-q (payment.events).
+    """
     payload = request.body
-    sig_header = request.META["HTTP_STRIPE_SIGNATURE"]
-    event = None
+    sig_header = request.META.get("HTTP_STRIPE_SIGNATURE", "")
 
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
+        stripe.Webhook.construct_event(
+            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
-    except ValueError as e:
-        #print("⚠️  Verification failed." + str(e))
+        event = json.loads(payload)
+    except ValueError:
         return HttpResponse(status=400)
     except stripe.error.SignatureVerificationError as e:
-        print("⚠️  Webhook signature verification failed." + str(e))
+        logger.warning("Webhook signature verification failed: %s", e)
         return HttpResponse(status=400)
 
-    if (
-        event["type"] == "checkout.session.completed"
-        or event["type"] == "checkout.session.async_payment_succeeded"
-    ):
-        complete_payment(session_id=event["data"]["object"]["id"])
-
+    record_event(event)
     return HttpResponse(status=200)
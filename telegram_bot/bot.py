@@ -1,21 +1,91 @@
-from books_rent_config.settings import TELEGRAM_BOT_TOKEN
-
 import asyncio
+from urllib.parse import urlsplit
+
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import (
+    SimpleRequestHandler,
+    setup_application,
+)
+from aiohttp import web
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
 from telegram_bot.handlers import start_handler
+from telegram_bot.sender import make_bot
+from telegram_bot.storage import CacheStorage
+
+DEFAULT_WEBHOOK_PATH = "/telegram/webhook/"
+# Concurrent update requests Telegram may open to the webhook.
+WEBHOOK_MAX_CONNECTIONS = 40
 
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher()
+bot = make_bot()
+# FSM state lives in the shared cache, so it survives restarts and
+# moving between webhook replicas.
+dp = Dispatcher(storage=CacheStorage())
+
+
+def setup_dispatcher(dispatcher: Dispatcher = dp) -> Dispatcher:
+    if start_handler.router.parent_router is None:
+        dispatcher.include_router(start_handler.router)
+    return dispatcher
 
 
 async def main():
     print("Telegram bot is running...")
-    dp.include_router(start_handler.router)
+    setup_dispatcher()
 
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
 
+def webhook_path() -> str:
+    if settings.TELEGRAM_WEBHOOK_URL:
+        return urlsplit(settings.TELEGRAM_WEBHOOK_URL).path or "/"
+    return DEFAULT_WEBHOOK_PATH
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher) -> None:
+    """
+    Point Telegram at TELEGRAM_WEBHOOK_URL. Every replica does it on
+    start; the call is idempotent, and none removes the webhook on stop
+    because the others keep serving it.
+    """
+    await bot.set_webhook(
+        url=settings.TELEGRAM_WEBHOOK_URL,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def webhook_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp application serving Telegram updates posted to the webhook.
+    Requests without the secret token Telegram was given are answered
+    401. Replicas share nothing but Redis and Postgres, so any number of
+    them can run behind a load balancer.
+    """
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise ImproperlyConfigured(
+            "TELEGRAM_WEBHOOK_SECRET is required in webhook mode."
+        )
+    if settings.TELEGRAM_WEBHOOK_URL:
+        dispatcher.startup.register(set_webhook)
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+    ).register(app, path=webhook_path())
+    app.router.add_get("/health/", health)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
@@ -0,0 +1,98 @@
+"""
+Local stand-in for the Telegram Bot API, used by benchmarks.
+
+It answers sendMessage after a configurable latency and enforces the
+global and per-chat rate limits the way Telegram does, replying 429 with
+retry_after when a client sends too fast.
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+FAKE_API_LATENCY = 0.05
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        latency: float = FAKE_API_LATENCY,
+        global_rate: int = 30,
+        chat_rate: int = 1,
+        retry_after: int = 1,
+    ):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self.sent = 0
+        self.throttled = 0
+        self.message_id = 0
+        self.connections = set()
+        self.window = deque()
+        self.chat_windows = defaultdict(deque)
+        self.runner = None
+        self.url = None
+
+    def _over_limit(self, window: deque, limit: int, now: float) -> bool:
+        while window and window[0] <= now - 1:
+            window.popleft()
+        return len(window) >= limit
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # Every client connection has its own source port, so the number
+        # of distinct peers shows how often clients reconnect.
+        self.connections.add(request.transport.get_extra_info("peername"))
+        data = await request.post()
+        if request.match_info["method"].lower() != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+        await asyncio.sleep(self.latency)
+        chat_id = int(data["chat_id"])
+        now = time.monotonic()
+        chat_window = self.chat_windows[chat_id]
+        if self._over_limit(
+            self.window, self.global_rate, now
+        ) or self._over_limit(chat_window, self.chat_rate, now):
+            self.throttled += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after "
+                    f"{self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+        self.window.append(now)
+        chat_window.append(now)
+        self.sent += 1
+        self.message_id += 1
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": self.message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": data.get("text", ""),
+                },
+            }
+        )
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and return the base URL for TELEGRAM_API_URL."""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
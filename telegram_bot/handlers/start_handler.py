@@ -12,6 +12,7 @@ from telegram_bot.requests_to_db.account_sync import (
     try_synchronize_accounts,
 )
 from telegram_bot.requests_to_db.get_borrowings import get_borrowings
+from telegram_bot.sender import split_message
 
 router = Router()
 
@@ -50,12 +51,15 @@ async def stage_two(message: Message, state: FSMContext):
 
 @router.message(Reg.password)
 async def stage_three(message: Message, state: FSMContext):
-    await state.update_data(password=message.text)
+    # The password is never written to the FSM storage, which is shared.
     data = await state.get_data()
-    is_valid = await try_synchronize_accounts(
-        data, telegram_id=message.from_user.id
-    )
-    await state.clear()
+    try:
+        is_valid = await try_synchronize_accounts(
+            {"email": data["email"], "password": message.text},
+            telegram_id=message.from_user.id,
+        )
+    finally:
+        await state.clear()
     if is_valid:
         await message.answer(
             "accounts have synchronize successfully, "
@@ -68,20 +72,26 @@ async def stage_three(message: Message, state: FSMContext):
         )
 
 
+def borrowing_line(borrowing: dict) -> str:
+    rented_days = (timezone.now().date() - borrowing["borrow_date"]).days
+    return (
+        f"{borrowing['book__title']}, is taken {rented_days} "
+        f"days ago, daily fee {borrowing['book__daily_fee']}, "
+        f"dept for today {borrowing['book__daily_fee'] * rented_days},"
+        f" expected return date {borrowing['expected_return_date']}"
+    )
+
+
+async def answer_borrowings(message: Message, borrowings: list[dict]):
+    """Answer with all borrowings in as few messages as fit the limit."""
+    for text in split_message(map(borrowing_line, borrowings)):
+        await message.answer(text)
+
+
 @router.message(F.text.lower() == "show my borrowings")
 async def all_borrowings(message: Message):
     borrowings = await get_borrowings(user_id=message.from_user.id)
-    for borrowing in borrowings:
-        rented_days = (
-            borrowing["book__daily_fee"]
-            * (timezone.now().date() - borrowing["borrow_date"]).days
-        )
-        await message.answer(
-            f"{borrowing["book__title"]}, is taken {rented_days} "
-            f"days ago, daily fee {borrowing['book__daily_fee']}, "
-            f"dept for today {borrowing['book__daily_fee'] * rented_days},"
-            f" expected return date {borrowing["expected_return_date"]}"
-        )
+    await answer_borrowings(message, borrowings)
 
 
 @router.message(F.text.lower() == "show my overdue borrowings")
@@ -89,14 +99,4 @@ async def without_puree(message: Message):
     borrowings = await get_borrowings(
         user_id=message.from_user.id, is_overdue=True
     )
-    for borrowing in borrowings:
-        rented_days = (
-            borrowing["book__daily_fee"]
-            * (timezone.now().date() - borrowing["borrow_date"]).days
-        )
-        await message.answer(
-            f"{borrowing["book__title"]}, is taken {rented_days} "
-            f"days ago, daily fee {borrowing['book__daily_fee']}, "
-            f"dept for today {borrowing['book__daily_fee'] * rented_days},"
-            f" expected return date {borrowing["expected_return_date"]}"
-        )
+    await answer_borrowings(message, borrowings)
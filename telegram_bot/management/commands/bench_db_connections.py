@@ -0,0 +1,178 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.utils import OperationalError
+
+from book.models import Book
+
+BENCH_ALIAS = "bench"
+MODES = {
+    # A new connection per request, the old default.
+    "connect": {"CONN_MAX_AGE": 0},
+    # One connection per thread, kept for a minute and checked on reuse.
+    "persistent": {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True},
+    # A per-process psycopg pool shared by all threads.
+    "pool": {
+        "ENGINE": "books_rent_config.postgresql_pool",
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": True,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs short request-like units of work from many threads with a "
+        "new connection per request, persistent connections and the "
+        "connection pool, and reports latency percentiles and how many "
+        "connections each mode opened"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=4000)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument(
+            "--queries",
+            type=int,
+            default=3,
+            help="Queries per request",
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=settings.DB_POOL_SIZES["web"]["max_size"],
+            help="max_size of the pool; below --concurrency threads wait",
+        )
+        parser.add_argument(
+            "--pool-min-size",
+            type=int,
+            default=settings.DB_POOL_SIZES["web"]["min_size"],
+            help="Connections the pool opens up front",
+        )
+        parser.add_argument(
+            "--thread-per-request",
+            action="store_true",
+            help="Serve every request in a new thread, as runserver does",
+        )
+        parser.add_argument(
+            "--modes", nargs="+", choices=list(MODES), default=list(MODES)
+        )
+
+    def handle(self, *args, **options):
+        self.sql = str(
+            Book.objects.values_list("id", "title").order_by("id")[:20].query
+        )
+        for mode in options["modes"]:
+            database = {
+                **connections.settings["default"],
+                "OPTIONS": {},
+                **MODES[mode],
+            }
+            if mode == "pool":
+                database["OPTIONS"] = {
+                    "pool": {
+                        "min_size": options["pool_min_size"],
+                        "max_size": options["pool_size"],
+                    }
+                }
+            self.run_mode(mode, database, options)
+
+    def run_mode(self, mode, database, options):
+        # Every thread opens its own connection under the extra alias.
+        connections.settings[BENCH_ALIAS] = database
+        connects = []
+
+        def count_connect(sender, connection, **kwargs):
+            if connection.alias == BENCH_ALIAS:
+                connects.append(1)
+
+        latencies = []
+        per_thread = options["requests"] // options["concurrency"]
+
+        errors = []
+
+        def serve(timings, close=False):
+            started = time.perf_counter()
+            try:
+                self.request(connections[BENCH_ALIAS], options["queries"])
+            except OperationalError as error:
+                errors.append(error)
+                return
+            finally:
+                if close:
+                    # runserver closes a thread's connections when its
+                    # request is done.
+                    connections[BENCH_ALIAS].close()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        def worker():
+            timings = []
+            # One untimed request warms up imports and caches.
+            for _ in range(per_thread + 1):
+                if options["thread_per_request"]:
+                    thread = threading.Thread(
+                        target=serve, args=(timings, True)
+                    )
+                    thread.start()
+                    thread.join()
+                else:
+                    serve(timings)
+            latencies.extend(timings[1:])
+            connections[BENCH_ALIAS].close()
+
+        if mode == "pool":
+            # A long-running process fills its pool once, at start.
+            connections[BENCH_ALIAS].pool.open(wait=True)
+        connection_created.connect(count_connect)
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(options["concurrency"])
+        ]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection_created.disconnect(count_connect)
+        elapsed = time.perf_counter() - started
+
+        opened, waits = len(connects), ""
+        if mode == "pool":
+            wrapper = connections[BENCH_ALIAS]
+            stats = wrapper.pool_stats()
+            opened = stats["pool_size"]
+            waits = (
+                f", {stats.get('requests_queued', 0)} waited "
+                f"{stats.get('requests_wait_ms', 0)} ms in total"
+            )
+            wrapper.close_pool()
+            del connections[BENCH_ALIAS]
+        del connections.settings[BENCH_ALIAS]
+
+        latencies.sort()
+        p50, p95, p99 = (
+            latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+            for p in (50, 95, 99)
+        )
+        self.stdout.write(
+            f"{mode:<11} {len(latencies) / elapsed:7.1f} req/s, "
+            f"p50 {p50:6.2f} ms, p95 {p95:6.2f} ms, p99 {p99:6.2f} ms, "
+            f"max {latencies[-1]:7.2f} ms, {opened} connections opened"
+            f"{waits}, {len(errors)} errors"
+        )
+        if errors:
+            self.stdout.write(f"{'':<11} first error: {errors[0]}")
+
+    def request(self, connection, queries):
+        """One request: a few reads, then what request_finished does."""
+        with connection.cursor() as cursor:
+            for _ in range(queries):
+                cursor.execute(self.sql)
+                cursor.fetchall()
+        connection.close_if_unusable_or_obsolete()
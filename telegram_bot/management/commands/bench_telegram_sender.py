@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from django.core.management.base import BaseCommand
+
+from telegram_bot.fake_api import FAKE_API_LATENCY, FakeBotAPI
+from telegram_bot.sender import send_messages
+
+BENCH_TOKEN = "42:bench"
+
+
+def fake_bot(url: str) -> Bot:
+    return Bot(
+        token=BENCH_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(url)),
+    )
+
+
+async def send_serially(url: str, messages: list) -> int:
+    """The old notifier: one asyncio.run and one session per message."""
+    sent = 0
+    for chat_id, text in messages:
+        bot = fake_bot(url)
+        try:
+            await bot.send_message(chat_id, text)
+            sent += 1
+        except Exception:
+            pass
+        finally:
+            await bot.session.close()
+    return sent
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends overdue notifications to a local fake Bot API server, "
+        "serially and through the rate-limited sender, and reports "
+        "throughput, 429 responses and connections opened"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=300)
+        parser.add_argument("--chats", type=int, default=100)
+        parser.add_argument("--latency", type=float, default=FAKE_API_LATENCY)
+        parser.add_argument("--global-rate", type=int, default=30)
+
+    def handle(self, *args, **options):
+        messages = [
+            (chat_id % options["chats"] + 1, f"bench message {chat_id}")
+            for chat_id in range(options["messages"])
+        ]
+
+        async def serial(url):
+            return await send_serially(url, messages)
+
+        async def pipeline(url):
+            bot = fake_bot(url)
+            try:
+                return await send_messages(
+                    messages,
+                    bot=bot,
+                    global_rate=options["global_rate"],
+                    shared_rate=options["global_rate"],
+                )
+            finally:
+                await bot.session.close()
+
+        for name, run in (("serial", serial), ("pipeline", pipeline)):
+            result = asyncio.run(
+                self.measure(run, options["latency"], options["global_rate"])
+            )
+            self.stdout.write(
+                "{name:>8}: {sent}/{total} sent in {elapsed:.2f}s "
+                "({rate:.1f} msg/s), {throttled} throttled, "
+                "{connections} connections".format(
+                    name=name, total=len(messages), **result
+                )
+            )
+
+    async def measure(self, run, latency: float, global_rate: int) -> dict:
+        api = FakeBotAPI(latency=latency, global_rate=global_rate)
+        url = await api.start()
+        try:
+            started = time.perf_counter()
+            sent = await run(url)
+            elapsed = time.perf_counter() - started
+        finally:
+            await api.stop()
+        return {
+            "sent": sent,
+            "elapsed": elapsed,
+            "rate": sent / elapsed,
+            "throttled": api.throttled,
+            "connections": len(api.connections),
+        }
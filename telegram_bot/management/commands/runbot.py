@@ -1,15 +1,38 @@
 import asyncio
+
+from aiohttp import web
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from telegram_bot.bot import main
+
+from telegram_bot.bot import bot, main, setup_dispatcher, webhook_app
 from telegram_bot.tasks import create_scheduled_task
 
 
 class Command(BaseCommand):
     help = "Запускає Telegram бота"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--webhook",
+            action="store_true",
+            default=settings.TELEGRAM_BOT_MODE == "webhook",
+            help="Serve updates from a webhook instead of polling",
+        )
+        parser.add_argument("--host", default=settings.TELEGRAM_WEBHOOK_HOST)
+        parser.add_argument(
+            "--port", type=int, default=settings.TELEGRAM_WEBHOOK_PORT
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Запуск Telegram бота...")
         create_scheduled_task()
         print("scheduled_task starts")
-        asyncio.run(main())
+        if options["webhook"]:
+            web.run_app(
+                webhook_app(setup_dispatcher(), bot),
+                host=options["host"],
+                port=options["port"],
+            )
+        else:
+            asyncio.run(main())
         print("bot is running")
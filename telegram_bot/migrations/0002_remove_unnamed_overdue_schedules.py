@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Q
+
+OVERDUE_FUNC = "telegram_bot.tasks.find_expired_and_send_message"
+
+
+def remove_unnamed_schedules(apps, schema_editor):
+    """
+    Every bot start used to add an unnamed overdue schedule, so older
+    installs send the digest once per start. The named schedule that
+    runbot creates replaces them.
+    """
+    schedule = apps.get_model("django_q", "Schedule")
+    schedule.objects.filter(
+        Q(name__isnull=True) | Q(name=""), func=OVERDUE_FUNC
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_q", "0014_schedule_cluster"),
+        ("telegram_bot", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_unnamed_schedules, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import models
+from django.db.models import Index, Q
+from django.utils import timezone
+
+
+class Notification(models.Model):
+    """
+    Outbox row for a Telegram message. Rows are written in the same
+    transaction as the change they announce and delivered by django-q.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        SENT = "sent", "Sent"
+        FAILED = "failed", "Failed"
+
+    telegram_id = models.BigIntegerField()
+    text = models.TextField()
+    status = models.CharField(
+        max_length=7, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            Index(
+                fields=["available_at", "id"],
+                condition=Q(status="pending"),
+                name="notification_pending_idx",
+            ),
+            Index(
+                fields=["sent_at"],
+                condition=Q(status="sent"),
+                name="notification_sent_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.id} to {self.telegram_id} ({self.status})"
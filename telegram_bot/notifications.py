@@ -1,83 +1,212 @@
 import asyncio
-from aiogram import Bot
+import logging
+from typing import Iterator
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import ArrayAgg
+from django_q.tasks import async_task
 
+from django.utils import timezone
 from django.views.generic.dates import timezone_today
 
-from books_rent_config.settings import TELEGRAM_BOT_TOKEN
+from books_rent_config.settings import Q_CLUSTER
 from borrowing.models import Borrowing
+from telegram_bot.sender import (
+    TELEGRAM_GLOBAL_RATE,
+    send_messages,
+    split_message,
+)
 
+logger = logging.getLogger(__name__)
 
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+# A task sends at least one message per user at its share of the global
+# rate, and must be done well within the django-q timeout: it is killed
+# then and never retried.
+OVERDUE_TIMEOUT_SHARE = 0.8
+OVERDUE_USERS_PER_TASK = int(
+    TELEGRAM_GLOBAL_RATE
+    / Q_CLUSTER["workers"]
+    * Q_CLUSTER["timeout"]
+    * OVERDUE_TIMEOUT_SHARE
+)
+OVERDUE_ITERATOR_CHUNK = 2000
 
 
-async def send_created(telegram_id: int, borrowing: Borrowing = None) -> None:
+def created_text(borrowing: Borrowing) -> str:
     rented_days = (timezone_today() - borrowing.borrow_date).days
-    await bot.send_message(
-        telegram_id,
+    return (
         f"You rented a {borrowing.book.title} on {borrowing.borrow_date},"
         f" the cost of rental is $ {borrowing.book.daily_fee} "
         f"a day, today accrued the cost of rolling "
-        f"{borrowing.book.daily_fee * rented_days} $",
+        f"{borrowing.book.daily_fee * rented_days} $"
     )
-    await bot.session.close()
 
 
-def run_send_created(telegram_id: int, borrowing: Borrowing) -> None:
-    asyncio.run(send_created(telegram_id, borrowing))
+def expired_text(book_title: str, expired_days: int) -> str:
+    return (
+        f"Your rented book {book_title} is overdue for {expired_days} "
+        f"days, please return the book as soon as possible"
+    )
 
 
-async def message_expired(
-    telegram_id: int, book_title: str, expired_days: int
-) -> None:
-    await bot.send_message(
-        telegram_id,
-        f"Your rented book {book_title} is overdue for {expired_days} "
-        f"days, please return the book as soon as possible",
+def waitlist_offer_text(book_title: str, expires_at) -> str:
+    return (
+        f"A copy of {book_title} is free and held for you until "
+        f"{timezone.localtime(expires_at):%Y-%m-%d %H:%M}, borrow it "
+        f"before then or it goes to the next reader in the queue"
     )
-    await bot.session.close()
-    print("Message (expired book) is sent")
 
 
-async def message_no_expired(telegram_id: int) -> None:
-    await bot.send_message(telegram_id, "No borrowings overdue today!")
-    await bot.session.close()
+NO_EXPIRED_TEXT = "No borrowings overdue today!"
+
+
+def user_id_ranges(
+    size: int = OVERDUE_USERS_PER_TASK,
+) -> Iterator[tuple[int, int]]:
+    """
+    Stream user ids and yield (first_id, last_id) bounds of consecutive
+    blocks of `size` users.
+    """
+    first_id = last_id = None
+    count = 0
+    user_ids = (
+        get_user_model()
+        .objects.order_by("id")
+        .values_list("id", flat=True)
+        .iterator(chunk_size=OVERDUE_ITERATOR_CHUNK)
+    )
+    for user_id in user_ids:
+        if first_id is None:
+            first_id = user_id
+        last_id = user_id
+        count += 1
+        if count == size:
+            yield first_id, last_id
+            first_id, count = None, 0
+    if first_id is not None:
+        yield first_id, last_id
+
+
+def overdue_digest(titles: list[str], expired_days: list[int]) -> list[str]:
+    """One reminder for all of a user's overdue books, split to fit."""
+    if len(titles) == 1:
+        return [expired_text(titles[0], expired_days[0])]
+    lines = [
+        f"You have {len(titles)} overdue books, please return them as soon "
+        f"as possible:"
+    ]
+    lines.extend(
+        f"- {title}: overdue for {days} days"
+        for title, days in zip(titles, expired_days)
+    )
+    return split_message(lines)
+
 
+def overdue_messages(
+    first_user_id: int, last_user_id: int, digest: bool = True
+) -> Iterator[tuple[int, str]]:
+    """
+    (telegram_id, text) pairs for the users with ids in the given range:
+    reminders for overdue borrowings, or a single all-clear message.
 
-def run_messages_expired() -> None:
-    borrowings = Borrowing.objects.filter(
-        expected_return_date__lte=timezone_today(),
+    In digest mode the borrowings are grouped by user in the query and
+    every user gets one reminder listing all of their overdue books,
+    instead of one message per borrowing.
+    """
+    today = timezone_today()
+    overdue = Borrowing.objects.filter(
+        user_id__gte=first_user_id,
+        user_id__lte=last_user_id,
+        expected_return_date__lte=today,
         actual_return_date__isnull=True,
-    ).select_related("user", "book")
-    for borrowing in borrowings:
-        expired_days = (timezone_today() - borrowing.expected_return_date).days
-        if borrowing.user.telegram_id:
-            telegram_id = borrowing.user.telegram_id
-            asyncio.run(
-                (
-                    message_expired(
-                        telegram_id=telegram_id,
-                        book_title=borrowing.book.title,
-                        expired_days=expired_days,
-                    )
-                )
+    )
+    if digest:
+        rows = (
+            overdue.values("user_id", "user__telegram_id", "user__email")
+            .annotate(
+                titles=ArrayAgg(
+                    "book__title", ordering=("expected_return_date", "id")
+                ),
+                dates=ArrayAgg(
+                    "expected_return_date",
+                    ordering=("expected_return_date", "id"),
+                ),
+            )
+            .order_by("user_id")
+            .iterator(chunk_size=OVERDUE_ITERATOR_CHUNK)
+        )
+    else:
+        rows = (
+            {
+                "user_id": borrowing.user_id,
+                "user__telegram_id": borrowing.user.telegram_id,
+                "user__email": borrowing.user.email,
+                "titles": [borrowing.book.title],
+                "dates": [borrowing.expected_return_date],
+            }
+            for borrowing in overdue.select_related("user", "book").iterator(
+                chunk_size=OVERDUE_ITERATOR_CHUNK
             )
-        else:
-            print(
-                f"user {borrowing.user} - {borrowing.user.email}"
-                f"has not had telegram id yet"
+        )
+
+    overdue_user_ids = set()
+    for row in rows:
+        overdue_user_ids.add(row["user_id"])
+        telegram_id = row["user__telegram_id"]
+        if not telegram_id:
+            logger.warning(
+                "User %s has no telegram id yet", row["user__email"]
             )
+            continue
+        expired_days = [(today - date).days for date in row["dates"]]
+        for text in overdue_digest(row["titles"], expired_days):
+            yield telegram_id, text
 
     users = (
         get_user_model()
-        .objects.prefetch_related("borrowings")
-        .exclude(
-            telegram_id=None,
-            borrowings__expected_return_date__lte=timezone_today(),
+        .objects.filter(
+            id__range=(first_user_id, last_user_id),
+            telegram_id__isnull=False,
         )
-        .distinct()
+        .values_list("id", "telegram_id")
+        .iterator(chunk_size=OVERDUE_ITERATOR_CHUNK)
+    )
+    for user_id, telegram_id in users:
+        if user_id not in overdue_user_ids:
+            yield telegram_id, NO_EXPIRED_TEXT
+
+
+def send_overdue_range(
+    first_user_id: int,
+    last_user_id: int,
+    global_rate: float = TELEGRAM_GLOBAL_RATE,
+    digest: bool = True,
+) -> None:
+    """django-q task sending the overdue notifications of one user range."""
+    messages = list(overdue_messages(first_user_id, last_user_id, digest))
+    sent = asyncio.run(send_messages(messages, global_rate=global_rate))
+    logger.info(
+        "Overdue notifications for users %s-%s sent: %s of %s",
+        first_user_id,
+        last_user_id,
+        sent,
+        len(messages),
     )
-    for user in users:
-        if user.telegram_id:
-            telegram_id = user.telegram_id
-            asyncio.run((message_no_expired(telegram_id=telegram_id)))
+
+
+def run_messages_expired(digest: bool = True) -> None:
+    """
+    Split the daily overdue run into user id ranges and queue one django-q
+    task per range. The tasks run on all cluster workers at once, so each
+    gets its share of Telegram's global rate limit.
+    """
+    ranges = list(user_id_ranges(OVERDUE_USERS_PER_TASK))
+    parallel = min(Q_CLUSTER["workers"], len(ranges)) or 1
+    for first_user_id, last_user_id in ranges:
+        async_task(
+            "telegram_bot.notifications.send_overdue_range",
+            first_user_id,
+            last_user_id,
+            TELEGRAM_GLOBAL_RATE / parallel,
+            digest,
+        )
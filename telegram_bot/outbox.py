@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramRetryAfter
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from books_rent_config.settings import Q_CLUSTER
+from telegram_bot.models import Notification
+from telegram_bot.sender import (
+    RateLimitedSender,
+    SendDeadlinePassed,
+    make_bot,
+)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = timedelta(seconds=30)
+# Longer than sending a batch takes, rate limits included.
+OUTBOX_LEASE = timedelta(minutes=5)
+# A run stops sending well before django-q kills it at the timeout.
+OUTBOX_RUN_SECONDS = Q_CLUSTER["timeout"] * 0.8
+
+
+def enqueue(telegram_id: int, text: str) -> Notification:
+    """
+    Store a message in the outbox as part of the current transaction and
+    ask the django-q cluster to deliver it once the transaction commits.
+    """
+    notification = Notification.objects.create(
+        telegram_id=telegram_id, text=text
+    )
+    transaction.on_commit(schedule_delivery)
+    return notification
+
+
+def schedule_delivery() -> None:
+    try:
+        async_task("telegram_bot.outbox.deliver_pending")
+    except Exception as error:
+        # The periodic schedule picks the message up on its next run.
+        logger.warning("Could not queue outbox delivery: %s", error)
+
+
+async def send_batch(
+    notifications: list[Notification], deadline: float = None
+) -> list:
+    """Send the messages over one bot session, returning errors or None."""
+    bot = make_bot()
+    try:
+        sender = RateLimitedSender(bot, deadline=deadline)
+        return await asyncio.gather(
+            *(
+                sender.send(notification.telegram_id, notification.text)
+                for notification in notifications
+            )
+        )
+    finally:
+        await bot.session.close()
+
+
+def claim_batch(batch_size: int) -> list[Notification]:
+    """
+    Lease a batch of due rows in a short transaction. The lease moves
+    available_at past OUTBOX_LEASE, so other workers skip the rows while
+    they are being sent, and a worker that dies mid-batch only delays
+    them. SKIP LOCKED keeps concurrent claims apart.
+    """
+    with transaction.atomic():
+        batch = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=Notification.Status.PENDING,
+                available_at__lte=timezone.now(),
+            )
+            .order_by("available_at", "id")[:batch_size]
+        )
+        if batch:
+            Notification.objects.filter(
+                id__in=[notification.id for notification in batch]
+            ).update(available_at=timezone.now() + OUTBOX_LEASE)
+    return batch
+
+
+def deliver_pending(
+    batch_size: int = OUTBOX_BATCH_SIZE,
+    run_seconds: float = OUTBOX_RUN_SECONDS,
+) -> int:
+    """
+    Drain due outbox rows in batches for at most `run_seconds`. Each
+    batch is claimed with a lease, sent outside any transaction and then
+    marked sent or rescheduled, so no row lock or transaction is held
+    across the Telegram calls. Messages not sent in time are handed back
+    at once for the next run. Returns the number of delivered messages.
+    """
+    deadline = time.monotonic() + run_seconds
+    delivered = 0
+    while time.monotonic() < deadline:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+        errors = asyncio.run(send_batch(batch, deadline))
+        now = timezone.now()
+        sent_ids, unsent_ids = [], []
+        for notification, error in zip(batch, errors):
+            if error is None:
+                sent_ids.append(notification.id)
+            elif isinstance(error, SendDeadlinePassed):
+                unsent_ids.append(notification.id)
+            else:
+                _schedule_retry(notification, error, now)
+        Notification.objects.filter(id__in=sent_ids).update(
+            status=Notification.Status.SENT,
+            sent_at=now,
+            attempts=F("attempts") + 1,
+        )
+        Notification.objects.filter(id__in=unsent_ids).update(available_at=now)
+        delivered += len(sent_ids)
+        if unsent_ids:
+            break
+    return delivered
+
+
+def _schedule_retry(notification: Notification, error: Exception, now):
+    notification.attempts += 1
+    notification.last_error = str(error)
+    if notification.attempts >= OUTBOX_MAX_ATTEMPTS:
+        notification.status = Notification.Status.FAILED
+    elif isinstance(error, TelegramRetryAfter):
+        notification.available_at = now + timedelta(seconds=error.retry_after)
+    else:
+        notification.available_at = now + OUTBOX_RETRY_DELAY * 2 ** (
+            notification.attempts - 1
+        )
+    notification.save(
+        update_fields=["attempts", "last_error", "status", "available_at"]
+    )
+
+
+def outbox_metrics() -> dict:
+    """Queue depth and delivery lag of the outbox."""
+    now = timezone.now()
+    pending = Notification.objects.filter(
+        status=Notification.Status.PENDING
+    ).aggregate(depth=Count("id"), oldest=Min("created_at"))
+    sent = Notification.objects.filter(
+        status=Notification.Status.SENT, sent_at__gte=now - timedelta(hours=1)
+    ).aggregate(
+        count=Count("id"),
+        lag_avg=Avg(F("sent_at") - F("created_at")),
+        lag_max=Max(F("sent_at") - F("created_at")),
+    )
+    return {
+        "queue_depth": pending["depth"],
+        "oldest_pending_age_seconds": (
+            (now - pending["oldest"]).total_seconds()
+            if pending["oldest"]
+            else 0
+        ),
+        "sent_last_hour": sent["count"],
+        "delivery_lag_avg_seconds": (
+            sent["lag_avg"].total_seconds() if sent["lag_avg"] else 0
+        ),
+        "delivery_lag_max_seconds": (
+            sent["lag_max"].total_seconds() if sent["lag_max"] else 0
+        ),
+        "failed": Notification.objects.filter(
+            status=Notification.Status.FAILED
+        ).count(),
+    }
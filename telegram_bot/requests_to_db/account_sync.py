@@ -1,15 +1,15 @@
-from asgiref.sync import sync_to_async
-
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
 
+from telegram_bot.requests_to_db.db import database_sync_to_async
+
 
-@sync_to_async
+@database_sync_to_async
 def check_user_sync(user_id: int) -> bool:
     return get_user_model().objects.filter(telegram_id=user_id).exists()
 
 
-@sync_to_async
+@database_sync_to_async
 def try_synchronize_accounts(data: dict, telegram_id: int) -> bool:
     try:
         user = get_user_model().objects.get(email=data["email"])
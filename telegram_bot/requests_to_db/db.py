@@ -0,0 +1,33 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+def close_old_connections() -> None:
+    """
+    django.db.close_old_connections, except that a connection inside an
+    atomic block (a test case) is left alone.
+    """
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def database_sync_to_async(func):
+    """
+    sync_to_async for ORM calls from the bot. The bot never finishes a
+    request, so connections that outlived CONN_MAX_AGE or broke are
+    closed, or returned to the pool, before and after every call, as
+    Django does around a request.
+    """
+
+    @wraps(func)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run)
@@ -1,12 +1,11 @@
-from asgiref.sync import sync_to_async
-
 from django.utils import timezone
 from django.views.generic.dates import timezone_today
 
 from borrowing.models import Borrowing
+from telegram_bot.requests_to_db.db import database_sync_to_async
 
 
-@sync_to_async
+@database_sync_to_async
 def get_borrowings(user_id: int, is_overdue: bool = False) -> list[dict]:
     if is_overdue:
         return list(
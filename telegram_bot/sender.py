@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Iterable
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second per bot and one message
+# per second per chat.
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+SEND_CONCURRENCY = 20
+SEND_MAX_RETRIES = 3
+TELEGRAM_MESSAGE_LIMIT = 4096
+SHARED_RATE_KEY = "telegram:send"
+
+
+def make_bot(token: str = None) -> Bot:
+    """Bot with a pooled session, pointed at TELEGRAM_API_URL if set."""
+    if settings.TELEGRAM_API_URL:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL),
+            limit=SEND_CONCURRENCY,
+        )
+    else:
+        session = AiohttpSession(limit=SEND_CONCURRENCY)
+    return Bot(token=token or settings.TELEGRAM_BOT_TOKEN, session=session)
+
+
+def split_message(
+    lines: Iterable[str], limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> list[str]:
+    """
+    Join lines into as few messages as fit Telegram's length limit,
+    breaking between lines and cutting only lines that are too long alone.
+    """
+    messages = []
+    current = ""
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class TokenBucket:
+    """Async token bucket refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds` seconds."""
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class SharedRateLimit:
+    """
+    Send rate shared by every process through the cache. Time is cut into
+    slots of 1 / rate seconds and each message claims a free slot with an
+    atomic add, so the cluster as a whole sends at most `rate` messages a
+    second. Without the cache only the limits of the process apply.
+    """
+
+    def __init__(self, rate: float, key: str = SHARED_RATE_KEY):
+        self.rate = rate
+        self.key = key
+        self.next_slot = 0
+        self.cache_failed = False
+
+    def _claim_slot(self) -> int:
+        now = time.time()
+        slot = max(math.ceil(now * self.rate), self.next_slot)
+        paused_until = cache.get(f"{self.key}:paused")
+        if paused_until:
+            slot = max(slot, math.ceil(paused_until * self.rate))
+        # Keep the claim until its slot has passed.
+        while not cache.add(
+            f"{self.key}:{slot}", 1, math.ceil(slot / self.rate - now) + 10
+        ):
+            slot += 1
+        self.next_slot = slot + 1
+        return slot
+
+    def _cache_error(self, error: Exception) -> None:
+        if not self.cache_failed:
+            self.cache_failed = True
+            logger.warning("Shared send rate is unavailable: %s", error)
+
+    async def acquire(self) -> None:
+        try:
+            slot = self._claim_slot()
+        except Exception as error:
+            self._cache_error(error)
+            return
+        delay = slot / self.rate - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Give no process a slot for the next `seconds` seconds."""
+        try:
+            cache.set(
+                f"{self.key}:paused",
+                time.time() + seconds,
+                math.ceil(seconds) + 1,
+            )
+        except Exception as error:
+            self._cache_error(error)
+
+
+class SendDeadlinePassed(Exception):
+    """The message was not sent because the sender's deadline passed."""
+
+
+class RateLimitedSender:
+    """
+    Sends messages over one bot session with bounded concurrency, a global
+    and a per-chat token bucket, and Telegram's retry_after respected.
+
+    The global bucket limits this sender; the shared rate limits all
+    senders of the cluster together. Messages still waiting for their
+    turn when the monotonic `deadline` passes are not sent.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = SEND_CONCURRENCY,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        shared_rate: float = TELEGRAM_GLOBAL_RATE,
+        deadline: float = None,
+    ):
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # A capacity of one spaces sends evenly instead of allowing a
+        # burst on top of the steady rate within the same second.
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.shared_limit = SharedRateLimit(shared_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.deadline = deadline
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return self.chat_buckets[chat_id]
+
+    async def send(self, chat_id: int, text: str) -> Exception | None:
+        """Send one message. Returns None on success, else the error."""
+        async with self.semaphore:
+            for attempt in range(SEND_MAX_RETRIES + 1):
+                await self._chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+                await self.shared_limit.acquire()
+                if self.deadline is not None and (
+                    time.monotonic() >= self.deadline
+                ):
+                    return SendDeadlinePassed()
+                try:
+                    await self.bot.send_message(chat_id, text)
+                    return None
+                except TelegramRetryAfter as error:
+                    # Flood control applies to the whole bot, so every
+                    # sender waits, not only this one.
+                    self.global_bucket.pause(error.retry_after)
+                    self.shared_limit.pause(error.retry_after)
+                    if attempt == SEND_MAX_RETRIES:
+                        return error
+                except Exception as error:
+                    logger.warning(
+                        "Message to %s was not sent: %s", chat_id, error
+                    )
+                    return error
+
+
+async def send_messages(
+    messages: Iterable[tuple[int, str]], bot: Bot = None, **limits
+) -> int:
+    """
+    Send (chat_id, text) pairs through one RateLimitedSender on one event
+    loop. Returns the number of delivered messages.
+    """
+    own_bot = bot is None
+    bot = bot or make_bot()
+    try:
+        sender = RateLimitedSender(bot, **limits)
+        errors = await asyncio.gather(
+            *(sender.send(chat_id, text) for chat_id, text in messages)
+        )
+    finally:
+        if own_bot:
+            await bot.session.close()
+    return sum(error is None for error in errors)
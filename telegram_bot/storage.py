@@ -0,0 +1,68 @@
+"""
+aiogram FSM storage in the Django cache.
+
+Every bot process, the polling one or any webhook replica, reads and
+writes the same Redis, so a conversation such as the Reg.email ->
+Reg.password registration keeps its state when the next update lands on
+another process. aiogram's own RedisStorage needs redis-py 5
+(redis.asyncio), while django-q 1.3 pins redis<4.
+"""
+
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+from django.core.cache import caches
+
+# An abandoned conversation is forgotten after a day.
+FSM_TTL = 24 * 60 * 60
+
+
+class CacheStorage(BaseStorage):
+    def __init__(
+        self,
+        alias: str = "default",
+        ttl: int = FSM_TTL,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.alias = alias
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_destiny=True
+        )
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    async def set_state(self, key: StorageKey, state: StateType = None):
+        cache_key = self.key_builder.build(key, "state")
+        if isinstance(state, State):
+            state = state.state
+        if state is None:
+            await self.cache.adelete(cache_key)
+        else:
+            await self.cache.aset(cache_key, state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.cache.aget(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]):
+        cache_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.cache.adelete(cache_key)
+        else:
+            await self.cache.aset(cache_key, dict(data), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self.cache.aget(self.key_builder.build(key, "data"))
+        return dict(data or {})
+
+    async def close(self) -> None:
+        pass
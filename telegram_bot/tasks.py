@@ -7,11 +7,25 @@ from datetime import timedelta
 
 
 def create_scheduled_task():
-    Schedule.objects.create(
-        func="telegram_bot.tasks.find_expired_and_send_message",
-        next_run=timezone.now() + timedelta(seconds=30),
-        schedule_type=Schedule.DAILY,
-        repeats=-1,
+    # Every bot replica runs this on start, so only create what is missing.
+    # The payment and borrowing schedules come with their migrations.
+    Schedule.objects.get_or_create(
+        name="notify overdue borrowings",
+        defaults={
+            "func": "telegram_bot.tasks.find_expired_and_send_message",
+            "next_run": timezone.now() + timedelta(seconds=30),
+            "schedule_type": Schedule.DAILY,
+            "repeats": -1,
+        },
+    )
+    Schedule.objects.update_or_create(
+        name="deliver telegram outbox",
+        defaults={
+            "func": "telegram_bot.outbox.deliver_pending",
+            "schedule_type": Schedule.MINUTES,
+            "minutes": 1,
+            "repeats": -1,
+        },
     )
 
 
@@ -1,13 +1,31 @@
+import importlib
 import unittest
 import asyncio
+import threading
+import time
 from datetime import timedelta
 
 from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import connection, transaction
 from django.db.models.signals import post_save
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from django_q.models import Schedule
 from unittest.mock import AsyncMock, patch, MagicMock, call
+from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram import Dispatcher, Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiogram import Dispatcher, Bot, Router
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram.exceptions import TelegramRetryAfter
 import os
 import django
 from django.contrib.auth import get_user_model
@@ -15,18 +33,42 @@ from django.views.generic.dates import timezone_today
 from book.models import Book
 from borrowing.models import Borrowing
 from borrowing.signals import borrowing_created
+from telegram_bot.fake_api import FakeBotAPI
+from telegram_bot.models import Notification
 from telegram_bot.notifications import (
-    send_created,
-    run_send_created,
-    message_expired,
-    message_no_expired,
+    created_text,
+    NO_EXPIRED_TEXT,
+    OVERDUE_USERS_PER_TASK,
+    expired_text,
+    overdue_digest,
+    overdue_messages,
     run_messages_expired,
+    send_overdue_range,
+    user_id_ranges,
+)
+from telegram_bot.outbox import (
+    OUTBOX_LEASE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RUN_SECONDS,
+    claim_batch,
+    deliver_pending,
+    outbox_metrics,
+)
+from telegram_bot.sender import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_MESSAGE_LIMIT,
+    RateLimitedSender,
+    SendDeadlinePassed,
+    SharedRateLimit,
+    send_messages,
+    split_message,
 )
 from telegram_bot.requests_to_db.get_borrowings import get_borrowings
 from user.models import User
 from telegram_bot.handlers import start_handler
-from telegram_bot.bot import main
+from telegram_bot.bot import DEFAULT_WEBHOOK_PATH, main, webhook_app
 from telegram_bot.handlers.start_handler import (
+    all_borrowings,
     cmd_start,
     stage_two,
     stage_three,
@@ -40,10 +82,13 @@ from telegram_bot.requests_to_db.account_sync import (
     try_synchronize_accounts,
 )
 from telegram_bot.handlers.start_handler import Reg
+from telegram_bot.storage import CacheStorage
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "books_rent_config.settings")
 django.setup()
 
+WEBHOOK_SECRET = "webhook-secret"
+
 
 class TestTelegramBot(unittest.IsolatedAsyncioTestCase):
     """
@@ -156,7 +201,11 @@ class TestStartHandler(unittest.IsolatedAsyncioTestCase):
 
         await stage_three(self.message, self.state)
 
-        self.state.update_data.assert_called_once_with(password="password123")
+        self.state.update_data.assert_not_called()
+        mock_try_synchronize_accounts.assert_called_once_with(
+            {"email": "test@test.com", "password": "password123"},
+            telegram_id=self.message.from_user.id,
+        )
         self.state.clear.assert_called_once()
         self.message.answer.assert_called_once_with(
             "accounts have synchronize successfully, "
@@ -175,15 +224,57 @@ class TestStartHandler(unittest.IsolatedAsyncioTestCase):
 
         await stage_three(self.message, self.state)
 
-        self.state.update_data.assert_called_once_with(
-            password="wrong_password"
-        )
+        self.state.update_data.assert_not_called()
         self.state.clear.assert_called_once()
         self.message.answer.assert_called_once_with(
             "You input wrong email or/and password, please push '/start'"
             " and try again"
         )
 
+    @patch(
+        "telegram_bot.handlers.start_handler.try_synchronize_accounts",
+        new_callable=AsyncMock,
+    )
+    async def test_stage_three_clears_state_on_error(
+        self, mock_try_synchronize_accounts
+    ):
+        """The state is cleared even if the synchronization fails"""
+        self.message.text = "password123"
+        self.state.get_data.return_value = {"email": "test@test.com"}
+        mock_try_synchronize_accounts.side_effect = RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            await stage_three(self.message, self.state)
+
+        self.state.clear.assert_called_once()
+        self.message.answer.assert_not_called()
+
+
+    @patch(
+        "telegram_bot.handlers.start_handler.get_borrowings",
+        new_callable=AsyncMock,
+    )
+    async def test_borrowings_are_answered_in_one_message(
+        self, mock_get_borrowings
+    ):
+        """All borrowings fit into a single answer"""
+        mock_get_borrowings.return_value = [
+            {
+                "book__title": f"Book {i}",
+                "book__daily_fee": 1,
+                "borrow_date": timezone_today() - timedelta(days=2),
+                "expected_return_date": timezone_today(),
+            }
+            for i in range(3)
+        ]
+
+        await all_borrowings(self.message)
+
+        self.message.answer.assert_called_once()
+        text = self.message.answer.call_args.args[0]
+        self.assertEqual(text.count("\n"), 2)
+        self.assertIn("Book 2, is taken 2 days ago", text)
+
 
 class TestKeyboards(unittest.TestCase):
     """Tests for Keyboards functions."""
@@ -250,6 +341,17 @@ class TestAccountSync(TestCase):
         result = await check_user_sync(self.user_1.telegram_id + 100)
         self.assertFalse(result)
 
+    async def test_old_connections_are_closed_around_the_query(self):
+        """
+        Tests if stale connections are closed before and after every
+        database call of the bot, as Django does around a request.
+        """
+        with patch(
+            "telegram_bot.requests_to_db.db.close_old_connections"
+        ) as close_old_connections:
+            await check_user_sync(self.user_1.telegram_id)
+        self.assertEqual(close_old_connections.call_count, 2)
+
     async def test_add_telegram_id_and_return_true_if_credentials_correct(
         self,
     ):
@@ -446,16 +548,7 @@ class TestNotifications(TestCase):
             self.book_2,
         ) = sample_bd()
 
-    @patch(
-        "telegram_bot.notifications.bot.session.close", new_callable=AsyncMock
-    )
-    @patch(
-        "telegram_bot.notifications.bot.send_message", new_callable=AsyncMock
-    )
-    async def test_send_created(self, mock_send_message, mock_close):
-        await send_created(
-            telegram_id=self.user.telegram_id, borrowing=self.borrowing
-        )
+    def test_created_text(self):
         amount = (
             self.borrowing.book.daily_fee
             * (timezone_today() - self.borrowing.borrow_date).days
@@ -467,65 +560,17 @@ class TestNotifications(TestCase):
             f"today accrued the cost of rolling"
             f" {amount} $"
         )
-        mock_send_message.assert_called_once_with(
-            self.user.telegram_id, expected_message
-        )
-        mock_close.assert_called_once()
-
-    @patch("telegram_bot.notifications.send_created")
-    def test_run_send_created(self, mock_send_created):
-        telegram_id = 123456
-        run_send_created(telegram_id, self.borrowing)
-        mock_send_created.assert_called_once_with(telegram_id, self.borrowing)
+        self.assertEqual(created_text(self.borrowing), expected_message)
 
-    @patch(
-        "telegram_bot.notifications.bot.session.close", new_callable=AsyncMock
-    )
-    @patch(
-        "telegram_bot.notifications.bot.send_message", new_callable=AsyncMock
-    )
-    async def test_run_messages_expired(self, mock_send_message, mock_close):
-        telegram_id = 123456
-        expired_days = 3
-        await message_expired(
-            telegram_id=telegram_id,
-            book_title=self.book_1.title,
-            expired_days=expired_days,
-        )
+    def test_expired_text(self):
         expected_message = (
             f"Your rented book {self.book_1.title} is overdue for "
-            f"{expired_days} days, please return the book as soon as possible"
-        )
-
-        mock_send_message.assert_called_once_with(
-            telegram_id, expected_message
+            f"3 days, please return the book as soon as possible"
         )
-        mock_close.assert_called_once()
+        self.assertEqual(expired_text(self.book_1.title, 3), expected_message)
 
-    @patch(
-        "telegram_bot.notifications.bot.session.close", new_callable=AsyncMock
-    )
-    @patch(
-        "telegram_bot.notifications.bot.send_message", new_callable=AsyncMock
-    )
-    async def test_message_no_expired(self, mock_send_message, mock_close):
-        telegram_id = 123456
-        expected_message = "No borrowings overdue today!"
-        await message_no_expired(telegram_id=telegram_id)
-        mock_send_message.assert_called_once_with(
-            telegram_id, expected_message
-        )
-        mock_close.assert_called_once()
-
-    @patch(
-        "telegram_bot.notifications.message_no_expired", new_callable=AsyncMock
-    )
-    @patch(
-        "telegram_bot.notifications.message_expired", new_callable=AsyncMock
-    )
-    def test_run_message_expired(
-        self, mock_message_expired, mock_message_no_expired
-    ):
+    @patch("telegram_bot.notifications.send_messages", new_callable=AsyncMock)
+    def test_send_overdue_range(self, mock_send_messages):
         telegram_id = 88888
         get_user_model().objects.create_user(
             email="<EMAIL_3>", password="<PASSWORD>", telegram_id=telegram_id
@@ -536,25 +581,468 @@ class TestNotifications(TestCase):
         expired_days_2 = (
             timezone_today() - self.overdue_borrow_user_2.expected_return_date
         ).days
-        run_messages_expired()
-        mock_message_expired.assert_has_calls(
+        user_ids = get_user_model().objects.values_list("id", flat=True)
+        mock_send_messages.return_value = 3
+        with self.assertLogs("telegram_bot.notifications", "INFO") as logs:
+            send_overdue_range(min(user_ids), max(user_ids))
+        self.assertIn("sent: 3 of 3", logs.output[-1])
+        mock_send_messages.assert_called_once()
+        messages = mock_send_messages.call_args.args[0]
+        self.assertCountEqual(
+            messages,
             [
-                call(
-                    telegram_id=self.user.telegram_id,
-                    book_title=self.book_2.title,
-                    expired_days=expired_days_1,
+                (
+                    self.user.telegram_id,
+                    expired_text(self.book_2.title, expired_days_1),
                 ),
-                call(
-                    telegram_id=self.user_2.telegram_id,
-                    book_title=self.book_2.title,
-                    expired_days=expired_days_2,
+                (
+                    self.user_2.telegram_id,
+                    expired_text(self.book_2.title, expired_days_2),
                 ),
+                (telegram_id, NO_EXPIRED_TEXT),
             ],
-            any_order=True,
         )
-        mock_message_no_expired.assert_has_calls(
+
+    def test_overdue_borrowings_are_sent_as_one_digest(self):
+        self.borrowing.borrow_date = timezone_today() - timedelta(days=5)
+        self.borrowing.expected_return_date = timezone_today() - timedelta(
+            days=1
+        )
+        self.borrowing.save()
+        messages = list(overdue_messages(self.user.id, self.user.id))
+        self.assertEqual(len(messages), 1)
+        telegram_id, text = messages[0]
+        self.assertEqual(telegram_id, self.user.telegram_id)
+        self.assertIn("You have 2 overdue books", text)
+        self.assertIn(f"- {self.book_1.title}: overdue for 1 days", text)
+        self.assertIn(f"- {self.book_2.title}: overdue for 2 days", text)
+
+        messages = list(
+            overdue_messages(self.user.id, self.user.id, digest=False)
+        )
+        self.assertEqual(len(messages), 2)
+
+    def test_long_digest_is_split(self):
+        titles = [f"Book {i:04}" for i in range(500)]
+        texts = overdue_digest(titles, [1] * len(titles))
+        self.assertGreater(len(texts), 1)
+        self.assertTrue(
+            all(len(text) <= TELEGRAM_MESSAGE_LIMIT for text in texts)
+        )
+        self.assertEqual("\n".join(texts).count("overdue for"), len(titles))
+
+    def test_user_id_ranges(self):
+        for i in range(3):
+            get_user_model().objects.create_user(
+                email=f"<RANGE_{i}>", password="<PASSWORD>"
+            )
+        user_ids = list(
+            get_user_model()
+            .objects.order_by("id")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(
+            list(user_id_ranges(size=2)),
+            [
+                (user_ids[0], user_ids[1]),
+                (user_ids[2], user_ids[3]),
+                (user_ids[4], user_ids[4]),
+            ],
+        )
+
+    def test_overdue_range_is_sent_within_the_task_timeout(self):
+        """A full range at the slowest per-task rate beats the timeout"""
+        slowest_rate = TELEGRAM_GLOBAL_RATE / settings.Q_CLUSTER["workers"]
+        self.assertLess(
+            OVERDUE_USERS_PER_TASK / slowest_rate,
+            settings.Q_CLUSTER["timeout"],
+        )
+
+    @patch("telegram_bot.notifications.OVERDUE_USERS_PER_TASK", 1)
+    @patch("telegram_bot.notifications.async_task")
+    def test_run_message_expired_fans_out(self, mock_async_task):
+        run_messages_expired()
+        self.assertEqual(
+            mock_async_task.call_args_list,
             [
-                call(telegram_id=telegram_id),
+                call(
+                    "telegram_bot.notifications.send_overdue_range",
+                    user.id,
+                    user.id,
+                    TELEGRAM_GLOBAL_RATE / 2,
+                    True,
+                )
+                for user in (self.user, self.user_2)
             ],
-            any_order=True,
         )
+
+
+class TestRateLimitedSender(unittest.IsolatedAsyncioTestCase):
+    """Tests for the rate-limited Telegram sender"""
+
+    async def test_retry_after_pauses_and_retries(self):
+        bot = AsyncMock()
+        bot.send_message.side_effect = [
+            TelegramRetryAfter(MagicMock(), "Too Many Requests", 0),
+            None,
+        ]
+        sender = RateLimitedSender(bot, chat_rate=1000)
+        self.assertIsNone(await sender.send(1, "text"))
+        self.assertEqual(bot.send_message.await_count, 2)
+
+    async def test_other_errors_are_returned(self):
+        bot = AsyncMock()
+        error = RuntimeError("telegram is down")
+        bot.send_message.side_effect = error
+        sender = RateLimitedSender(bot)
+        self.assertIs(await sender.send(1, "text"), error)
+        bot.send_message.assert_awaited_once()
+
+    async def test_send_through_fake_bot_api(self):
+        api = FakeBotAPI(latency=0, chat_rate=1)
+        url = await api.start()
+        try:
+            with override_settings(
+                TELEGRAM_API_URL=url, TELEGRAM_BOT_TOKEN="42:test"
+            ):
+                sent = await send_messages(
+                    [(1, "first"), (2, "second")], chat_rate=1000
+                )
+        finally:
+            await api.stop()
+        self.assertEqual(sent, 2)
+        self.assertEqual(api.sent, 2)
+
+    def test_shared_rate_gives_every_sender_its_own_slot(self):
+        first = SharedRateLimit(rate=10, key="test:send")
+        second = SharedRateLimit(rate=10, key="test:send")
+        slots = [
+            limit._claim_slot() for limit in (first, second, first, second)
+        ]
+        self.assertEqual(slots, list(range(slots[0], slots[0] + 4)))
+
+        first.pause(60)
+        self.assertGreaterEqual(second._claim_slot() / 10, time.time() + 59)
+
+    async def test_sender_stops_at_its_deadline(self):
+        bot = AsyncMock()
+        sender = RateLimitedSender(bot, deadline=time.monotonic())
+        self.assertIsInstance(await sender.send(1, "text"), SendDeadlinePassed)
+        bot.send_message.assert_not_awaited()
+
+    def test_split_message(self):
+        self.assertEqual(
+            split_message(["aaa", "bbb", "ccc"], limit=7),
+            ["aaa\nbbb", "ccc"],
+        )
+        self.assertEqual(
+            split_message(["a", "bbbbbbbbbb"], limit=4),
+            ["a", "bbbb", "bbbb", "bb"],
+        )
+
+    async def test_messages_to_one_chat_are_spaced(self):
+        bot = AsyncMock()
+        started = time.monotonic()
+        sent = await send_messages(
+            [(1, "first"), (1, "second"), (2, "other")],
+            bot=bot,
+            chat_rate=10,
+        )
+        self.assertEqual(sent, 3)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        bot.session.close.assert_not_awaited()
+
+
+class TestOutbox(TestCase):
+    """Tests for the transactional Telegram outbox"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="<OUTBOX>", password="<PASSWORD>", telegram_id=77777
+        )
+        self.book = sample_book()
+
+    @patch("telegram_bot.outbox.async_task")
+    def test_borrowing_is_announced_through_outbox(self, mock_async_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            borrowing = Borrowing.objects.create(
+                expected_return_date=timezone_today() + timedelta(days=1),
+                book=self.book,
+                user=self.user,
+            )
+        notification = Notification.objects.get()
+        self.assertEqual(notification.telegram_id, self.user.telegram_id)
+        self.assertEqual(notification.text, created_text(borrowing))
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        mock_async_task.assert_called_once_with(
+            "telegram_bot.outbox.deliver_pending"
+        )
+
+    @patch("telegram_bot.outbox.async_task")
+    def test_outbox_row_rolls_back_with_borrowing(self, mock_async_task):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Borrowing.objects.create(
+                    expected_return_date=timezone_today() + timedelta(days=1),
+                    book=self.book,
+                    user=self.user,
+                )
+                raise RuntimeError
+        self.assertFalse(Notification.objects.exists())
+        mock_async_task.assert_not_called()
+
+    @patch("telegram_bot.outbox.send_batch", new_callable=AsyncMock)
+    def test_deliver_pending_sends_in_batches(self, mock_send_batch):
+        mock_send_batch.side_effect = lambda batch, deadline: [None] * len(
+            batch
+        )
+        Notification.objects.bulk_create(
+            Notification(telegram_id=index, text="hi") for index in range(5)
+        )
+        self.assertEqual(deliver_pending(batch_size=2), 5)
+        self.assertEqual(mock_send_batch.call_count, 3)
+        self.assertFalse(
+            Notification.objects.exclude(
+                status=Notification.Status.SENT
+            ).exists()
+        )
+
+    @patch("telegram_bot.outbox.send_batch", new_callable=AsyncMock)
+    def test_failed_delivery_is_retried_later(self, mock_send_batch):
+        mock_send_batch.return_value = [RuntimeError("telegram is down")]
+        notification = Notification.objects.create(telegram_id=1, text="hi")
+        self.assertEqual(deliver_pending(), 0)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.last_error, "telegram is down")
+        self.assertGreater(notification.available_at, timezone.now())
+
+        Notification.objects.filter(id=notification.id).update(
+            attempts=OUTBOX_MAX_ATTEMPTS - 1, available_at=timezone.now()
+        )
+        deliver_pending()
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, Notification.Status.FAILED)
+
+    @patch("telegram_bot.outbox.send_batch", new_callable=AsyncMock)
+    def test_messages_past_the_deadline_are_handed_back(self, mock_send_batch):
+        sent, unsent = Notification.objects.bulk_create(
+            Notification(telegram_id=index, text="hi") for index in range(2)
+        )
+        mock_send_batch.return_value = [None, SendDeadlinePassed()]
+        self.assertEqual(deliver_pending(), 1)
+        unsent.refresh_from_db()
+        self.assertEqual(unsent.status, Notification.Status.PENDING)
+        self.assertEqual(unsent.attempts, 0)
+        self.assertLessEqual(unsent.available_at, timezone.now())
+
+    @patch("telegram_bot.outbox.send_batch", new_callable=AsyncMock)
+    def test_run_stops_at_its_time_budget(self, mock_send_batch):
+        Notification.objects.create(telegram_id=1, text="hi")
+        self.assertEqual(deliver_pending(run_seconds=0), 0)
+        mock_send_batch.assert_not_called()
+
+    def test_run_time_budget_is_within_the_task_timeout(self):
+        self.assertLess(OUTBOX_RUN_SECONDS, settings.Q_CLUSTER["timeout"])
+
+    def test_claimed_batch_is_leased_to_one_worker(self):
+        Notification.objects.bulk_create(
+            Notification(telegram_id=index, text="hi") for index in range(3)
+        )
+        self.assertEqual(len(claim_batch(2)), 2)
+        self.assertEqual(len(claim_batch(2)), 1)
+        self.assertEqual(claim_batch(2), [])
+        self.assertFalse(
+            Notification.objects.filter(
+                available_at__lte=timezone.now() + OUTBOX_LEASE / 2
+            ).exists()
+        )
+
+    def test_outbox_metrics(self):
+        Notification.objects.create(telegram_id=1, text="pending")
+        Notification.objects.create(
+            telegram_id=2,
+            text="sent",
+            status=Notification.Status.SENT,
+            sent_at=timezone.now() + timedelta(seconds=5),
+        )
+        metrics = outbox_metrics()
+        self.assertEqual(metrics["queue_depth"], 1)
+        self.assertEqual(metrics["sent_last_hour"], 1)
+        self.assertGreater(metrics["delivery_lag_avg_seconds"], 4)
+        self.assertEqual(metrics["failed"], 0)
+
+
+class TestScheduleMigration(TestCase):
+    def test_unnamed_overdue_schedules_are_removed(self):
+        migration = importlib.import_module(
+            "telegram_bot.migrations.0002_remove_unnamed_overdue_schedules"
+        )
+        for name in (None, "", "notify overdue borrowings"):
+            Schedule.objects.create(
+                name=name,
+                func=migration.OVERDUE_FUNC,
+                schedule_type=Schedule.DAILY,
+            )
+        migration.remove_unnamed_schedules(django_apps, None)
+        self.assertEqual(
+            list(
+                Schedule.objects.filter(
+                    func=migration.OVERDUE_FUNC
+                ).values_list("name", flat=True)
+            ),
+            ["notify overdue borrowings"],
+        )
+
+
+class TestOutboxRate(TransactionTestCase):
+    """Concurrent outbox runs in separate workers"""
+
+    def test_concurrent_runs_share_the_global_rate(self):
+        Notification.objects.bulk_create(
+            Notification(telegram_id=index, text="hi") for index in range(40)
+        )
+        sent_at = []
+        bot = AsyncMock()
+        bot.send_message.side_effect = lambda *args: sent_at.append(
+            time.monotonic()
+        )
+        barrier = threading.Barrier(2)
+        delivered = []
+
+        def worker():
+            barrier.wait()
+            try:
+                delivered.append(deliver_pending(batch_size=20))
+            finally:
+                connection.close()
+
+        with patch("telegram_bot.outbox.make_bot", return_value=bot):
+            workers = [threading.Thread(target=worker) for _ in range(2)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+        self.assertEqual(delivered, [20, 20])
+        sent_at.sort()
+        # No second holds more than TELEGRAM_GLOBAL_RATE sends, give or
+        # take the timer resolution.
+        for first, last in zip(sent_at, sent_at[TELEGRAM_GLOBAL_RATE:]):
+            self.assertGreater(last - first, 0.9)
+
+
+class TestCacheStorage(SimpleTestCase):
+    """FSM state kept in the shared cache."""
+
+    def setUp(self):
+        self.key = StorageKey(bot_id=42, chat_id=7, user_id=7)
+
+    async def test_state_and_data_round_trip(self):
+        storage = CacheStorage()
+        await storage.set_state(self.key, Reg.email)
+        await storage.update_data(self.key, {"email": "user@example.com"})
+
+        self.assertEqual(await storage.get_state(self.key), Reg.email.state)
+        self.assertEqual(
+            await storage.get_data(self.key), {"email": "user@example.com"}
+        )
+        other = StorageKey(bot_id=42, chat_id=8, user_id=8)
+        self.assertIsNone(await storage.get_state(other))
+
+        await storage.set_state(self.key, None)
+        await storage.set_data(self.key, {})
+        self.assertIsNone(await storage.get_state(self.key))
+        self.assertEqual(await storage.get_data(self.key), {})
+
+    async def test_registration_survives_a_process_hop(self):
+        """
+        Tests if the password step finds the email entered through
+        another process, which has its own storage object.
+        """
+        message = AsyncMock()
+        message.from_user.id = 7
+        message.text = "user@example.com"
+        await stage_two(message, FSMContext(CacheStorage(), self.key))
+
+        state = FSMContext(CacheStorage(), self.key)
+        self.assertEqual(await state.get_state(), Reg.password.state)
+        message.text = "password"
+        with patch(
+            "telegram_bot.handlers.start_handler.try_synchronize_accounts",
+            new_callable=AsyncMock,
+            return_value=True,
+        ) as synchronize:
+            await stage_three(message, state)
+
+        synchronize.assert_awaited_once_with(
+            {"email": "user@example.com", "password": "password"},
+            telegram_id=7,
+        )
+        self.assertIsNone(await state.get_state())
+
+
+@override_settings(
+    TELEGRAM_WEBHOOK_SECRET=WEBHOOK_SECRET, TELEGRAM_WEBHOOK_URL=None
+)
+class TestWebhookApp(SimpleTestCase):
+    """Updates served over the webhook."""
+
+    update = {
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "Reader"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+    def setUp(self):
+        router = Router()
+
+        @router.message(CommandStart())
+        async def start(message, state: FSMContext):
+            await state.set_state(Reg.email)
+
+        dispatcher = Dispatcher(storage=CacheStorage())
+        dispatcher.include_router(router)
+        self.app = webhook_app(dispatcher, Bot(token="42:test"))
+        self.key = StorageKey(bot_id=42, chat_id=7, user_id=7)
+
+    async def post_update(self, secret: str):
+        async with TestClient(TestServer(self.app)) as client:
+            response = await client.post(
+                DEFAULT_WEBHOOK_PATH,
+                json=self.update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+            )
+            # Updates are handled in the background after the answer.
+            for _ in range(50):
+                if await CacheStorage().get_state(self.key):
+                    break
+                await asyncio.sleep(0.01)
+            return response.status
+
+    async def test_update_with_secret_is_handled(self):
+        self.assertEqual(await self.post_update(WEBHOOK_SECRET), 200)
+        self.assertEqual(
+            await CacheStorage().get_state(self.key), Reg.email.state
+        )
+
+    async def test_update_without_secret_is_rejected(self):
+        self.assertEqual(await self.post_update("wrong"), 401)
+        self.assertIsNone(await CacheStorage().get_state(self.key))
+
+    async def test_health(self):
+        async with TestClient(TestServer(self.app)) as client:
+            response = await client.get("/health/")
+            self.assertEqual(response.status, 200)
+
+    @override_settings(TELEGRAM_WEBHOOK_SECRET=None)
+    def test_secret_is_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            webhook_app(Dispatcher(), Bot(token="42:test"))
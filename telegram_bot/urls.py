@@ -0,0 +1,14 @@
+from django.urls import path
+
+from telegram_bot.views import OutboxMetricsView
+
+
+app_name = "notifications"
+
+urlpatterns = [
+    path(
+        "outbox/metrics/",
+        OutboxMetricsView.as_view(),
+        name="outbox-metrics",
+    ),
+]
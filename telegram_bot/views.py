@@ -0,0 +1,19 @@
+from drf_spectacular.utils import extend_schema
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from telegram_bot.outbox import outbox_metrics
+
+
+class OutboxMetricsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(
+        description=(
+            "Telegram outbox queue depth, age of the oldest pending "
+            "message and delivery lag over the last hour."
+        )
+    )
+    def get(self, request):
+        return Response(outbox_metrics())
@@ -0,0 +1,40 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+)
+from rest_framework_simplejwt.settings import api_settings
+
+from user.cache import get_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that takes the user from the user cache instead of
+    reading the users table on every request.
+    """
+
+    def get_user(self, validated_token):
+        if (
+            api_settings.CHECK_REVOKE_TOKEN
+            or api_settings.USER_ID_FIELD != "id"
+        ):
+            # These need columns the snapshot does not keep.
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            )
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(
+                _("User not found"), code="user_not_found"
+            )
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(
+                _("User is inactive"), code="user_inactive"
+            )
+        return user
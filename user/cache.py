@@ -0,0 +1,143 @@
+"""
+Two-tier cache of the user snapshot that authentication needs.
+
+A small in-process LRU answers most requests without any I/O. Behind it
+the shared cache keeps the snapshot for every worker, and only a miss in
+both reads the users table. Saving or deleting a user drops the snapshot
+from the shared cache and from this process; other processes may serve
+their local copy for up to LOCAL_CACHE_TIMEOUT seconds longer.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TIMEOUT = 300
+LOCAL_CACHE_TIMEOUT = 10
+LOCAL_CACHE_SIZE = 1024
+
+# Enough for permission checks and the /users/me/ profile; any other
+# field is deferred and loaded on first access.
+SNAPSHOT_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "is_staff",
+    "is_active",
+    "telegram_id",
+)
+
+
+class LocalCache:
+    """Thread-safe LRU with a time to live, private to the process."""
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TIMEOUT)
+
+
+def _key(user_id) -> str:
+    return f"user:{user_id}:snapshot"
+
+
+def _load(user_id):
+    try:
+        snapshot = cache.get(_key(user_id))
+    except Exception as error:
+        logger.warning("User cache is unavailable: %s", error)
+        snapshot = None
+    if snapshot is None:
+        snapshot = (
+            get_user_model()
+            .objects.filter(pk=user_id)
+            .values_list(*SNAPSHOT_FIELDS)
+            .first()
+        )
+        if snapshot is None:
+            return None
+        try:
+            cache.set(_key(user_id), snapshot, USER_CACHE_TIMEOUT)
+        except Exception as error:
+            logger.warning("User cache is unavailable: %s", error)
+    return snapshot
+
+
+def get_user(user_id):
+    """
+    The user as a model instance with only SNAPSHOT_FIELDS loaded, or
+    None if there is no such user. Saving it writes the loaded fields
+    only, like any instance from .only().
+    """
+    snapshot = local_cache.get(user_id)
+    if snapshot is None:
+        snapshot = _load(user_id)
+        if snapshot is None:
+            return None
+        local_cache.set(user_id, snapshot)
+    user_model = get_user_model()
+    values = dict(zip(SNAPSHOT_FIELDS, snapshot))
+    fields = [
+        field.attname
+        for field in user_model._meta.concrete_fields
+        if field.attname in values
+    ]
+    return user_model.from_db(
+        DEFAULT_DB_ALIAS, fields, [values[name] for name in fields]
+    )
+
+
+def invalidate_user(user_id) -> None:
+    """
+    Drop the user's snapshot now and again once the transaction commits,
+    so a request that read the old row meanwhile can not keep it cached.
+    """
+
+    def drop():
+        local_cache.delete(user_id)
+        try:
+            cache.delete(_key(user_id))
+        except Exception as error:
+            logger.warning("User cache invalidation failed: %s", error)
+
+    drop()
+    transaction.on_commit(drop)
@@ -5,6 +5,10 @@ from django.contrib.auth.hashers import check_password
 from rest_framework.test import APIClient
 from rest_framework.reverse import reverse
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from books_rent_config.testing import QueryBudgetMixin
+from user.cache import local_cache
 
 User = get_user_model()
 
@@ -127,3 +131,62 @@ class UsersAPIEndpointTests(TestCase):
         self.assertTrue(
             check_password(user_data["password"], user_from_db.password)
         )
+
+
+class QueryBudget(QueryBudgetMixin, TestCase):
+    def test_me(self):
+        user = User.objects.create_user(
+            email="budget@example.com", password="password"
+        )
+
+        def add_users(count):
+            User.objects.bulk_create(
+                User(email=f"budget{User.objects.count()}-{i}@example.com")
+                for i in range(count)
+            )
+
+        # At most the authentication query, on a cold user cache.
+        self.assertQueryBudget(URL_ME, 1, add_users, user=user)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="cached@example.com", password="password"
+        )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZE=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+
+    def test_me_is_served_from_cache(self):
+        self.client.get(URL_ME)
+        with self.assertNumQueries(0):
+            response = self.client.get(URL_ME)
+        self.assertEqual(response.data["email"], self.user.email)
+
+    def test_shared_cache_backs_local_cache(self):
+        self.client.get(URL_ME)
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.client.get(URL_ME)
+
+    def test_saving_user_invalidates_cache(self):
+        self.client.get(URL_ME)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertTrue(self.client.get(URL_ME).data["is_staff"])
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(URL_ME)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_update_through_cached_user_keeps_other_fields(self):
+        self.client.get(URL_ME)
+        response = self.client.patch(URL_ME, {"first_name": "Kate"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Kate")
+        self.assertTrue(self.user.check_password("password"))
+        self.assertEqual(self.client.get(URL_ME).data["first_name"], "Kate")
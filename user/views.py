@@ -17,4 +17,5 @@ class UserMeView(generics.RetrieveUpdateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
-        return self.queryset.get(id=self.request.user.id)
+        # The authentication backend has already loaded the user.
+        return self.request.user